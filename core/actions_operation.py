@@ -0,0 +1,337 @@
+# ================================
+# core/actions_operation.py - Actions courantes de la fiche opération
+# ================================
+#
+# Accepter / refuser un devis, enregistrer ou confirmer un paiement,
+# changer le statut, enregistrer les commentaires. Chaque action est
+# une fonction (operation, user, donnees) partagée par deux points
+# d'entrée :
+#
+# - operation_detail (POST classique) : message + redirection
+# - ajax_action_operation (JSON) : seuls les fragments modifiés (statut,
+#   totaux, nouvelles lignes d'historique, carte du devis ou ligne de
+#   paiement), sans reconstruire la fiche.
+
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .facturation import emettre_facture
+from .models import Operation, Devis, Echeance, HistoriqueOperation
+
+
+class ActionOperationError(Exception):
+    """Action refusée : message pour l'utilisateur, statut HTTP pour la réponse JSON"""
+
+    def __init__(self, message, statut=400):
+        super().__init__(message)
+        self.message = message
+        self.statut = statut
+
+
+def resultat(niveau, message, historique=(), **objets):
+    """
+    Résultat d'une action : niveau du message (success, warning), entrées
+    d'historique créées par l'action et objets modifiés
+    """
+    return {'niveau': niveau, 'message': message, 'historique': list(historique), **objets}
+
+
+def historiser(operation, user, action):
+    return HistoriqueOperation.objects.create(operation=operation, action=action, utilisateur=user)
+
+
+# ========================================
+# DEVIS
+# ========================================
+
+def devis_de(operation, donnees):
+    """Devis de l'opération désigné par donnees['devis_id'] (devis.operation = operation)"""
+    try:
+        return operation.devis_set.get(id=donnees.get('devis_id'))
+    except (Devis.DoesNotExist, ValueError):
+        raise ActionOperationError("❌ Devis introuvable", statut=404)
+
+
+def accepter_devis(operation, user, donnees):
+    devis = devis_de(operation, donnees)
+
+    # Date de réponse = aujourd'hui
+    devis.date_reponse = timezone.now().date()
+    devis.statut = 'accepte'
+    devis.save()
+
+    # Changer le statut de l'opération si besoin
+    if operation.statut == 'en_attente_devis':
+        # ✅ Déjà un passage planifié : "planifie", sinon "a_planifier"
+        passage_planifie = operation.passages.filter(
+            date_prevue__isnull=False,
+            realise=False
+        ).exists()
+        operation.statut = 'planifie' if passage_planifie else 'a_planifier'
+        operation.save()
+
+    # Calculer délai de réponse
+    if devis.date_envoi and devis.date_reponse:
+        delai = (devis.date_reponse - devis.date_envoi).days
+        delai_texte = f" - Délai : {delai} jour{'s' if delai > 1 else ''}"
+    else:
+        delai_texte = ""
+
+    entree = historiser(
+        operation, user,
+        f"✅ Devis {devis.numero_devis} accepté par le client{delai_texte} - Montant : {devis.total_ttc}€ TTC"
+    )
+    return resultat(
+        'success', f"✅ Devis {devis.numero_devis} accepté le {devis.date_reponse.strftime('%d/%m/%Y')} !",
+        historique=[entree], devis=devis
+    )
+
+
+def refuser_devis(operation, user, donnees):
+    devis = devis_de(operation, donnees)
+
+    devis.date_reponse = timezone.now().date()
+    devis.statut = 'refuse'
+    devis.save()
+
+    entree = historiser(
+        operation, user,
+        f"❌ Devis {devis.numero_devis} refusé par le client - Montant : {devis.total_ttc}€ TTC"
+    )
+    return resultat(
+        'warning', f"❌ Devis {devis.numero_devis} marqué comme refusé.", historique=[entree], devis=devis
+    )
+
+
+# ========================================
+# PAIEMENTS
+# ========================================
+# Les échéances sont lues par operation.echeances : echeance.operation est
+# l'instance chargée, dont echeance.save() met à jour l'état financier
+# (montant_encaisse / montant_planifie) sans relecture.
+
+def echeance_de(operation, donnees, introuvable):
+    try:
+        return operation.echeances.get(id=donnees.get('echeance_id'))
+    except (Echeance.DoesNotExist, ValueError):
+        raise ActionOperationError(introuvable, statut=404)
+
+
+def marquer_paye_echeance(operation, user, donnees):
+    echeance = echeance_de(operation, donnees, "Échéance introuvable")
+    echeance.paye = True
+    echeance.save()
+
+    # Toutes les échéances payées : l'opération est soldée
+    if not operation.echeances.filter(paye=False).exists():
+        operation.statut = 'paye'
+        operation.save()
+        entree = historiser(
+            operation, user,
+            f"Échéance {echeance.numero} marquée comme payée - Toutes les échéances sont payées"
+        )
+        return resultat(
+            'success', "Échéance marquée comme payée. Toutes les échéances sont réglées !",
+            historique=[entree], echeance=echeance
+        )
+
+    entree = historiser(operation, user, f"Échéance {echeance.numero} marquée comme payée")
+    return resultat('success', "Échéance marquée comme payée", historique=[entree], echeance=echeance)
+
+
+def add_paiement(operation, user, donnees):
+    montant_str = donnees.get('montant', '')
+    date_paiement_str = donnees.get('date_paiement', '')
+    if not (montant_str and date_paiement_str):
+        raise ActionOperationError("Montant et date du paiement obligatoires")
+
+    try:
+        montant = Decimal(montant_str)
+        date_paiement = datetime.strptime(date_paiement_str, '%Y-%m-%d').date()
+    except (InvalidOperation, ValueError, TypeError) as e:
+        raise ActionOperationError(f"Données invalides : {e}")
+    paye = donnees.get('paye', 'false') == 'true'
+    generer_facture_auto = donnees.get('generer_facture_auto') == 'true'
+
+    # ✅ VÉRIFICATION : total planifié stocké sur l'opération
+    nouveau_total = operation.montant_planifie + montant
+    if nouveau_total > operation.montant_total:
+        depassement = nouveau_total - operation.montant_total
+        raise ActionOperationError(
+            f"❌ Dépassement de {depassement:.2f}€ ! "
+            f"Total avec ce paiement : {nouveau_total:.2f}€ / Montant opération : {operation.montant_total:.2f}€"
+        )
+
+    facture_generee = False
+    historique = []
+    with transaction.atomic():
+        # Auto-générer le numéro et l'ordre
+        derniers = operation.echeances.aggregate(
+            max_numero=Max('numero'),
+            max_ordre=Max('ordre'),
+        )
+
+        # Créer l'échéance (met à jour operation.montant_encaisse / montant_planifie)
+        echeance = Echeance.objects.create(
+            operation=operation,
+            numero=(derniers['max_numero'] or 0) + 1,
+            montant=montant,
+            date_echeance=date_paiement,
+            paye=paye,
+            ordre=(derniers['max_ordre'] or 0) + 1
+        )
+
+        statut_txt = "payé" if paye else "prévu"
+        historique.append(historiser(
+            operation, user, f"💰 Paiement {statut_txt} : {montant}€ le {date_paiement.strftime('%d/%m/%Y')}"
+        ))
+
+        # ✅ GÉNÉRATION AUTOMATIQUE DE FACTURE SI PAYÉ
+        if paye and generer_facture_auto:
+            emettre_facture(echeance, user, operation=operation, automatique=True, historique=historique)
+            facture_generee = True
+
+    facture_txt = f" + Facture {echeance.numero_facture} générée" if facture_generee else ""
+
+    # Vérifier si tout est payé
+    if operation.montant_encaisse >= operation.montant_total:
+        operation.statut = 'paye'
+        operation.save()
+        if facture_generee:
+            message = f"✅ Paiement de {montant}€ enregistré{facture_txt} - Opération soldée ! 🎉"
+        else:
+            message = "✅ Paiement enregistré - Opération soldée ! 🎉"
+    else:
+        message = f"✅ Paiement de {montant}€ enregistré{facture_txt}"
+    return resultat('success', message, historique=historique, echeance=echeance)
+
+
+def marquer_paye(operation, user, donnees):
+    echeance = echeance_de(operation, donnees, "Paiement introuvable")
+
+    historique = []
+    with transaction.atomic():
+        echeance.paye = True
+        echeance.save()
+
+        # ✅ GÉNÉRATION AUTOMATIQUE DE FACTURE
+        if not echeance.facture_generee:
+            emettre_facture(echeance, user, operation=operation, automatique=True, historique=historique)
+
+    # Vérifier si tout est payé (état financier recalculé par echeance.save())
+    if operation.montant_encaisse >= operation.montant_total:
+        operation.statut = 'paye'
+        operation.save()
+        historique.append(historiser(
+            operation, user,
+            f"✅ Paiement de {echeance.montant}€ confirmé + Facture {echeance.numero_facture} - Opération soldée ! 🎉"
+        ))
+        return resultat(
+            'success', f"🎉 Paiement confirmé + Facture {echeance.numero_facture} générée - Opération soldée !",
+            historique=historique, echeance=echeance
+        )
+
+    historique.append(historiser(
+        operation, user, f"✅ Paiement de {echeance.montant}€ confirmé + Facture {echeance.numero_facture}"
+    ))
+    return resultat(
+        'success', f"✅ Paiement de {echeance.montant}€ confirmé + Facture {echeance.numero_facture} générée",
+        historique=historique, echeance=echeance
+    )
+
+
+# ========================================
+# STATUT ET COMMENTAIRES
+# ========================================
+
+def lire_date_heure(valeur):
+    """Date-heure d'un champ datetime-local ('2025-01-31T14:30'), None si absente ou invalide"""
+    if not valeur:
+        return None
+    try:
+        return datetime.fromisoformat(valeur.replace('T', ' '))
+    except ValueError:
+        return None
+
+
+def change_status(operation, user, donnees):
+    nouveau_statut = donnees.get('statut')
+    if nouveau_statut not in dict(Operation.STATUTS):
+        raise ActionOperationError("Statut invalide")
+
+    ancien_statut = operation.get_statut_display()
+    operation.statut = nouveau_statut
+
+    date_prevue = lire_date_heure(donnees.get('date_prevue', ''))
+    date_realisation = lire_date_heure(donnees.get('date_realisation', ''))
+    date_paiement = lire_date_heure(donnees.get('date_paiement', ''))
+
+    if nouveau_statut == 'planifie' and date_prevue:
+        operation.date_prevue = date_prevue
+    elif nouveau_statut == 'realise' and date_realisation:
+        operation.date_realisation = date_realisation
+    elif nouveau_statut == 'paye':
+        if date_realisation:
+            operation.date_realisation = date_realisation
+        if date_paiement:
+            operation.date_paiement = date_paiement
+
+    operation.save()
+
+    entree = historiser(operation, user, f"Statut changé : {ancien_statut} → {operation.get_statut_display()}")
+    return resultat('success', f"Statut mis à jour : {operation.get_statut_display()}", historique=[entree])
+
+
+def update_commentaires(operation, user, donnees):
+    operation.commentaires = donnees.get('commentaires', '').strip()
+    operation.save()
+
+    entree = historiser(operation, user, "Commentaires mis à jour")
+    return resultat('success', "Commentaires enregistrés avec succès", historique=[entree])
+
+
+ACTIONS_OPERATION = {
+    'accepter_devis': accepter_devis,
+    'refuser_devis': refuser_devis,
+    'marquer_paye_echeance': marquer_paye_echeance,
+    'add_paiement': add_paiement,
+    'marquer_paye': marquer_paye,
+    'change_status': change_status,
+    'update_commentaires': update_commentaires,
+}
+
+
+# ========================================
+# TOTAUX DES PAIEMENTS
+# ========================================
+
+def totaux_paiements(montant_total, totaux):
+    """
+    Totaux de la section paiements de la fiche, à partir des sommes
+    d'échéances (payees, prevues, tout) : mêmes clés que le contexte
+    de operation_detail.
+    """
+    reste_a_enregistrer = montant_total - totaux['tout']
+    return {
+        'montant_total': montant_total,
+        'total_echeances': totaux['payees'],
+        'total_echeances_prevus': totaux['prevues'],
+        'total_echeances_tout': totaux['tout'],
+        'reste_a_payer': montant_total - totaux['payees'],
+        'reste_a_enregistrer': reste_a_enregistrer,
+        'reste_a_enregistrer_abs': abs(reste_a_enregistrer),
+        'max_paiement': reste_a_enregistrer if reste_a_enregistrer > 0 else montant_total,
+    }
+
+
+def totaux_stockes(operation):
+    """Sommes d'échéances lues sur l'état financier stocké (aucune requête)"""
+    return {
+        'payees': operation.montant_encaisse,
+        'prevues': operation.montant_planifie - operation.montant_encaisse,
+        'tout': operation.montant_planifie,
+    }
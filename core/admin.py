@@ -7,7 +7,8 @@ from .models import (
     Intervention, 
     HistoriqueOperation, 
     Echeance,
-    ProfilEntreprise
+    ProfilEntreprise,
+    SequenceNumerotation,
 )
 
 @admin.register(Client)
@@ -159,6 +160,18 @@ class EcheanceAdmin(admin.ModelAdmin):
     readonly_fields = ['facture_generee', 'numero_facture', 'facture_date_emission']
 
 
+# ========================================
+# ADMIN SÉQUENCES DE NUMÉROTATION
+# ========================================
+@admin.register(SequenceNumerotation)
+class SequenceNumerotationAdmin(admin.ModelAdmin):
+    list_display = ['user', 'type_document', 'annee', 'dernier_numero']
+    list_filter = ['type_document', 'annee']
+    search_fields = ['user__username']
+    # Modifiée uniquement par l'allocation (ou la commande initialiser_sequences)
+    readonly_fields = ['user', 'annee', 'type_document', 'dernier_numero']
+
+
 # ========================================
 # ADMIN HISTORIQUE (CONSERVÉ)
 # ========================================
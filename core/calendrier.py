@@ -0,0 +1,167 @@
+# ================================
+# core/calendrier.py - Événements du calendrier (passages)
+# ================================
+#
+# Construit les événements du calendrier à partir d'UNE requête sur les
+# passages : opération et client en select_related, retards de paiement
+# de l'opération en sous-requêtes annotées (plus de requêtes par passage).
+# L'API calendrier les sert en colonnes, avec ETag / Last-Modified calculés
+# par une requête d'agrégat sur la même fenêtre.
+
+import hashlib
+
+from django.db.models import Q, Sum, Max, Count, OuterRef, Subquery, IntegerField
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .compteurs import MONTANT_FIELD, ZERO
+from .dates import jour_local, q_jours
+from .models import Echeance, PassageOperation
+
+
+def passages_calendrier(user, start_date, end_date, now=None):
+    """
+    Passages datés (prévus ou réalisés) entre start_date et end_date inclus,
+    annotés avec les retards de paiement de leur opération :
+
+    - nb_retards : nombre d'échéances impayées échues
+    - montant_retard : montant total de ces échéances
+    """
+    now = now or timezone.now()
+
+    retards = Echeance.objects.filter(
+        operation=OuterRef('operation'),
+        paye=False,
+        date_echeance__lt=jour_local(now)
+    ).order_by().values('operation')
+
+    return PassageOperation.objects.filter(
+        operation__user=user
+    ).filter(
+        q_jours('date_prevue', start_date, end_date) |
+        q_jours('date_realisation', start_date, end_date)
+    ).select_related(
+        'operation', 'operation__client'
+    ).annotate(
+        nb_retards=Coalesce(
+            Subquery(retards.annotate(nb=Count('pk')).values('nb'), output_field=IntegerField()),
+            0
+        ),
+        montant_retard=Coalesce(
+            Subquery(retards.annotate(total=Sum('montant')).values('total'), output_field=MONTANT_FIELD),
+            ZERO
+        ),
+    )
+
+
+# Ordre des colonnes de la réponse JSON de l'API calendrier
+COLONNES_EVENEMENT = (
+    'id', 'passage_id', 'client_nom', 'service', 'date', 'time', 'address',
+    'phone', 'url', 'statut', 'statut_display', 'color_class', 'is_past',
+    'commentaires', 'has_retard_paiement', 'nb_retards', 'montant_retard',
+)
+
+
+def statut_passage(passage, now):
+    """(statut brut pour le JS, libellé, classe CSS) d'un passage"""
+    en_retard = passage.date_prevue is not None and not passage.realise and passage.date_prevue < now
+
+    if passage.realise:
+        # Si passage réalisé mais opération pas payée
+        if passage.operation.statut == 'paye':
+            return 'realise', "Payé", 'event-paye'
+        return 'realise', "Réalisé", 'event-realise'
+    if en_retard:
+        # Passage prévu dans le passé mais pas réalisé
+        return 'a_traiter', "À traiter (en retard)", 'event-a-traiter'
+    if passage.date_prevue is not None:
+        # Passage planifié dans le futur
+        return 'planifie', "Planifié", 'event-planifie'
+    # Passage sans date prévue
+    return 'a_planifier', "À planifier", 'event-default'
+
+
+def evenement_calendrier(passage, now):
+    """Dictionnaire d'un événement, à partir d'un passage de passages_calendrier()"""
+    op = passage.operation
+
+    # ✅ Utiliser date_prevue du PASSAGE en priorité
+    date_affichage = passage.date_prevue or passage.date_realisation or now
+    statut_brut, status_text, color_class = statut_passage(passage, now)
+
+    return {
+        'id': op.id,
+        'passage_id': passage.id,
+        'client_nom': f"{op.client.nom} {op.client.prenom}",
+        'service': f"{op.type_prestation} - Passage #{passage.numero}",
+        'date': date_affichage.strftime('%Y-%m-%d'),
+        'time': date_affichage.strftime('%H:%M'),
+        'address': op.adresse_intervention,
+        'phone': op.client.telephone,
+        'url': f'/operations/{op.id}/',
+        'statut': statut_brut,  # ✅ Valeur brute pour JS
+        'statut_display': status_text,  # ✅ Texte pour affichage
+        'color_class': color_class,
+        'is_past': date_affichage < now,
+        'commentaires': passage.commentaire or op.commentaires or '',
+        'has_retard_paiement': passage.nb_retards > 0,
+        'nb_retards': passage.nb_retards,
+        'montant_retard': float(passage.montant_retard),
+    }
+
+
+def construire_evenements_calendrier(user, start_date, end_date, now=None):
+    """Événements du calendrier entre deux dates : une seule requête"""
+    now = now or timezone.now()
+    return [
+        evenement_calendrier(passage, now)
+        for passage in passages_calendrier(user, start_date, end_date, now=now)
+    ]
+
+
+def evenements_en_colonnes(evenements):
+    """
+    Format colonnes : {'colonne': [valeur par événement]}. Les clés ne sont
+    écrites qu'une fois au lieu d'une fois par événement.
+    """
+    return {colonne: [evenement[colonne] for evenement in evenements] for colonne in COLONNES_EVENEMENT}
+
+
+def version_calendrier(user, start_date, end_date, now=None):
+    """
+    (etag, last_modified) des événements entre deux dates, en UNE requête
+    d'agrégat, sans construire les événements.
+
+    last_modified : dernier updated_at des passages (ou date_modification
+    de leur opération, ou de son client : nom et téléphone affichés).
+    L'etag y ajoute ce que les dates de modification ne voient pas :
+    passages supprimés (nombre), passages devenus passés avec le temps,
+    retards de paiement des opérations.
+    """
+    now = now or timezone.now()
+
+    stats = passages_calendrier(user, start_date, end_date, now=now).aggregate(
+        nb_passages=Count('pk'),
+        dernier_passage=Max('updated_at'),
+        derniere_operation=Max('operation__date_modification'),
+        dernier_client=Max('operation__client__date_modification'),
+        nb_passes=Count('pk', filter=(
+            Q(date_prevue__lt=now) |
+            Q(date_prevue__isnull=True, date_realisation__lt=now)
+        )),
+        # Alias distincts des annotations (sinon l'agrégat les masque)
+        total_nb_retards=Sum('nb_retards'),
+        total_montant_retard=Sum('montant_retard'),
+    )
+
+    dates = [d for d in (stats['dernier_passage'], stats['derniere_operation'], stats['dernier_client']) if d]
+    last_modified = max(dates) if dates else None
+
+    empreinte = '|'.join(str(valeur) for valeur in (
+        user.pk, start_date, end_date, jour_local(now), stats['nb_passages'],
+        stats['nb_passes'], stats['total_nb_retards'], stats['total_montant_retard'],
+        last_modified and last_modified.isoformat(),
+    ))
+    etag = hashlib.md5(empreinte.encode()).hexdigest()
+
+    return etag, last_modified
@@ -0,0 +1,458 @@
+# ================================
+# core/compteurs.py - Compteurs des onglets calculés en base
+# ================================
+#
+# Chaque opération est classée dans ses catégories (urgences, à faire,
+# en cours, ...) par des expressions SQL annotées (Exists / Subquery /
+# Case). Les compteurs sont ensuite obtenus par un seul aggregate(),
+# quel que soit le nombre d'opérations du compte.
+
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db.models import (
+    Q, F, Sum, Count, Case, When, Value, Exists, OuterRef, Subquery,
+    BooleanField, CharField, DateField, DecimalField, DurationField, ExpressionWrapper,
+)
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .dates import jour_local, q_jours
+from .models import Client, Operation, Devis, Echeance, PassageOperation
+
+
+MONTANT_FIELD = DecimalField(max_digits=14, decimal_places=2)
+ZERO = Value(Decimal('0.00'), output_field=MONTANT_FIELD)
+
+STATUTS_EN_COURS = ['en_attente_devis', 'a_planifier', 'planifie', 'en_cours', 'realise']
+
+
+# ========================================
+# EXPRESSIONS RÉUTILISABLES
+# ========================================
+
+def expr_date_limite_devis():
+    """Date limite de validité d'un devis : date_envoi + validite_jours"""
+    duree = ExpressionWrapper(
+        F('validite_jours') * Value(timedelta(days=1)),
+        output_field=DurationField()
+    )
+    return ExpressionWrapper(F('date_envoi') + duree, output_field=DateField())
+
+
+def q_devis_expire(today, prefix=''):
+    """
+    Équivalent SQL de Devis.est_expire (envoyé, daté, validité non nulle,
+    date limite dépassée). `prefix` permet de l'appliquer via une relation.
+    """
+    return (
+        Q(**{f'{prefix}statut': 'envoye'})
+        & Q(**{f'{prefix}date_envoi__isnull': False})
+        & ~Q(**{f'{prefix}validite_jours': 0})
+        & Q(**{f'{prefix}date_limite__lt': today})
+    )
+
+
+def expr_reste(champ):
+    """Montant total moins un montant stocké (encaissé, planifié), borné à 0"""
+    return Case(
+        When(montant_total__gt=F(champ), then=F('montant_total') - F(champ)),
+        default=ZERO,
+        output_field=MONTANT_FIELD
+    )
+
+
+def _flag(condition):
+    return Case(When(condition, then=Value(True)), default=Value(False), output_field=BooleanField())
+
+
+# ========================================
+# DERNIER DEVIS DE CHAQUE OPÉRATION
+# ========================================
+
+CATEGORIES_DEVIS = ['brouillon', 'pret', 'envoye', 'expire', 'accepte', 'refuse']
+
+
+def annoter_dernier_devis(operations, today=None):
+    """
+    Annote chaque opération avec les informations de son dernier devis
+    (version la plus élevée), calculées en base :
+
+    - dernier_devis_statut : statut du dernier devis (None si aucun devis)
+    - dernier_devis_date_limite : date_envoi + validite_jours
+    - dernier_devis_expire : équivalent de Devis.est_expire
+    - dernier_devis_categorie : statut, avec 'expire' à la place de 'envoye'
+      quand le devis envoyé est expiré (clés des sous-filtres de l'onglet Devis)
+    """
+    today = today or jour_local()
+
+    derniers = Devis.objects.filter(
+        operation=OuterRef('pk')
+    ).annotate(
+        date_limite=expr_date_limite_devis()
+    ).annotate(
+        expire=_flag(q_devis_expire(today))
+    ).order_by('-version')
+
+    operations = operations.annotate(
+        dernier_devis_statut=Subquery(derniers.values('statut')[:1]),
+        dernier_devis_date_limite=Subquery(derniers.values('date_limite')[:1], output_field=DateField()),
+        dernier_devis_expire=Subquery(derniers.values('expire')[:1], output_field=BooleanField()),
+    )
+
+    return operations.annotate(
+        dernier_devis_categorie=Case(
+            When(dernier_devis_expire=True, then=Value('expire')),
+            default=F('dernier_devis_statut'),
+            output_field=CharField()
+        )
+    )
+
+
+# ========================================
+# CLASSEMENT DES OPÉRATIONS
+# ========================================
+
+def annoter_categories(operations, now=None):
+    """
+    Annote chaque opération avec ses catégories d'onglets :
+
+    - est_paiement_retard, est_devis_expire, est_aujourdhui, est_demain, est_urgence
+    - est_paiement_non_planifie, est_a_faire, est_en_cours
+    - est_a_venir, est_a_encaisser, est_a_traiter
+
+    Les règles reprennent à l'identique celles de operations_list.
+    """
+    now = now or timezone.now()
+    today = jour_local(now)
+    demain = today + timedelta(days=1)
+
+    devis_expires = Devis.objects.annotate(
+        date_limite=expr_date_limite_devis()
+    ).filter(q_devis_expire(today), operation=OuterRef('pk'))
+
+    operations = operations.annotate(
+        a_retard_echeance=Exists(
+            Echeance.objects.filter(operation=OuterRef('pk'), paye=False, date_echeance__lt=today)
+        ),
+        a_devis_expire=Exists(devis_expires),
+        a_devis=Exists(Devis.objects.filter(operation=OuterRef('pk'))),
+        a_devis_brouillon=Exists(
+            Devis.objects.filter(operation=OuterRef('pk'), statut='brouillon')
+        ),
+        a_passage_aujourdhui=Exists(
+            PassageOperation.objects.filter(q_jours('date_prevue', today, today), operation=OuterRef('pk'), realise=False)
+        ),
+        a_passage_demain=Exists(
+            PassageOperation.objects.filter(q_jours('date_prevue', demain, demain), operation=OuterRef('pk'), realise=False)
+        ),
+        a_passage_a_venir=Exists(
+            PassageOperation.objects.filter(operation=OuterRef('pk'), date_prevue__gte=now, realise=False)
+        ),
+        a_passage_en_retard=Exists(
+            PassageOperation.objects.filter(operation=OuterRef('pk'), date_prevue__lt=now, realise=False)
+        ),
+    )
+
+    q_paiement_retard = Q(statut='realise', a_retard_echeance=True)
+    q_devis_expire_op = Q(avec_devis=True, a_devis_expire=True)
+    q_aujourdhui = q_jours('date_prevue', today, today) | Q(a_passage_aujourdhui=True)
+    q_demain = q_jours('date_prevue', demain, demain) | Q(a_passage_demain=True)
+    q_urgence = q_paiement_retard | q_devis_expire_op | q_aujourdhui | q_demain
+    # ✅ État financier stocké sur l'opération : plus de sous-requêtes de sommes
+    q_montant_non_nul = ~Q(montant_total=0)
+    q_paiement_non_planifie = (
+        Q(statut='realise') & q_montant_non_nul
+        & Q(montant_planifie__lt=F('montant_total'))
+    )
+
+    return operations.annotate(
+        est_paiement_retard=_flag(q_paiement_retard),
+        est_devis_expire=_flag(q_devis_expire_op),
+        est_aujourdhui=_flag(q_aujourdhui),
+        est_demain=_flag(q_demain),
+        est_urgence=_flag(q_urgence),
+        est_paiement_non_planifie=_flag(q_paiement_non_planifie),
+        est_a_faire=_flag(
+            (Q(statut='a_planifier') | Q(a_devis_brouillon=True) | q_paiement_non_planifie)
+            & ~q_urgence
+        ),
+        est_en_cours=_flag(Q(statut__in=STATUTS_EN_COURS) & ~q_urgence),
+        est_a_venir=_flag(
+            Q(statut='planifie', date_prevue__gte=now) | Q(a_passage_a_venir=True)
+        ),
+        est_a_encaisser=_flag(
+            Q(statut='realise') & q_montant_non_nul
+            & Q(montant_encaisse__lt=F('montant_total'))
+        ),
+        est_a_traiter=_flag(Q(a_passage_en_retard=True)),
+    )
+
+
+def _compte(**filtres):
+    return Count('pk', filter=Q(**filtres))
+
+
+def calculer_compteurs_operations(user, now=None):
+    """
+    Retourne tous les compteurs d'onglets de la page Opérations.
+
+    Deux requêtes au total, quel que soit le volume :
+    - un aggregate() sur les opérations annotées
+    - un aggregate() sur les devis (compteurs historiques comptés par devis)
+    """
+    now = now or timezone.now()
+    today = jour_local(now)
+
+    operations = annoter_categories(Operation.objects.filter(user=user), now=now)
+
+    compteurs = operations.aggregate(
+        nb_total=Count('pk'),
+        nb_paiements_retard=_compte(est_paiement_retard=True),
+        nb_devis_expire=_compte(est_devis_expire=True),
+        nb_aujourdhui=_compte(est_aujourdhui=True),
+        nb_demain=_compte(est_demain=True),
+        nb_urgences=_compte(est_urgence=True),
+        nb_a_planifier=_compte(statut='a_planifier'),
+        nb_devis_brouillon=_compte(a_devis_brouillon=True),
+        nb_operations_sans_paiement=_compte(est_paiement_non_planifie=True),
+        nb_a_faire=_compte(est_a_faire=True),
+        nb_en_cours=_compte(est_en_cours=True),
+        nb_a_venir=_compte(est_a_venir=True),
+        nb_a_encaisser=_compte(est_a_encaisser=True),
+        nb_archivees=_compte(statut='paye'),
+        nb_planifie=_compte(statut='planifie'),
+        nb_realise=_compte(statut='realise'),
+        nb_paye=_compte(statut='paye'),
+        nb_a_traiter=_compte(est_a_traiter=True),
+        nb_sans_devis=_compte(avec_devis=True, a_devis=False),
+    )
+
+    compteurs.update(
+        Devis.objects.filter(operation__user=user).annotate(
+            date_limite=expr_date_limite_devis()
+        ).aggregate(
+            nb_devis_genere_non_envoye=Count('pk', filter=Q(statut='pret')),
+            nb_devis_en_attente=Count('pk', filter=(
+                Q(operation__avec_devis=True, statut='envoye', date_envoi__isnull=False)
+                & ~q_devis_expire(today)
+            )),
+        )
+    )
+
+    return compteurs
+
+
+def calculer_compteurs_devis(operations, today=None):
+    """
+    Compteurs de l'onglet Devis, par OPÉRATION et selon son DERNIER devis.
+    Une seule requête d'agrégation.
+    """
+    operations = annoter_dernier_devis(operations.filter(avec_devis=True), today=today)
+
+    compteurs = operations.aggregate(
+        nb_devis_total=Count('pk', filter=Q(dernier_devis_statut__isnull=False)),
+        **{
+            f'nb_devis_{categorie}': _compte(dernier_devis_categorie=categorie)
+            for categorie in CATEGORIES_DEVIS
+        }
+    )
+    return compteurs
+
+
+# ========================================
+# KPI FINANCIERS
+# ========================================
+
+def calculer_kpi_financiers(user, periode_start, periode_end, today=None):
+    """
+    KPI financiers de la page Opérations, à partir de l'état financier
+    stocké sur les opérations (montant_total, montant_encaisse,
+    montant_planifie). Deux requêtes d'agrégation :
+
+    - ca_encaisse, ca_en_attente_total, ca_non_planifies : opérations
+      réalisées/payées dans la période
+    - ca_previsionnel_30j : opérations planifiées dans les 30 prochains jours
+    - ca_retard : échéances impayées échues des opérations de la période
+    """
+    today = today or jour_local()
+
+    # Jours locaux inclus, bornes comprises (derniers jours entiers)
+    q_periode = Q(statut__in=['realise', 'paye']) & q_jours('date_realisation', periode_start, periode_end)
+    q_previsionnel = Q(statut='planifie') & q_jours('date_prevue', today, today + timedelta(days=30))
+
+    kpi = Operation.objects.filter(user=user).filter(q_periode | q_previsionnel).aggregate(
+        ca_encaisse=Coalesce(Sum('montant_encaisse', filter=q_periode), ZERO),
+        ca_en_attente_total=Coalesce(Sum(expr_reste('montant_encaisse'), filter=q_periode), ZERO),
+        ca_non_planifies=Coalesce(Sum(expr_reste('montant_planifie'), filter=q_periode), ZERO),
+        ca_previsionnel_30j=Coalesce(Sum('montant_total', filter=q_previsionnel), ZERO),
+    )
+
+    kpi.update(
+        Echeance.objects.filter(
+            q_jours('operation__date_realisation', periode_start, periode_end),
+            operation__user=user,
+            operation__statut__in=['realise', 'paye'],
+            paye=False,
+            date_echeance__lt=today,
+        ).aggregate(ca_retard=Coalesce(Sum('montant'), ZERO))
+    )
+
+    return kpi
+
+
+# ========================================
+# KPI DU DASHBOARD
+# ========================================
+
+def calculer_kpi_dashboard(user, now=None):
+    """
+    KPI du dashboard en 4 requêtes d'agrégation, quel que soit le volume :
+
+    - opérations : urgences, interventions du jour, à planifier,
+      à encaisser, réalisées sans paiement planifié
+    - échéances : CA encaissé du mois, nombre de paiements en retard
+    - devis : devis envoyés en attente de réponse (non expirés)
+    - clients : nombre de clients
+
+    Les règles reprennent celles de l'ancien dashboard (urgences :
+    paiement en retard, devis expiré, passage aujourd'hui ou demain).
+    """
+    now = now or timezone.now()
+    today = jour_local(now)
+    demain = today + timedelta(days=1)
+
+    passages_non_realises = PassageOperation.objects.filter(operation=OuterRef('pk'), realise=False)
+    devis_expires = Devis.objects.annotate(
+        date_limite=expr_date_limite_devis()
+    ).filter(q_devis_expire(today), operation=OuterRef('pk'))
+
+    operations = Operation.objects.filter(user=user).annotate(
+        a_retard_echeance=Exists(
+            Echeance.objects.filter(operation=OuterRef('pk'), paye=False, date_echeance__lt=today)
+        ),
+        a_devis_expire=Exists(devis_expires),
+        a_passage_aujourdhui=Exists(passages_non_realises.filter(q_jours('date_prevue', today, today))),
+        a_passage_demain=Exists(passages_non_realises.filter(q_jours('date_prevue', demain, demain))),
+    )
+
+    q_urgence = (
+        Q(statut='realise', a_retard_echeance=True)
+        | Q(avec_devis=True, a_devis_expire=True)
+        | Q(a_passage_aujourdhui=True)
+        | Q(a_passage_demain=True)
+    )
+    q_realise_avec_montant = Q(statut='realise') & ~Q(montant_total=0)
+
+    kpi = operations.aggregate(
+        nb_urgences=Count('pk', filter=q_urgence),
+        nb_aujourdhui=_compte(a_passage_aujourdhui=True),
+        nb_a_planifier=_compte(statut='a_planifier'),
+        nb_a_encaisser=Count('pk', filter=q_realise_avec_montant & Q(montant_encaisse__lt=F('montant_total'))),
+        nb_operations_sans_paiement=Count('pk', filter=Q(statut='realise', montant_planifie__lt=F('montant_total'))),
+    )
+
+    kpi.update(
+        Echeance.objects.filter(operation__user=user).aggregate(
+            ca_mois=Coalesce(
+                Sum('montant', filter=Q(paye=True, date_echeance__gte=today.replace(day=1))),
+                ZERO
+            ),
+            # Nombre d'échéances (et non d'opérations) en retard sur les opérations réalisées
+            nb_paiements_retard=Count('pk', filter=Q(
+                operation__statut='realise', paye=False, date_echeance__lt=today
+            )),
+        )
+    )
+
+    kpi.update(
+        Devis.objects.filter(
+            operation__user=user, operation__avec_devis=True, statut='envoye', date_envoi__isnull=False
+        ).annotate(
+            date_limite=expr_date_limite_devis()
+        ).aggregate(
+            nb_en_attente_devis=Count('pk', filter=~q_devis_expire(today)),
+        )
+    )
+
+    kpi['nb_clients'] = Client.objects.filter(user=user).count()
+
+    return kpi
+
+
+# ========================================
+# LISTE DES CLIENTS
+# ========================================
+
+# Opérations payées ou annulées (devis refusé) : jamais « prochaine opération »
+STATUTS_TERMINES = ['paye', 'devis_refuse']
+
+
+def annoter_clients(clients, now=None):
+    """
+    Annote chaque client avec le résumé de ses opérations, en sous-requêtes
+    corrélées (une seule requête pour toute la page) :
+
+    - derniere_op_type, derniere_op_date : dernière opération créée
+    - prochaine_op_type, prochaine_op_date : prochaine opération datée à
+      venir, hors opérations payées ou annulées
+    - nb_operations : nombre d'opérations
+    - ca_total : somme des montants des opérations payées (comme la fiche client)
+    """
+    now = now or timezone.now()
+
+    operations = Operation.objects.filter(client=OuterRef('pk'))
+    dernieres = operations.order_by('-date_creation')
+    prochaines = operations.filter(
+        date_prevue__isnull=False, date_prevue__gte=now
+    ).exclude(statut__in=STATUTS_TERMINES).order_by('date_prevue')
+    totaux = operations.order_by().values('client')
+
+    return clients.annotate(
+        derniere_op_type=Subquery(dernieres.values('type_prestation')[:1]),
+        derniere_op_date=Subquery(dernieres.values('date_creation')[:1]),
+        prochaine_op_type=Subquery(prochaines.values('type_prestation')[:1]),
+        prochaine_op_date=Subquery(prochaines.values('date_prevue')[:1]),
+        nb_operations=Coalesce(Subquery(totaux.annotate(n=Count('pk')).values('n')), 0),
+        ca_total=Coalesce(
+            Subquery(
+                totaux.filter(statut='paye').annotate(total=Sum('montant_total')).values('total'),
+                output_field=MONTANT_FIELD
+            ),
+            ZERO
+        ),
+    )
+
+
+# ========================================
+# FICHE CLIENT
+# ========================================
+
+# Opérations dont le montant est dû (prestation réalisée)
+STATUTS_FACTURABLES = ['realise', 'paye']
+
+
+def annoter_soldes(operations):
+    """
+    Annote chaque opération avec son solde, à partir de l'état financier
+    stocké : reste_du (montant total - encaissé, borné à 0).
+    """
+    return operations.annotate(reste_du=expr_reste('montant_encaisse'))
+
+
+def calculer_totaux_client(client):
+    """
+    Totaux d'un client en une requête d'agrégation :
+
+    - nb_operations
+    - ca_total : montants des opérations payées
+    - total_encaisse : échéances payées, toutes opérations confondues
+    - reste_a_encaisser : reste dû des opérations réalisées ou payées
+    """
+    q_facturable = Q(statut__in=STATUTS_FACTURABLES)
+    return Operation.objects.filter(client=client).aggregate(
+        nb_operations=Count('pk'),
+        ca_total=Coalesce(Sum('montant_total', filter=Q(statut='paye')), ZERO),
+        total_encaisse=Coalesce(Sum('montant_encaisse'), ZERO),
+        reste_a_encaisser=Coalesce(Sum(expr_reste('montant_encaisse'), filter=q_facturable), ZERO),
+    )
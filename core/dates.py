@@ -0,0 +1,48 @@
+# ================================
+# core/dates.py - Jours locaux -> intervalles de dates-heures
+# ================================
+#
+# Avec USE_TZ, un filtre `date_prevue__date=jour` compare la date locale
+# (Europe/Paris) de chaque ligne : la colonne est convertie puis tronquée,
+# ce qu'aucun index B-tree ne sait servir. Ici, un jour local devient un
+# intervalle semi-ouvert de dates-heures aware :
+#
+#   date_prevue >= minuit du jour  AND  date_prevue < minuit du lendemain
+#
+# comparé directement à la colonne (parcours d'intervalle sur l'index).
+# Les bornes sont calculées dans le fuseau courant : un jour de changement
+# d'heure dure 23 h ou 25 h, pas 24 h.
+
+from datetime import datetime, time, timedelta
+
+from django.db.models import Q
+from django.utils import timezone
+
+
+def jour_local(now=None):
+    """Date du jour dans le fuseau courant (et non la date UTC de now)"""
+    return timezone.localdate(now or timezone.now())
+
+
+def debut_jour(jour):
+    """Minuit (heure locale) d'un jour, en datetime aware"""
+    return timezone.make_aware(datetime.combine(jour, time.min))
+
+
+def intervalle_jours(premier, dernier=None):
+    """(début, fin exclue) des jours locaux premier..dernier inclus"""
+    return debut_jour(premier), debut_jour((dernier or premier) + timedelta(days=1))
+
+
+def q_jours(champ, premier=None, dernier=None):
+    """
+    Q équivalent à `champ__date` entre premier et dernier inclus (bornes
+    optionnelles), exprimé sur la colonne elle-même pour rester indexable.
+    `champ` peut traverser une relation ('passages__date_prevue').
+    """
+    conditions = {}
+    if premier is not None:
+        conditions[f'{champ}__gte'] = debut_jour(premier)
+    if dernier is not None:
+        conditions[f'{champ}__lt'] = debut_jour(dernier + timedelta(days=1))
+    return Q(**conditions)
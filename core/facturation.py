@@ -0,0 +1,94 @@
+# ================================
+# core/facturation.py - Émission des factures d'échéances
+# ================================
+#
+# Point d'entrée unique pour transformer une échéance payée en facture
+# (ajout de paiement, confirmation de paiement, génération manuelle).
+
+from django.db import transaction
+from django.db.models import Q, Sum, Count
+from django.utils import timezone
+
+from .models import Echeance, HistoriqueOperation, SequenceNumerotation
+
+
+LIBELLES_TYPE_FACTURE = {
+    'globale': 'globale',
+    'acompte': "d'acompte",
+    'solde': 'de solde',
+}
+
+
+class FacturationError(Exception):
+    """Échéance qui ne peut pas être facturée (non payée, déjà facturée)"""
+
+
+def determiner_type_facture(echeance, operation):
+    """
+    Type de la facture d'une échéance payée, en un seul aggregate :
+
+    - globale : un seul paiement, unique échéance de l'opération
+    - solde : dernière échéance payée à facturer, et plus rien à enregistrer
+    - acompte : paiement intermédiaire
+    """
+    stats = Echeance.objects.filter(operation_id=echeance.operation_id).aggregate(
+        nb_echeances=Count('pk'),
+        nb_payees=Count('pk', filter=Q(paye=True)),
+        nb_payees_non_facturees=Count('pk', filter=Q(paye=True, facture_generee=False)),
+        total_planifie=Sum('montant'),
+    )
+    reste_non_enregistre = operation.montant_total - (stats['total_planifie'] or 0)
+
+    if stats['nb_payees'] == 1 and stats['nb_echeances'] == 1:
+        return 'globale'
+    if stats['nb_payees_non_facturees'] == 1 and reste_non_enregistre <= 0:
+        return 'solde'
+    return 'acompte'
+
+
+def emettre_facture(echeance, user, operation=None, automatique=False, historique=None):
+    """
+    Émet la facture d'une échéance payée, dans une seule transaction :
+    type de facture, numéro (séquence verrouillée), enregistrement et
+    historique. Si une étape échoue, rien n'est écrit et le numéro
+    n'est pas consommé. L'entrée d'historique créée est ajoutée à la
+    liste `historique` si elle est fournie.
+
+    Retourne l'échéance facturée ; lève FacturationError si l'échéance
+    n'est pas payée ou déjà facturée.
+    """
+    operation = operation or echeance.operation
+
+    if not echeance.paye:
+        raise FacturationError("Le paiement doit être marqué comme payé avant de générer la facture")
+    if echeance.facture_generee:
+        raise FacturationError(f"Facture déjà générée : {echeance.numero_facture}")
+
+    with transaction.atomic():
+        # Ligne verrouillée puis relue : deux confirmations simultanées du même
+        # paiement ne peuvent pas allouer deux numéros (le second écraserait le premier)
+        verrouillee = Echeance.objects.select_for_update().get(pk=echeance.pk)
+        if not verrouillee.paye:
+            raise FacturationError("Le paiement doit être marqué comme payé avant de générer la facture")
+        if verrouillee.facture_generee:
+            raise FacturationError(f"Facture déjà générée : {verrouillee.numero_facture}")
+
+        echeance.facture_type = determiner_type_facture(echeance, operation)
+        echeance.numero_facture = SequenceNumerotation.prochain_numero(user, 'facture')
+        echeance.facture_generee = True
+        echeance.facture_date_emission = timezone.now().date()
+        # Champs facture uniquement : l'état financier de l'opération ne change pas
+        echeance.save(update_fields=[
+            'facture_generee', 'numero_facture', 'facture_date_emission', 'facture_type'
+        ])
+
+        libelle = LIBELLES_TYPE_FACTURE[echeance.facture_type]
+        if automatique:
+            action = f"📄 Facture {libelle} {echeance.numero_facture} générée automatiquement"
+        else:
+            action = f"📄 Facture {libelle} {echeance.numero_facture} générée - Montant : {echeance.montant}€"
+        entree = HistoriqueOperation.objects.create(operation=operation, action=action, utilisateur=user)
+        if historique is not None:
+            historique.append(entree)
+
+    return echeance
@@ -0,0 +1,307 @@
+# ================================
+# core/lignes_devis.py - Édition des lignes d'un devis par lot
+# ================================
+#
+# Une liste ordonnée d'opérations (créer, modifier, supprimer, déplacer)
+# est appliquée en mémoire aux lignes d'un devis brouillon, puis écrite
+# dans une seule transaction : un DELETE, un bulk_create, un bulk_update
+# (ordre compris), un seul recalcul des totaux et une seule entrée
+# d'historique. Coller un devis de 60 lignes coûte un aller-retour.
+#
+# Une nouvelle version de devis peut aussi reprendre toutes les lignes
+# d'une version existante (devis refusé à réviser) en un seul INSERT.
+
+import re
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+
+from .models import Devis, LigneDevis, HistoriqueOperation, arrondir_montant
+from .recherche import normaliser
+
+
+LOT_LIGNES_MAX = 500
+
+CHAMPS_LIGNE = ['description', 'quantite', 'unite', 'prix_unitaire_ht', 'taux_tva']
+
+# Valeurs par défaut d'une ligne créée (comme le formulaire d'ajout)
+DEFAUTS_LIGNE = {'quantite': '1', 'unite': 'forfait', 'taux_tva': '10'}
+
+# Bornes des colonnes décimales (max_digits - decimal_places chiffres entiers)
+BORNES_DECIMALES = {
+    'quantite': Decimal('1e8'),
+    'prix_unitaire_ht': Decimal('1e8'),
+    'taux_tva': Decimal('1e3'),
+    'montant': Decimal('1e8'),
+}
+
+# Unité par code ('m2') ou par libellé normalisé ('m²', 'heure') : collage depuis un tableur
+UNITES = {
+    **{normaliser(libelle): code for code, libelle in LigneDevis.UNITES_CHOICES},
+    **{code: code for code, _ in LigneDevis.UNITES_CHOICES},
+}
+
+
+class LignesDevisError(Exception):
+    """Lot refusé : message pour l'utilisateur, statut HTTP pour la réponse JSON"""
+
+    def __init__(self, message, statut=400):
+        super().__init__(message)
+        self.message = message
+        self.statut = statut
+
+
+# ========================================
+# LECTURE DES OPÉRATIONS
+# ========================================
+
+def lire_decimal(valeur, champ, position):
+    """Décimal arrondi au centime ('1 250,50 €' accepté), borné selon la colonne"""
+    try:
+        texte = re.sub(r'[\s€%]', '', str(valeur)).replace(',', '.')
+        nombre = Decimal(texte)
+    except (InvalidOperation, ValueError):
+        raise LignesDevisError(f"Opération {position} : {champ} invalide")
+    if not nombre.is_finite() or abs(nombre) >= BORNES_DECIMALES[champ]:
+        raise LignesDevisError(f"Opération {position} : {champ} invalide")
+    return arrondir_montant(nombre)
+
+
+def lire_valeurs(donnees, position, creation=False):
+    """
+    Valeurs des champs de ligne présents dans une opération (toutes, avec
+    les valeurs par défaut, pour une création)
+    """
+    if creation:
+        donnees = {**DEFAUTS_LIGNE, **{k: v for k, v in donnees.items() if v not in (None, '')}}
+        if not str(donnees.get('description', '')).strip() or donnees.get('prix_unitaire_ht') is None:
+            raise LignesDevisError(f"Opération {position} : description et prix unitaire HT obligatoires")
+
+    valeurs = {}
+    if 'description' in donnees:
+        valeurs['description'] = str(donnees['description']).strip()
+        if not valeurs['description']:
+            raise LignesDevisError(f"Opération {position} : description vide")
+    if 'unite' in donnees:
+        valeurs['unite'] = UNITES.get(normaliser(donnees['unite']))
+        if valeurs['unite'] is None:
+            raise LignesDevisError(f"Opération {position} : unité inconnue ({donnees['unite']})")
+    for champ in ['quantite', 'prix_unitaire_ht', 'taux_tva']:
+        if champ in donnees:
+            valeurs[champ] = lire_decimal(donnees[champ], champ, position)
+    return valeurs
+
+
+def lire_position(donnees, position):
+    """Position 1-based demandée (None : en fin de devis)"""
+    valeur = donnees.get('position')
+    if valeur in (None, ''):
+        return None
+    try:
+        valeur = int(valeur)
+    except (TypeError, ValueError):
+        valeur = 0
+    if valeur < 1:
+        raise LignesDevisError(f"Opération {position} : position invalide")
+    return valeur
+
+
+def placer(lignes, ligne, rang):
+    """Insère la ligne au rang demandé (1-based), en fin de liste si None ou au-delà"""
+    if rang is None:
+        lignes.append(ligne)
+    else:
+        lignes.insert(rang - 1, ligne)
+
+
+def etat(ligne):
+    return tuple(getattr(ligne, champ) for champ in CHAMPS_LIGNE)
+
+
+# ========================================
+# APPLICATION DU LOT
+# ========================================
+
+def appliquer_lot(operation, devis_id, operations, user):
+    """
+    Applique au devis brouillon `devis_id` de l'opération la liste
+    ordonnée d'opérations, chacune un dict :
+
+    - {'action': 'creer', 'description', 'prix_unitaire_ht', 'quantite',
+       'unite', 'taux_tva', 'position'} (position optionnelle : en fin)
+    - {'action': 'modifier', 'id', <champs à modifier>}
+    - {'action': 'supprimer', 'id'}
+    - {'action': 'deplacer', 'id', 'position'}
+
+    Tout ou rien : la première opération invalide annule le lot. Les
+    lignes sont ensuite renumérotées 1..n dans l'ordre obtenu.
+
+    Retourne (devis, lignes dans l'ordre) ; lève LignesDevisError.
+    """
+    if not isinstance(operations, list) or not operations:
+        raise LignesDevisError("Aucune opération à appliquer")
+    if len(operations) > LOT_LIGNES_MAX:
+        raise LignesDevisError(f"Au plus {LOT_LIGNES_MAX} opérations par envoi")
+
+    with transaction.atomic():
+        # Verrou du devis : deux lots sur le même devis s'appliquent l'un après l'autre
+        try:
+            devis = operation.devis_set.select_for_update().get(id=devis_id)
+        except (Devis.DoesNotExist, ValueError, TypeError):
+            raise LignesDevisError("Devis introuvable", statut=404)
+        if devis.est_verrouille:
+            raise LignesDevisError("Devis verrouillé", statut=403)
+
+        lignes = list(devis.lignes.order_by('ordre', 'pk'))
+        par_id = {ligne.pk: ligne for ligne in lignes}
+        initiales = {ligne.pk: etat(ligne) for ligne in lignes}
+        ordre_initial = [ligne.pk for ligne in lignes]
+        supprimees = []
+
+        for position, donnees in enumerate(operations, start=1):
+            if not isinstance(donnees, dict):
+                raise LignesDevisError(f"Opération {position} : format invalide")
+            action = donnees.get('action')
+
+            if action == 'creer':
+                ligne = LigneDevis(devis=devis, **lire_valeurs(donnees, position, creation=True))
+                placer(lignes, ligne, lire_position(donnees, position))
+                continue
+
+            try:
+                ligne = par_id[int(donnees.get('id'))]
+            except (KeyError, TypeError, ValueError):
+                raise LignesDevisError(f"Opération {position} : ligne introuvable")
+
+            if action == 'modifier':
+                for champ, valeur in lire_valeurs(donnees, position).items():
+                    setattr(ligne, champ, valeur)
+            elif action == 'supprimer':
+                lignes.remove(ligne)
+                del par_id[ligne.pk]
+                supprimees.append(ligne.pk)
+            elif action == 'deplacer':
+                rang = lire_position(donnees, position)
+                if rang is None:
+                    raise LignesDevisError(f"Opération {position} : position obligatoire")
+                lignes.remove(ligne)
+                placer(lignes, ligne, rang)
+            else:
+                raise LignesDevisError(f"Opération {position} : action inconnue ({action})")
+
+        for ligne in lignes:
+            if abs(ligne.quantite * ligne.prix_unitaire_ht) >= BORNES_DECIMALES['montant']:
+                raise LignesDevisError(f"Montant trop élevé : {ligne.description[:50]}")
+
+        # Renumérotation 1..n : seules les lignes dont l'ordre change sont écrites
+        ordres_initiaux = {ligne.pk: ligne.ordre for ligne in lignes if ligne.pk}
+        for ordre, ligne in enumerate(lignes, start=1):
+            ligne.ordre = ordre
+
+        nouvelles = [ligne for ligne in lignes if ligne.pk is None]
+        modifiees = [ligne for ligne in lignes if ligne.pk and etat(ligne) != initiales[ligne.pk]]
+        ids_modifies = {ligne.pk for ligne in modifiees}
+        deplacees = [
+            ligne for ligne in lignes
+            if ligne.pk and ligne.pk not in ids_modifies and ligne.ordre != ordres_initiaux[ligne.pk]
+        ]
+        reordonne = [pk for pk in ordre_initial if pk in par_id] != [l.pk for l in lignes if l.pk]
+
+        if not (nouvelles or modifiees or deplacees or supprimees):
+            return devis, lignes
+
+        # Totaux recalculés une seule fois, après toutes les écritures
+        if supprimees:
+            LigneDevis.objects.filter(pk__in=supprimees).delete(recalculer=False)
+        if nouvelles:
+            LigneDevis.objects.bulk_create(nouvelles, recalculer=False)
+        if modifiees or deplacees:
+            LigneDevis.objects.bulk_update(
+                modifiees + deplacees, CHAMPS_LIGNE + ['ordre'], batch_size=500, recalculer=False
+            )
+        devis.recalculer_totaux()
+
+        details = [
+            texte for nombre, texte in [
+                (len(nouvelles), f"{len(nouvelles)} ajoutée(s)"),
+                (len(modifiees), f"{len(modifiees)} modifiée(s)"),
+                (len(supprimees), f"{len(supprimees)} supprimée(s)"),
+                (reordonne, "ordre modifié"),
+            ] if nombre
+        ]
+        HistoriqueOperation.objects.create(
+            operation=operation,
+            action=f"✏️ Lignes du devis {devis.numero_devis} : {', '.join(details)}",
+            utilisateur=user
+        )
+
+    return devis, lignes
+
+
+# ========================================
+# NOUVELLE VERSION À PARTIR D'UNE AUTRE
+# ========================================
+
+def nouvelle_version(operation, user, source_id=None):
+    """
+    Crée un devis brouillon (version suivante) qui reprend les notes, la
+    validité et toutes les lignes, dans l'ordre, du devis `source_id` de
+    l'opération (par défaut la dernière version) : un bulk_create, un
+    recalcul des totaux et une entrée d'historique, dans une transaction.
+
+    Retourne (source, nouveau devis, nombre de lignes) ; lève LignesDevisError.
+    """
+    with transaction.atomic():
+        versions = operation.devis_set.order_by('-version')
+        try:
+            source = versions.filter(id=source_id).first() if source_id else versions.first()
+        except (ValueError, TypeError):
+            source = None
+        if source is None:
+            raise LignesDevisError("Devis introuvable", statut=404)
+
+        nouveau = Devis.objects.create(
+            operation=operation,
+            statut='brouillon',
+            notes=source.notes,
+            validite_jours=source.validite_jours
+        )
+        lignes = [
+            LigneDevis(devis=nouveau, ordre=ordre, **{champ: getattr(ligne, champ) for champ in CHAMPS_LIGNE})
+            for ordre, ligne in enumerate(source.lignes.order_by('ordre', 'pk'), start=1)
+        ]
+        if lignes:
+            LigneDevis.objects.bulk_create(lignes, batch_size=500, recalculer=False)
+            nouveau.recalculer_totaux()
+
+        HistoriqueOperation.objects.create(
+            operation=operation,
+            action=(
+                f"📄 Nouveau devis créé : {nouveau.numero_devis} (version {nouveau.version}) "
+                f"à partir de {source.numero_devis} - {len(lignes)} ligne(s) reprise(s)"
+            ),
+            utilisateur=user
+        )
+
+    return source, nouveau, len(lignes)
+
+
+# ========================================
+# RÉPONSES JSON
+# ========================================
+
+def ligne_json(ligne):
+    return {
+        'id': ligne.id,
+        'description': ligne.description,
+        'quantite': float(ligne.quantite),
+        'unite': ligne.unite,
+        'unite_display': ligne.get_unite_display(),
+        'prix_unitaire_ht': float(ligne.prix_unitaire_ht),
+        'taux_tva': float(ligne.taux_tva),
+        'montant': float(ligne.montant),
+    }
+
+
+def totaux_json(devis):
+    return {champ: float(getattr(devis, champ)) for champ in Devis.CHAMPS_TOTAUX}
@@ -0,0 +1,47 @@
+import re
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.models import Devis, Echeance, SequenceNumerotation
+
+
+NUMERO_REGEX = re.compile(r'^(?P<prefixe>[A-Z]+)-(?P<annee>\d{4})-U(?P<user_id>\d+)-(?P<numero>\d+)$')
+
+
+class Command(BaseCommand):
+    help = 'Initialise les séquences de numérotation (devis, factures) depuis les numéros existants'
+
+    def handle(self, *args, **options):
+        types_par_prefixe = {prefixe: type_document for type_document, prefixe in SequenceNumerotation.PREFIXES.items()}
+
+        numeros = list(Devis.objects.exclude(numero_devis='').values_list('numero_devis', flat=True))
+        numeros += list(Echeance.objects.filter(numero_facture__isnull=False).values_list('numero_facture', flat=True))
+
+        # Plus grand numéro attribué par (utilisateur, année, type)
+        maximums = {}
+        for numero in numeros:
+            match = NUMERO_REGEX.match(numero)
+            if not match or match['prefixe'] not in types_par_prefixe:
+                continue
+            cle = (int(match['user_id']), int(match['annee']), types_par_prefixe[match['prefixe']])
+            maximums[cle] = max(maximums.get(cle, 0), int(match['numero']))
+
+        nb_crees = nb_avances = 0
+        with transaction.atomic():
+            for (user_id, annee, type_document), maximum in sorted(maximums.items()):
+                sequence, cree = SequenceNumerotation.objects.select_for_update().get_or_create(
+                    user_id=user_id, annee=annee, type_document=type_document,
+                    defaults={'dernier_numero': maximum},
+                )
+                if cree:
+                    nb_crees += 1
+                elif sequence.dernier_numero < maximum:
+                    # Ne jamais faire reculer une séquence
+                    sequence.dernier_numero = maximum
+                    sequence.save(update_fields=['dernier_numero'])
+                    nb_avances += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(maximums)} séquences analysées : {nb_crees} créée(s), {nb_avances} avancée(s)"
+        ))
@@ -0,0 +1,112 @@
+import gc
+import resource
+import time
+import tracemalloc
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+
+from core.management.commands.verifier_plans_requetes import generer_jeu_de_donnees
+
+
+NOM_UTILISATEUR_GENERE = 'mesure_memoire'
+
+
+def pic_rss_ko():
+    """Pic RSS du processus en Ko (VmHWM sous Linux, sinon ru_maxrss)"""
+    try:
+        with open('/proc/self/status') as status:
+            for ligne in status:
+                if ligne.startswith('VmHWM:'):
+                    return int(ligne.split()[1])
+    except OSError:
+        pass
+    # ru_maxrss : kilo-octets sous Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def reinitialiser_pic_rss():
+    """
+    Repart du RSS courant (Linux : 5 dans /proc/self/clear_refs), pour que
+    la génération du jeu ne masque pas le pic de la page. False si non
+    disponible : le pic inclut alors tout ce qui précède.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+        return True
+    except OSError:
+        return False
+
+
+class Command(BaseCommand):
+    help = (
+        "Mesure la mémoire d'une page de liste (pic Python et pic RSS du processus) "
+        "sur un compte généré de --operations opérations (annulé à la fin), ou sur "
+        "un compte existant avec --utilisateur."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--operations', type=int, default=10000,
+            help="Nombre d'opérations du jeu généré (défaut : 10000)",
+        )
+        parser.add_argument(
+            '--utilisateur',
+            help="Mesurer sur ce compte existant au lieu de générer des données",
+        )
+        parser.add_argument('--url', default='/operations/', help='Page à mesurer (défaut : /operations/)')
+        parser.add_argument('--repetitions', type=int, default=3, help='Nombre de requêtes (défaut : 3)')
+
+    def handle(self, *args, **options):
+        # Tout est annulé à la fin : jeu généré compris
+        with transaction.atomic():
+            if options['utilisateur']:
+                try:
+                    user = User.objects.get(username=options['utilisateur'])
+                except User.DoesNotExist:
+                    raise CommandError(f"Utilisateur inconnu : {options['utilisateur']}")
+            else:
+                user = User.objects.create_user(NOM_UTILISATEUR_GENERE)
+                generer_jeu_de_donnees(user, options['operations'])
+                self.stdout.write(f"Jeu généré : {options['operations']} opérations")
+
+            # Les INSERT du jeu saturent le journal des requêtes (9000 entrées) :
+            # CaptureQueriesContext ne compterait plus rien
+            connection.queries_log.clear()
+            gc.collect()
+            if not reinitialiser_pic_rss():
+                self.stdout.write("Pic RSS non réinitialisable : il inclut la génération du jeu")
+            self.mesurer(user, options['url'], options['repetitions'])
+            transaction.set_rollback(True)
+
+    def mesurer(self, user, url, repetitions):
+        vue = resolve(url.split('?')[0]).func
+        factory = RequestFactory()
+
+        rss_depart = pic_rss_ko()
+        for numero in range(1, repetitions + 1):
+            request = factory.get(url)
+            request.user = user
+
+            tracemalloc.start()
+            debut = time.perf_counter()
+            with CaptureQueriesContext(connection) as requetes:
+                response = vue(request)
+                if hasattr(response, 'render'):
+                    response.render()
+            duree = time.perf_counter() - debut
+            _, pic = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            rss = pic_rss_ko()
+            self.stdout.write(
+                f"#{numero} {url} : HTTP {response.status_code}, {len(response.content) / 1024:.0f} Ko, "
+                f"{len(requetes)} requêtes, {duree * 1000:.0f} ms, "
+                f"pic Python {pic / 1024 / 1024:.1f} Mo, pic RSS {rss / 1024:.0f} Mo "
+                f"(+{max(rss - rss_depart, 0) / 1024:.0f} Mo)"
+            )
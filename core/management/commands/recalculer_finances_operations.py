@@ -0,0 +1,43 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import Operation
+
+
+class Command(BaseCommand):
+    help = "Recalcule (ou vérifie) l'état financier stocké des opérations (total, encaissé, planifié)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verifier',
+            action='store_true',
+            help="Vérifie seulement l'état financier, sans le corriger (code de sortie non nul si écart)",
+        )
+
+    def handle(self, *args, **options):
+        verifier = options['verifier']
+
+        nb_operations = 0
+        ecarts = []
+
+        operations = Operation.objects.order_by('pk').only('pk', 'id_operation', 'avec_devis', *Operation.CHAMPS_FINANCIERS)
+        for operation in operations.iterator():
+            nb_operations += 1
+            attendu = operation.calculer_finances()
+            stocke = {champ: getattr(operation, champ) or Decimal('0.00') for champ in Operation.CHAMPS_FINANCIERS}
+
+            if attendu != stocke:
+                ecarts.append(operation.id_operation)
+                self.stdout.write(
+                    f"  {operation.id_operation} : stocké {stocke}, attendu {attendu}"
+                )
+                if not verifier:
+                    Operation.objects.filter(pk=operation.pk).update(**attendu)
+
+        if verifier:
+            if ecarts:
+                raise CommandError(f"{len(ecarts)} opérations sur {nb_operations} ont un état financier incohérent")
+            self.stdout.write(self.style.SUCCESS(f"{nb_operations} opérations vérifiées : état financier cohérent"))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"{nb_operations} opérations vérifiées, {len(ecarts)} corrigée(s)"))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from core.models import Operation
+
+
+class Command(BaseCommand):
+    help = "Recalcule le statut des opérations selon leurs passages (réalisés, planifiés, en retard)"
+
+    def handle(self, *args, **options):
+        # Opérations payées, annulées ou en attente de devis exclues par update_statuts_from_passages
+        nb_modifiees = Operation.update_statuts_from_passages(Operation.objects.all())
+        self.stdout.write(self.style.SUCCESS(f"{nb_modifiees} opération(s) mise(s) à jour"))
@@ -0,0 +1,51 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import F
+
+from core.models import Devis, LigneDevis, calculer_totaux
+
+
+class Command(BaseCommand):
+    help = 'Recalcule (ou vérifie) les totaux HT/TVA/TTC stockés sur les devis'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verifier',
+            action='store_true',
+            help="Vérifie seulement les totaux, sans les corriger (code de sortie non nul si écart)",
+        )
+
+    def handle(self, *args, **options):
+        verifier = options['verifier']
+
+        # Une seule lecture des lignes, regroupées par devis
+        lignes_par_devis = defaultdict(list)
+        for devis_id, montant, taux_tva in LigneDevis.objects.order_by().values_list(
+            'devis_id', 'montant', 'taux_tva'
+        ):
+            lignes_par_devis[devis_id].append((montant, taux_tva))
+
+        nb_devis = 0
+        ecarts = []
+
+        for devis in Devis.objects.order_by('pk').only('pk', 'numero_devis', *Devis.CHAMPS_TOTAUX).iterator():
+            nb_devis += 1
+            attendu = calculer_totaux(lignes_par_devis.get(devis.pk, []))
+            stocke = {champ: getattr(devis, champ) or Decimal('0.00') for champ in Devis.CHAMPS_TOTAUX}
+
+            if attendu != stocke:
+                ecarts.append(devis.numero_devis)
+                self.stdout.write(
+                    f"  {devis.numero_devis} : stocké {stocke['total_ttc']} € TTC, attendu {attendu['total_ttc']} € TTC"
+                )
+                if not verifier:
+                    Devis.objects.filter(pk=devis.pk).update(**attendu, revision_totaux=F('revision_totaux') + 1)
+
+        if verifier:
+            if ecarts:
+                raise CommandError(f"{len(ecarts)} devis sur {nb_devis} ont des totaux incohérents")
+            self.stdout.write(self.style.SUCCESS(f"{nb_devis} devis vérifiés : totaux cohérents"))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"{nb_devis} devis vérifiés, {len(ecarts)} corrigé(s)"))
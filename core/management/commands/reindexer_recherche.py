@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.models import Client, Operation
+from core.recherche import (
+    CHAMPS_RECHERCHE_CLIENT, chiffres, document_client, document_suggestion, reconstruire_index,
+)
+
+
+class Command(BaseCommand):
+    help = "Recalcule les documents de recherche (clients, opérations) et reconstruit l'index"
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            clients = [
+                Client(
+                    pk=valeurs['pk'],
+                    texte_recherche=document_client(valeurs),
+                    telephone_chiffres=chiffres(valeurs['telephone']),
+                    texte_suggestion=document_suggestion(valeurs),
+                )
+                for valeurs in Client.objects.order_by().values('pk', *CHAMPS_RECHERCHE_CLIENT)
+            ]
+            Client.objects.bulk_update(
+                clients, ['texte_recherche', 'telephone_chiffres', 'texte_suggestion'], batch_size=500
+            )
+            reconstruire_index(Client)
+
+            nb_operations = Operation.mettre_a_jour_recherche(Operation.objects.all())
+            reconstruire_index(Operation)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Index de recherche reconstruit : {len(clients)} clients, {nb_operations} opérations"
+        ))
@@ -0,0 +1,289 @@
+import random
+import re
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, reset_queries, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+from django.utils import timezone
+
+from core.models import (
+    Client, Operation, PassageOperation, Echeance, Devis, LigneDevis, HistoriqueOperation,
+)
+from core.pagination import TAILLE_PAGE, encoder_curseur
+from core.views import TRIS_OPERATIONS
+
+
+# Tables dont un parcours complet coûte proportionnellement au volume
+TABLES_VOLUMINEUSES = {
+    model._meta.db_table
+    for model in (Client, Operation, PassageOperation, Echeance, Devis, LigneDevis, HistoriqueOperation)
+}
+
+NOM_UTILISATEUR_GENERE = 'verification_plans'
+
+
+def generer_jeu_de_donnees(user, nb_operations, graine=42):
+    """
+    Compte réaliste pour les plans : 1 client pour 5 opérations ; par
+    opération 2 passages, 2 échéances, 3 entrées d'historique ; un devis
+    (1 à 3 versions, 3 lignes chacune) pour 40 % des opérations.
+    """
+    rnd = random.Random(graine)
+    now = timezone.now()
+    today = now.date()
+    statuts = [code for code, _ in Operation.STATUTS]
+
+    Client.objects.bulk_create([
+        Client(
+            user=user, id_client=f'U{user.pk}CL{i:06X}', nom=f'Nom{i}', prenom='Prénom',
+            telephone=f'06{i:08d}', telephone_chiffres=f'06{i:08d}', ville='Lyon',
+            texte_suggestion=f' nom{i} prenom lyon',
+        )
+        for i in range(max(nb_operations // 5, 1))
+    ], batch_size=1000)
+    clients = list(Client.objects.filter(user=user).values_list('pk', flat=True))
+
+    Operation.objects.bulk_create([
+        Operation(
+            user=user, client_id=rnd.choice(clients), id_operation=f'U{user.pk}OP{i:06X}',
+            type_prestation='Plomberie', statut=rnd.choice(statuts), avec_devis=rnd.random() < 0.4,
+            date_prevue=now + timedelta(days=rnd.randint(-60, 60)),
+            montant_total=Decimal('1200.00'), montant_encaisse=Decimal('600.00'),
+        )
+        for i in range(nb_operations)
+    ], batch_size=1000)
+    operations = list(Operation.objects.filter(user=user).values_list('pk', 'avec_devis'))
+
+    PassageOperation.objects.bulk_create([
+        PassageOperation(
+            operation_id=pk, numero=numero, realise=numero == 1,
+            date_prevue=now + timedelta(days=rnd.randint(-60, 60)),
+            date_realisation=now - timedelta(days=rnd.randint(1, 60)) if numero == 1 else None,
+        )
+        for pk, _ in operations for numero in (1, 2)
+    ], batch_size=2000)
+
+    Echeance.objects.bulk_create([
+        Echeance(
+            operation_id=pk, numero=ordre, ordre=ordre, montant=Decimal('600.00'),
+            paye=ordre == 1, date_echeance=today + timedelta(days=rnd.randint(-60, 60)),
+        )
+        for pk, _ in operations for ordre in (1, 2)
+    ], batch_size=2000)
+
+    HistoriqueOperation.objects.bulk_create([
+        HistoriqueOperation(operation_id=pk, action=f'Action {k}', utilisateur=user)
+        for pk, _ in operations for k in range(3)
+    ], batch_size=2000)
+
+    Devis.objects.bulk_create([
+        Devis(
+            operation_id=pk, version=version, numero_devis=f'DEV-PLANS-U{user.pk}-{pk}-{version}',
+            statut=rnd.choice(['brouillon', 'pret', 'envoye', 'accepte']),
+            date_envoi=today - timedelta(days=rnd.randint(0, 60)),
+        )
+        for pk, avec_devis in operations if avec_devis
+        for version in range(1, rnd.randint(1, 3) + 1)
+    ], batch_size=2000)
+
+    LigneDevis.objects.bulk_create([
+        LigneDevis(
+            devis_id=devis_id, ordre=ordre, description=f'Ligne {ordre}',
+            quantite=Decimal('1'), prix_unitaire_ht=Decimal('100.00'), montant=Decimal('100.00'),
+        )
+        for devis_id in Devis.objects.filter(operation__user=user).values_list('pk', flat=True)
+        for ordre in (1, 2, 3)
+    ], batch_size=2000)
+
+
+def pages_a_verifier(user):
+    """
+    (libellé, url, tri_tolere) des pages principales pour ce compte.
+    tri_tolere : la page trie ses lignes après coup par nature (résultats
+    d'une recherche plein texte, qu'aucun index ne fournit dans l'ordre
+    de la liste) ; seuls les parcours séquentiels y sont vérifiés.
+    """
+    operation = Operation.objects.filter(user=user).order_by('pk').first()
+    client = Client.objects.filter(user=user).order_by('pk').first()
+
+    ordre = TRIS_OPERATIONS['recent']
+    cles = list(
+        Operation.objects.filter(user=user).order_by(*ordre)
+        .values_list(*[champ.lstrip('-') for champ in ordre])[TAILLE_PAGE - 1:TAILLE_PAGE]
+    )
+
+    today = timezone.localdate()
+    liste = reverse('operations')
+    calendrier = reverse('calendrier_evenements')
+    pages = [
+        ('dashboard', reverse('dashboard'), False),
+        ('calendrier', f'{calendrier}?debut={today - timedelta(days=7)}&fin={today + timedelta(days=35)}', False),
+        ('operations', liste, False),
+        ('operations (activité)', f'{liste}?tri=activite', False),
+        ('operations (urgences)', f'{liste}?filtre=urgences', False),
+        ('operations (à encaisser)', f'{liste}?filtre=a_encaisser', False),
+        ('operations (archivées)', f'{liste}?filtre=archivees', False),
+        ('operations (recherche)', f'{liste}?recherche=plomberie', True),
+        ('clients', reverse('clients'), False),
+        ('clients (page 2)', f"{reverse('clients')}?page=2", False),
+        ('clients (suggestions)', f"{reverse('clients_suggestions')}?q=nom1", True),
+        ('clients (suggestions, début du nom)', f"{reverse('clients_suggestions')}?q=no", True),
+        ('clients (suggestions téléphone)', f"{reverse('clients_suggestions')}?q=0600", True),
+    ]
+    if cles:
+        pages.append(('operations (page 2)', f'{liste}?curseur={encoder_curseur(cles[0])}', False))
+    if operation:
+        pages.append(('operation_detail', reverse('operation_detail', args=[operation.pk]), False))
+    if client:
+        pages.append(('client_detail', reverse('client_detail', args=[client.pk]), False))
+    return pages
+
+
+def forme_requete(sql):
+    """SQL sans ses valeurs littérales, pour n'expliquer chaque forme qu'une fois"""
+    return re.sub(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b", '?', sql)
+
+
+def expliquer(sql):
+    """
+    Plan d'exécution d'une requête : [(parent, ligne)]. Sous SQLite,
+    parent vaut 0 pour les étapes de la requête principale ; sous
+    PostgreSQL il n'est pas utilisé (None).
+    """
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('EXPLAIN ' + sql)
+            return [(None, ligne[0]) for ligne in cursor.fetchall()]
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+        return [(parent, detail) for _, parent, _, detail in cursor.fetchall()]
+
+
+def parcours_sequentiels(sql, plan):
+    """Tables volumineuses lues en entier (sans index) dans un plan"""
+    if connection.vendor == 'postgresql':
+        tables = re.findall(r'Seq Scan on (\w+)', '\n'.join(ligne for _, ligne in plan))
+    else:
+        # SQLite : « SCAN U0 » sans « USING INDEX » ; alias -> table d'après le SQL
+        alias = {nom: table for table, nom in re.findall(r'"(\w+)" (?:AS )?"?(\w+)"?', sql)}
+        tables = [
+            alias.get(match.group(1), match.group(1))
+            for match in (re.match(r'SCAN (\w+)$', ligne) for _, ligne in plan) if match
+        ]
+    return sorted(set(tables) & TABLES_VOLUMINEUSES)
+
+
+def tri_sans_index(sql, plan):
+    """
+    Tri fait après coup alors qu'on ne garde que les premières lignes :
+    requête paginée (LIMIT final) ou sous-requête corrélée [:1], évaluée
+    pour chaque ligne. Toutes les lignes filtrées sont lues et triées,
+    faute d'index dans l'ordre demandé.
+    """
+    if connection.vendor == 'postgresql':
+        texte = '\n'.join(ligne for _, ligne in plan)
+        return re.search(r'Limit\b.*\n\s*->\s+Sort\b', texte) is not None
+    pagine = re.search(r'\bLIMIT \d+(?: OFFSET \d+)?$', sql.rstrip()) is not None
+    return any(
+        ligne == 'USE TEMP B-TREE FOR ORDER BY' and (parent != 0 or pagine)
+        for parent, ligne in plan
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Exécute les pages principales sur un jeu de données généré (ou un compte existant), "
+        "passe chacune de leurs requêtes à EXPLAIN et échoue si une grande table est parcourue "
+        "sans index ou si une requête paginée trie toutes ses lignes"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--operations', type=int, default=2000,
+            help="Nombre d'opérations du jeu généré (défaut : 2000)",
+        )
+        parser.add_argument(
+            '--utilisateur',
+            help="Vérifier sur ce compte existant au lieu de générer des données",
+        )
+        parser.add_argument('--afficher', action='store_true', help='Affiche tous les plans')
+
+    def handle(self, *args, **options):
+        # Tout est annulé à la fin : jeu généré et statistiques du planificateur
+        with transaction.atomic():
+            if options['utilisateur']:
+                try:
+                    user = User.objects.get(username=options['utilisateur'])
+                except User.DoesNotExist:
+                    raise CommandError(f"Utilisateur inconnu : {options['utilisateur']}")
+            else:
+                user = User.objects.create_user(NOM_UTILISATEUR_GENERE)
+                generer_jeu_de_donnees(user, options['operations'])
+                self.stdout.write(f"Jeu généré : {options['operations']} opérations")
+
+            # Le plan ne doit pas dépendre du volume du jeu : un parcours
+            # complet ne reste que si aucun index n'est utilisable
+            with connection.cursor() as cursor:
+                if connection.vendor == 'postgresql':
+                    cursor.execute('ANALYZE')
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+                else:
+                    # Sans statistiques, SQLite suppose des tables volumineuses
+                    # et des index sélectifs ; ANALYZE sqlite_schema les recharge
+                    cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'")
+                    if cursor.fetchone():
+                        cursor.execute('DELETE FROM sqlite_stat1')
+                        cursor.execute('ANALYZE sqlite_schema')
+
+            problemes = self.verifier(user, options['afficher'])
+            transaction.set_rollback(True)
+
+        if problemes:
+            raise CommandError(f"{len(problemes)} requête(s) sans index adapté")
+        self.stdout.write(self.style.SUCCESS(
+            'Aucun parcours séquentiel sur les grandes tables ni tri sans index avant LIMIT'
+        ))
+
+    def verifier(self, user, afficher):
+        factory = RequestFactory()
+        deja_vues = set()
+        problemes = []
+
+        for libelle, url, tri_tolere in pages_a_verifier(user):
+            request = factory.get(url)
+            request.user = user
+            vue = resolve(url.split('?')[0])
+            reset_queries()
+            with CaptureQueriesContext(connection) as requetes:
+                response = vue.func(request, *vue.args, **vue.kwargs)
+            if response.status_code != 200:
+                raise CommandError(f"{libelle} : HTTP {response.status_code}")
+
+            nouvelles = 0
+            for requete in requetes:
+                sql = requete['sql']
+                forme = forme_requete(sql)
+                if not sql.lstrip().upper().startswith('SELECT') or forme in deja_vues:
+                    continue
+                deja_vues.add(forme)
+                nouvelles += 1
+
+                plan = expliquer(sql)
+                erreurs = [f"parcours de {table}" for table in parcours_sequentiels(sql, plan)]
+                if not tri_tolere and tri_sans_index(sql, plan):
+                    erreurs.append('tri sans index avant LIMIT')
+                if erreurs:
+                    problemes.append((libelle, erreurs, sql))
+                    self.stdout.write(self.style.ERROR(f"  {libelle} : {', '.join(erreurs)}"))
+                    self.stdout.write(f"    {sql[:300]}")
+                if afficher or erreurs:
+                    for _, ligne in plan:
+                        self.stdout.write(f"      {ligne}")
+
+            self.stdout.write(f"{libelle} : {len(requetes)} requêtes, {nouvelles} plan(s) vérifié(s)")
+
+        return problemes
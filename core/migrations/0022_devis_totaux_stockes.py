@@ -0,0 +1,45 @@
+# Generated by Django 5.2.6 on 2026-10-17 11:18
+
+from decimal import Decimal, ROUND_HALF_UP
+from django.db import migrations, models
+
+
+def initialiser_totaux(apps, schema_editor):
+    """Calcule les totaux stockés des devis existants"""
+    Devis = apps.get_model('core', 'Devis')
+    LigneDevis = apps.get_model('core', 'LigneDevis')
+
+    totaux = {}
+    for devis_id, montant, taux_tva in LigneDevis.objects.values_list('devis_id', 'montant', 'taux_tva'):
+        ht, tva = totaux.get(devis_id, (Decimal('0.00'), Decimal('0.00')))
+        tva_ligne = (montant * taux_tva / Decimal('100')).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+        totaux[devis_id] = (ht + montant, tva + tva_ligne)
+
+    for devis_id, (ht, tva) in totaux.items():
+        Devis.objects.filter(pk=devis_id).update(sous_total_ht=ht, total_tva=tva, total_ttc=ht + tva)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0021_alter_passageoperation_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='devis',
+            name='sous_total_ht',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), editable=False, max_digits=12, verbose_name='Sous-total HT'),
+        ),
+        migrations.AddField(
+            model_name='devis',
+            name='total_ttc',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), editable=False, max_digits=12, verbose_name='Total TTC'),
+        ),
+        migrations.AddField(
+            model_name='devis',
+            name='total_tva',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), editable=False, max_digits=12, verbose_name='Total TVA'),
+        ),
+        migrations.RunPython(initialiser_totaux, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 5.2.6 on 2026-10-17 11:22
+
+from decimal import Decimal, ROUND_HALF_UP
+from django.db import migrations, models
+from django.db.models import Q, Sum
+
+
+def initialiser_finances(apps, schema_editor):
+    """Calcule l'état financier stocké des opérations existantes"""
+    Operation = apps.get_model('core', 'Operation')
+    Devis = apps.get_model('core', 'Devis')
+    Intervention = apps.get_model('core', 'Intervention')
+    Echeance = apps.get_model('core', 'Echeance')
+
+    zero = Decimal('0.00')
+
+    # Avec devis : somme des devis acceptés (totaux déjà stockés)
+    ttc_devis = dict(
+        Devis.objects.filter(statut='accepte').order_by().values('operation').annotate(
+            total=Sum('total_ttc')
+        ).values_list('operation', 'total')
+    )
+
+    # Sans devis : interventions, TVA arrondie au centime par ligne
+    ttc_interventions = {}
+    for operation_id, montant, taux_tva in Intervention.objects.values_list('operation_id', 'montant', 'taux_tva'):
+        tva = (montant * taux_tva / Decimal('100')).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+        ttc_interventions[operation_id] = ttc_interventions.get(operation_id, zero) + montant + tva
+
+    echeances = {
+        ligne['operation']: ligne
+        for ligne in Echeance.objects.order_by().values('operation').annotate(
+            planifie=Sum('montant'),
+            encaisse=Sum('montant', filter=Q(paye=True)),
+        )
+    }
+
+    for operation_id, avec_devis in Operation.objects.values_list('pk', 'avec_devis'):
+        totaux = ttc_devis if avec_devis else ttc_interventions
+        montants = echeances.get(operation_id, {})
+        Operation.objects.filter(pk=operation_id).update(
+            montant_total=totaux.get(operation_id) or zero,
+            montant_encaisse=montants.get('encaisse') or zero,
+            montant_planifie=montants.get('planifie') or zero,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0022_devis_totaux_stockes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='operation',
+            name='montant_encaisse',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), editable=False, help_text='Somme des échéances payées', max_digits=12, verbose_name='Montant encaissé'),
+        ),
+        migrations.AddField(
+            model_name='operation',
+            name='montant_planifie',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), editable=False, help_text='Somme de toutes les échéances', max_digits=12, verbose_name='Montant planifié'),
+        ),
+        migrations.AddField(
+            model_name='operation',
+            name='montant_total',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), editable=False, help_text='Si avec devis : somme des devis acceptés, sinon somme des interventions', max_digits=12, verbose_name='Montant total TTC'),
+        ),
+        migrations.RunPython(initialiser_finances, migrations.RunPython.noop),
+    ]
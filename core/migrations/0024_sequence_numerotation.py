@@ -0,0 +1,31 @@
+# Generated by Django 5.2.6 on 2026-10-17 11:25
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0023_operation_finances_stockees'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SequenceNumerotation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('annee', models.PositiveIntegerField(verbose_name='Année')),
+                ('type_document', models.CharField(choices=[('devis', 'Devis'), ('facture', 'Facture')], max_length=20, verbose_name='Type de document')),
+                ('dernier_numero', models.PositiveIntegerField(default=0, verbose_name='Dernier numéro attribué')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sequences_numerotation', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Séquence de numérotation',
+                'verbose_name_plural': 'Séquences de numérotation',
+                'unique_together': {('user', 'annee', 'type_document')},
+            },
+        ),
+    ]
@@ -0,0 +1,145 @@
+# Generated by Django 5.2.6 on 2026-10-17 11:43
+
+import re
+import unicodedata
+
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+from django.db.utils import OperationalError
+
+
+TABLES = ['core_client', 'core_operation']
+
+
+# Copie figée des fonctions de core/recherche.py au moment de cette
+# migration : une évolution ultérieure du document de recherche ne doit
+# pas changer ce qu'écrit cette migration.
+CHAMPS_RECHERCHE_CLIENT = ['id_client', 'nom', 'prenom', 'email', 'telephone', 'ville', 'adresse']
+CHAMPS_RECHERCHE_OPERATION = ['id_operation', 'type_prestation', 'adresse_intervention', 'commentaires']
+CHAMPS_CLIENT_OPERATION = ['nom', 'prenom', 'telephone', 'ville']
+
+
+def normaliser(texte):
+    texte = unicodedata.normalize('NFKD', str(texte or ''))
+    texte = ''.join(c for c in texte if not unicodedata.combining(c))
+    return ' '.join(texte.lower().split())
+
+
+def chiffres(texte):
+    return re.sub(r'\D', '', texte or '')
+
+
+def document_client(valeurs):
+    morceaux = [valeurs.get(champ) for champ in CHAMPS_RECHERCHE_CLIENT]
+    morceaux.append(chiffres(valeurs.get('telephone')))
+    return normaliser(' '.join(m for m in morceaux if m))
+
+
+def document_operation(valeurs, client):
+    morceaux = [valeurs.get(champ) for champ in CHAMPS_RECHERCHE_OPERATION]
+    morceaux += [client.get(champ) for champ in CHAMPS_CLIENT_OPERATION]
+    morceaux.append(chiffres(client.get('telephone')))
+    return normaliser(' '.join(m for m in morceaux if m))
+
+
+def initialiser_recherche(apps, schema_editor):
+    """Calcule les documents de recherche des clients et opérations existants"""
+    Client = apps.get_model('core', 'Client')
+    Operation = apps.get_model('core', 'Operation')
+
+    clients = {}
+    a_jour = []
+    for valeurs in Client.objects.values('pk', *CHAMPS_RECHERCHE_CLIENT):
+        clients[valeurs['pk']] = valeurs
+        a_jour.append(Client(
+            pk=valeurs['pk'],
+            texte_recherche=document_client(valeurs),
+            telephone_chiffres=chiffres(valeurs['telephone']),
+        ))
+    Client.objects.bulk_update(a_jour, ['texte_recherche', 'telephone_chiffres'], batch_size=500)
+
+    a_jour = [
+        Operation(
+            pk=valeurs['pk'],
+            texte_recherche=document_operation(valeurs, clients.get(valeurs['client_id'], {})),
+        )
+        for valeurs in Operation.objects.values('pk', 'client_id', *CHAMPS_RECHERCHE_OPERATION)
+    ]
+    Operation.objects.bulk_update(a_jour, ['texte_recherche'], batch_size=500)
+
+
+def creer_index_recherche(apps, schema_editor):
+    """
+    PostgreSQL : index GIN trigrammes sur texte_recherche (extension
+    pg_trgm créée par TrigramExtension, qui demande le droit CREATE sur la
+    base, ou une extension déjà installée par un administrateur).
+    SQLite : tables FTS5 (tokenizer trigram) ; sans FTS5, la recherche
+    reste un LIKE sur la seule colonne texte_recherche.
+    """
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        for table in TABLES:
+            schema_editor.execute(
+                f'CREATE INDEX IF NOT EXISTS {table}_recherche_trgm '
+                f'ON {table} USING gin (texte_recherche gin_trgm_ops)'
+            )
+    elif vendor == 'sqlite':
+        for table in TABLES:
+            try:
+                schema_editor.execute(
+                    f"CREATE VIRTUAL TABLE IF NOT EXISTS {table}_fts "
+                    f"USING fts5(texte_recherche, tokenize='trigram')"
+                )
+            except OperationalError:
+                # SQLite sans FTS5 ou sans tokenizer trigram (< 3.34)
+                return
+            schema_editor.execute(
+                f'INSERT INTO {table}_fts (rowid, texte_recherche) SELECT id, texte_recherche FROM {table}'
+            )
+
+
+def supprimer_index_recherche(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for table in TABLES:
+        if vendor == 'postgresql':
+            schema_editor.execute(f'DROP INDEX IF EXISTS {table}_recherche_trgm')
+        elif vendor == 'sqlite':
+            schema_editor.execute(f'DROP TABLE IF EXISTS {table}_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0024_sequence_numerotation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='client',
+            name='telephone_chiffres',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=20),
+        ),
+        migrations.AddField(
+            model_name='client',
+            name='texte_recherche',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='operation',
+            name='texte_recherche',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AlterField(
+            model_name='client',
+            name='id_client',
+            field=models.CharField(blank=True, db_index=True, max_length=15),
+        ),
+        migrations.AlterField(
+            model_name='operation',
+            name='id_operation',
+            field=models.CharField(blank=True, db_index=True, max_length=15),
+        ),
+        migrations.RunPython(initialiser_recherche, migrations.RunPython.noop),
+        TrigramExtension(),
+        migrations.RunPython(creer_index_recherche, supprimer_index_recherche),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.6 on 2026-10-17 12:10
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0025_recherche_indexee'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='client',
+            index=models.Index(fields=['user', 'nom', 'prenom'], name='client_user_nom_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='echeance',
+            index=models.Index(fields=['operation', 'paye', 'date_echeance'], name='echeance_op_paye_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='historiqueoperation',
+            index=models.Index(fields=['operation', '-date'], name='historique_op_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='operation',
+            index=models.Index(fields=['user', '-date_creation', '-id'], name='operation_user_creation_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='operation',
+            index=models.Index(fields=['user', '-date_modification', '-id'], name='operation_user_modif_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='operation',
+            index=models.Index(fields=['user', 'statut', '-date_creation', '-id'], name='operation_user_statut_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='operation',
+            index=models.Index(fields=['client', '-date_creation'], name='operation_client_creation_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='operation',
+            index=models.Index(condition=models.Q(('date_prevue__isnull', False)), fields=['user', 'date_prevue'], name='operation_user_prevue_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='passageoperation',
+            index=models.Index(fields=['operation', 'realise', 'date_prevue'], name='passage_op_realise_prevue_idx'),
+        ),
+    ]
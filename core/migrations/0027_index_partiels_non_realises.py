@@ -0,0 +1,29 @@
+# Generated by Django 5.2.6 on 2026-10-17 12:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0026_index_composites'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='echeance',
+            name='echeance_op_paye_date_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='passageoperation',
+            name='passage_op_realise_prevue_idx',
+        ),
+        migrations.AddIndex(
+            model_name='echeance',
+            index=models.Index(condition=models.Q(('paye', False)), fields=['operation', 'date_echeance'], name='echeance_impayee_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='passageoperation',
+            index=models.Index(condition=models.Q(('realise', False)), fields=['operation', 'date_prevue'], name='passage_a_realiser_idx'),
+        ),
+    ]
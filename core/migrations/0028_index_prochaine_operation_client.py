@@ -0,0 +1,19 @@
+# Generated by Django 5.2.6 on 2026-10-17 12:20
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0027_index_partiels_non_realises'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='operation',
+            index=models.Index(condition=models.Q(('date_prevue__isnull', False)), fields=['client', 'date_prevue'], name='operation_client_prevue_idx'),
+        ),
+    ]
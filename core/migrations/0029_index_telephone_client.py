@@ -0,0 +1,19 @@
+# Generated by Django 5.2.6 on 2026-10-17 12:33
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0028_index_prochaine_operation_client'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='client',
+            index=models.Index(fields=['user', 'telephone_chiffres'], name='client_user_telephone_idx'),
+        ),
+    ]
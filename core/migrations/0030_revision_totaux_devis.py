@@ -0,0 +1,22 @@
+# Generated by Django 5.2.6 on 2026-10-17 12:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0029_index_telephone_client'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='devis',
+            name='revision_totaux',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='lignedevis',
+            index=models.Index(fields=['devis', 'ordre'], name='ligne_devis_ordre_idx'),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.6 on 2026-10-17 13:10
+
+import unicodedata
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+# Copie figée de core.recherche.document_suggestion au moment de cette migration
+CHAMPS_SUGGESTION_CLIENT = ['nom', 'prenom', 'ville']
+
+
+def normaliser(texte):
+    texte = unicodedata.normalize('NFKD', str(texte or ''))
+    texte = ''.join(c for c in texte if not unicodedata.combining(c))
+    return ' '.join(texte.lower().split())
+
+
+def document_suggestion(valeurs):
+    texte = normaliser(' '.join(valeurs.get(champ) or '' for champ in CHAMPS_SUGGESTION_CLIENT))
+    return ' ' + texte if texte else ''
+
+
+def initialiser_suggestions(apps, schema_editor):
+    """Calcule le document de suggestion des clients existants"""
+    Client = apps.get_model('core', 'Client')
+    a_jour = [
+        Client(pk=valeurs['pk'], texte_suggestion=document_suggestion(valeurs))
+        for valeurs in Client.objects.values('pk', *CHAMPS_SUGGESTION_CLIENT)
+    ]
+    Client.objects.bulk_update(a_jour, ['texte_suggestion'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0030_revision_totaux_devis'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='client',
+            name='texte_suggestion',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.RunPython(initialiser_suggestions, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='client',
+            index=models.Index(fields=['user', 'texte_suggestion'], name='client_user_suggestion_idx'),
+        ),
+    ]
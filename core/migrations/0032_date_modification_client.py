@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-17 13:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0031_suggestion_clients'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='client',
+            name='date_modification',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
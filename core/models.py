@@ -2,17 +2,96 @@
 # core/models.py - Version refactorisée avec système de devis multiple
 # ================================
 
-from django.db import models
+from django.db import models, connections, transaction, IntegrityError
 from django.contrib.auth.models import User
 from django.urls import reverse
 from django.utils import timezone
-from django.db.models import Sum, Max
-from decimal import Decimal
+from django.db.models import Q, F, Sum, Max, Count
+from collections import defaultdict
+from decimal import Decimal, ROUND_HALF_UP
+import re
+
+from .recherche import (
+    CHAMPS_CLIENT_OPERATION,
+    CHAMPS_RECHERCHE_CLIENT,
+    CHAMPS_RECHERCHE_OPERATION,
+    chiffres,
+    document_client,
+    document_operation,
+    document_suggestion,
+    indexer,
+)
+
+
+def arrondir_montant(valeur):
+    """Arrondi commercial au centime (0,005 → 0,01)"""
+    return Decimal(valeur).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+
+def calculer_tva(montant, taux_tva):
+    """TVA d'une ligne (devis ou intervention), arrondie au centime"""
+    return arrondir_montant(montant * taux_tva / Decimal('100'))
+
+
+def precharges(instance, relation):
+    """
+    Objets d'une relation déjà chargés par prefetch_related(relation)
+    (liste), sinon None : les propriétés calculent alors en mémoire au lieu
+    de relancer une requête par objet.
+    """
+    objets = getattr(instance, '_prefetched_objects_cache', {}).get(relation)
+    return list(objets) if objets is not None else None
+
+
+def calculer_totaux(lignes):
+    """Totaux (HT, TVA, TTC) d'une liste de couples (montant HT, taux TVA)"""
+    sous_total_ht = Decimal('0.00')
+    total_tva = Decimal('0.00')
+    for montant, taux_tva in lignes:
+        sous_total_ht += montant
+        total_tva += calculer_tva(montant, taux_tva)
+    return {
+        'sous_total_ht': sous_total_ht,
+        'total_tva': total_tva,
+        'total_ttc': sous_total_ht + total_tva,
+    }
+
+
+class FinancesOperationQuerySet(models.QuerySet):
+    """
+    QuerySet des objets qui alimentent l'état financier d'une opération
+    (interventions, échéances) : les opérations en masse contournent
+    save()/delete(), on y recalcule donc les opérations concernées.
+    """
+    
+    def _recalculer(self, operation_ids):
+        Operation.recalculer_finances_pour(
+            operation_ids, echeances_seulement=self.model is Echeance
+        )
+    
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        resultat = super().bulk_create(objs, *args, **kwargs)
+        self._recalculer(obj.operation_id for obj in objs)
+        return resultat
+    
+    def update(self, **kwargs):
+        # bulk_update() passe aussi par ici
+        operation_ids = list(self.values_list('operation_id', flat=True).distinct())
+        resultat = super().update(**kwargs)
+        self._recalculer(operation_ids)
+        return resultat
+    
+    def delete(self):
+        operation_ids = list(self.values_list('operation_id', flat=True).distinct())
+        resultat = super().delete()
+        self._recalculer(operation_ids)
+        return resultat
 
 
 class Client(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    id_client = models.CharField(max_length=15, blank=True)
+    id_client = models.CharField(max_length=15, blank=True, db_index=True)
     nom = models.CharField(max_length=100)
     prenom = models.CharField(max_length=100)
     email = models.EmailField(blank=True)
@@ -20,30 +99,98 @@ class Client(models.Model):
     adresse = models.TextField()
     ville = models.CharField(max_length=100)
     date_creation = models.DateTimeField(auto_now_add=True)
+    # Nom / téléphone affichés dans le calendrier : entre dans son ETag
+    date_modification = models.DateTimeField(auto_now=True)
+    
+    # ✅ Recherche indexée (voir core/recherche.py), maintenue par save()
+    texte_recherche = models.TextField(blank=True, default='', editable=False)
+    telephone_chiffres = models.CharField(max_length=20, blank=True, default='', db_index=True, editable=False)
+    # Saisie semi-automatique : mots du nom, du prénom et de la ville
+    texte_suggestion = models.TextField(blank=True, default='', editable=False)
 
     
     class Meta:
         ordering = ['nom', 'prenom']
+        indexes = [
+            # Liste des clients d'un compte, dans l'ordre d'affichage
+            models.Index(fields=['user', 'nom', 'prenom'], name='client_user_nom_idx'),
+            # Saisie semi-automatique : début de numéro (intervalle) dans un compte
+            models.Index(fields=['user', 'telephone_chiffres'], name='client_user_telephone_idx'),
+            # Saisie semi-automatique : début du nom (intervalle) dans un compte
+            models.Index(fields=['user', 'texte_suggestion'], name='client_user_suggestion_idx'),
+        ]
     
     def __str__(self):
         return f"{self.nom} {self.prenom}"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Champs repris dans la recherche des opérations : réindexées s'ils changent
+        instance._recherche_operations_initiale = instance._valeurs_recherche_operations()
+        return instance
+    
+    def _valeurs_recherche_operations(self):
+        return tuple(self.__dict__.get(champ) for champ in CHAMPS_CLIENT_OPERATION)
+    
     def save(self, *args, **kwargs):
         if not self.id_client:
             import uuid
             unique_suffix = str(uuid.uuid4())[:6].upper()
             self.id_client = f"U{self.user.id}CL{unique_suffix}"
+        
+        update_fields = kwargs.get('update_fields')
+        recherche_modifiee = update_fields is None or bool(set(update_fields) & set(CHAMPS_RECHERCHE_CLIENT))
+        if recherche_modifiee:
+            self.texte_recherche = document_client(
+                {champ: getattr(self, champ) for champ in CHAMPS_RECHERCHE_CLIENT}
+            )
+            self.telephone_chiffres = chiffres(self.telephone)
+            self.texte_suggestion = document_suggestion(
+                {champ: getattr(self, champ) for champ in CHAMPS_RECHERCHE_CLIENT}
+            )
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | {
+                    'texte_recherche', 'telephone_chiffres', 'texte_suggestion'
+                }
+        
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = set(kwargs['update_fields']) | {'date_modification'}
+        
+        reindexer_operations = (
+            not self._state.adding
+            and recherche_modifiee
+            and self._valeurs_recherche_operations() != getattr(self, '_recherche_operations_initiale', None)
+        )
+        
         super().save(*args, **kwargs)
+        
+        if recherche_modifiee:
+            indexer(Client, {self.pk: self.texte_recherche}, using=self._state.db)
+        if reindexer_operations:
+            Operation.mettre_a_jour_recherche(self.operations.all())
+        self._recherche_operations_initiale = self._valeurs_recherche_operations()
     
     @property
     def derniere_operation(self):
+        operations = precharges(self, 'operations')
+        if operations is not None:
+            return max(operations, key=lambda op: (op.date_creation, op.pk), default=None)
         return self.operations.order_by('-date_creation').first()
     
     @property
     def prochaine_operation(self):
+        now = timezone.now()
+        operations = precharges(self, 'operations')
+        if operations is not None:
+            a_venir = [
+                op for op in operations
+                if op.statut == 'planifie' and op.date_prevue is not None and op.date_prevue >= now
+            ]
+            return min(a_venir, key=lambda op: op.date_prevue, default=None)
         return self.operations.filter(
             statut='planifie', 
-            date_prevue__gte=timezone.now()
+            date_prevue__gte=now
         ).order_by('date_prevue').first()
 
 class Operation(models.Model):
@@ -76,7 +223,7 @@ class Operation(models.Model):
     
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     client = models.ForeignKey(Client, on_delete=models.CASCADE, related_name='operations')
-    id_operation = models.CharField(max_length=15, blank=True)
+    id_operation = models.CharField(max_length=15, blank=True, db_index=True)
     type_prestation = models.CharField(max_length=200)
     adresse_intervention = models.TextField()
     commentaires = models.TextField(blank=True, null=True, verbose_name="Commentaires / Notes")
@@ -127,12 +274,82 @@ class Operation(models.Model):
         verbose_name="Mode de paiement"
     )
     
+    # ========================================
+    # ÉTAT FINANCIER (stocké)
+    # ========================================
+    # Maintenu par les écritures sur Devis, LigneDevis, Intervention et
+    # Echeance (voir recalculer_finances) : les listes et KPI lisent ces
+    # colonnes au lieu de recalculer chaque opération.
+    montant_total = models.DecimalField(
+        max_digits=12,
+        decimal_places=2,
+        default=Decimal('0.00'),
+        editable=False,
+        verbose_name="Montant total TTC",
+        help_text="Si avec devis : somme des devis acceptés, sinon somme des interventions"
+    )
+    
+    montant_encaisse = models.DecimalField(
+        max_digits=12,
+        decimal_places=2,
+        default=Decimal('0.00'),
+        editable=False,
+        verbose_name="Montant encaissé",
+        help_text="Somme des échéances payées"
+    )
+    
+    montant_planifie = models.DecimalField(
+        max_digits=12,
+        decimal_places=2,
+        default=Decimal('0.00'),
+        editable=False,
+        verbose_name="Montant planifié",
+        help_text="Somme de toutes les échéances"
+    )
+    
+    CHAMPS_FINANCIERS = ['montant_total', 'montant_encaisse', 'montant_planifie']
+    
+    # ✅ Recherche indexée (voir core/recherche.py) : champs de l'opération
+    # et de son client, maintenue par save() et Client.save()
+    texte_recherche = models.TextField(blank=True, default='', editable=False)
+    
     class Meta:
         ordering = ['-date_creation']
+        indexes = [
+            # Liste paginée par curseur : tris « récent » et « activité »
+            models.Index(fields=['user', '-date_creation', '-id'], name='operation_user_creation_idx'),
+            models.Index(fields=['user', '-date_modification', '-id'], name='operation_user_modif_idx'),
+            # Onglets par statut (archivées, ...) dans l'ordre de la liste, KPI financiers
+            models.Index(fields=['user', 'statut', '-date_creation', '-id'], name='operation_user_statut_idx'),
+            # Opérations d'un client, de la plus récente à la plus ancienne
+            models.Index(fields=['client', '-date_creation'], name='operation_client_creation_idx'),
+            # Opérations datées à venir (partiel : sans les opérations non datées)
+            models.Index(
+                fields=['user', 'date_prevue'], condition=Q(date_prevue__isnull=False),
+                name='operation_user_prevue_idx'
+            ),
+            # Prochaine opération datée d'un client (liste des clients)
+            models.Index(
+                fields=['client', 'date_prevue'], condition=Q(date_prevue__isnull=False),
+                name='operation_client_prevue_idx'
+            ),
+        ]
     
     def __str__(self):
         return f"{self.id_operation} - {self.type_prestation}"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Champs du document de recherche au chargement : recalculé seulement s'ils changent
+        instance._recherche_initiale = instance._valeurs_recherche()
+        # Mode de l'opération au chargement : il change la source du montant total
+        instance._avec_devis_initial = instance.__dict__.get('avec_devis')
+        return instance
+    
+    def _valeurs_recherche(self):
+        return tuple(self.__dict__.get(champ) for champ in CHAMPS_RECHERCHE_OPERATION + ['client_id'])
+    
     def save(self, *args, **kwargs):
         # Générer l'ID opération
         if not self.id_operation:
@@ -140,54 +357,221 @@ class Operation(models.Model):
             unique_suffix = str(uuid.uuid4())[:6].upper()
             self.id_operation = f"U{self.user.id}OP{unique_suffix}"
         
+        # Document de recherche : seulement si un champ recherché a changé
+        update_fields = kwargs.get('update_fields')
+        recherche_modifiee = (
+            (update_fields is None or bool(set(update_fields) & set(CHAMPS_RECHERCHE_OPERATION + ['client'])))
+            and (self._state.adding or self._valeurs_recherche() != getattr(self, '_recherche_initiale', None))
+        )
+        if recherche_modifiee:
+            self.texte_recherche = self.construire_texte_recherche()
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | {'texte_recherche'}
+        
+        # ✅ L'état financier n'est écrit que par recalculer_finances() :
+        # une opération chargée avant un paiement ne doit pas l'écraser
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.CHAMPS_FINANCIERS
+            ]
+        
+        # Passage avec / sans devis : le montant total change de source
+        mode_modifie = (
+            not self._state.adding
+            and self.avec_devis != getattr(self, '_avec_devis_initial', self.avec_devis)
+            and (update_fields is None or 'avec_devis' in update_fields)
+        )
+        
         super().save(*args, **kwargs)
+        
+        if recherche_modifiee:
+            indexer(Operation, {self.pk: self.texte_recherche}, using=self._state.db)
+            self._recherche_initiale = self._valeurs_recherche()
+        if mode_modifie:
+            self.recalculer_finances()
+        self._avec_devis_initial = self.avec_devis
     
     # ========================================
-    # PROPERTIES POUR MONTANT TOTAL
+    # RECHERCHE
     # ========================================
-    @property
-    def montant_total(self):
+    def construire_texte_recherche(self):
+        """Document de recherche (client lu en base s'il n'est pas déjà chargé)"""
+        if Operation.client.is_cached(self):
+            client = {champ: getattr(self.client, champ) for champ in CHAMPS_CLIENT_OPERATION}
+        else:
+            client = Client.objects.filter(pk=self.client_id).values(*CHAMPS_CLIENT_OPERATION).first() or {}
+        return document_operation(
+            {champ: getattr(self, champ) for champ in CHAMPS_RECHERCHE_OPERATION}, client
+        )
+    
+    @classmethod
+    def mettre_a_jour_recherche(cls, operations):
+        """Recalcule le document de recherche d'un ensemble d'opérations (1 lecture + UPDATE par lots)"""
+        champs_client = [f'client__{champ}' for champ in CHAMPS_CLIENT_OPERATION]
+        documents = {}
+        for valeurs in operations.order_by().values('pk', *CHAMPS_RECHERCHE_OPERATION, *champs_client):
+            client = {champ: valeurs[f'client__{champ}'] for champ in CHAMPS_CLIENT_OPERATION}
+            documents[valeurs['pk']] = document_operation(valeurs, client)
+        
+        cls.objects.bulk_update(
+            [cls(pk=pk, texte_recherche=texte) for pk, texte in documents.items()],
+            ['texte_recherche'], batch_size=500
+        )
+        indexer(cls, documents, using=operations.db)
+        return len(documents)
+    
+    # ========================================
+    # ÉTAT FINANCIER
+    # ========================================
+    def calculer_finances(self, echeances_seulement=False):
         """
-        Calcule le montant total de l'opération :
-        - Si avec_devis : somme des devis acceptés
-        - Si sans devis : somme des interventions
+        Calcule l'état financier depuis les lignes sources (2 requêtes) :
+        - montant_total : devis acceptés (avec devis) ou interventions (sans devis)
+        - montant_encaisse / montant_planifie : échéances payées / toutes
+        
+        echeances_seulement : une écriture sur une échéance ne change pas
+        le montant total, seuls les montants encaissé / planifié sont lus.
         """
+        echeances = self.echeances.order_by().aggregate(
+            planifie=Sum('montant'),
+            encaisse=Sum('montant', filter=Q(paye=True)),
+        )
+        finances = {
+            'montant_encaisse': echeances['encaisse'] or Decimal('0.00'),
+            'montant_planifie': echeances['planifie'] or Decimal('0.00'),
+        }
+        if echeances_seulement:
+            return finances
+        
         if self.avec_devis:
-            devis_acceptes = self.devis_set.filter(statut='accepte')
-            total = sum(devis.total_ttc for devis in devis_acceptes)
-            return Decimal(str(total))
+            finances['montant_total'] = self.devis_set.filter(statut='accepte').aggregate(
+                total=Sum('total_ttc')
+            )['total'] or Decimal('0.00')
         else:
-            return self.total_ttc
+            finances['montant_total'] = calculer_totaux(
+                self.interventions.order_by().values_list('montant', 'taux_tva')
+            )['total_ttc']
+        return finances
+    
+    def totaux_echeances(self):
+        """
+        Sommes des échéances (payees, prevues : non payées, tout) : en
+        mémoire si elles sont préchargées, sinon une seule agrégation
+        """
+        echeances = precharges(self, 'echeances')
+        if echeances is not None:
+            return {
+                'payees': sum(e.montant for e in echeances if e.paye),
+                'prevues': sum(e.montant for e in echeances if not e.paye),
+                'tout': sum(e.montant for e in echeances),
+            }
+        totaux = self.echeances.order_by().aggregate(
+            payees=Sum('montant', filter=Q(paye=True)),
+            prevues=Sum('montant', filter=Q(paye=False)),
+            tout=Sum('montant'),
+        )
+        return {cle: total or 0 for cle, total in totaux.items()}
+    
+    def recalculer_finances(self, echeances_seulement=False):
+        """Recalcule et enregistre l'état financier (2 lectures + 1 UPDATE)"""
+        finances = self.calculer_finances(echeances_seulement=echeances_seulement)
+        Operation.objects.filter(pk=self.pk).update(**finances)
+        for champ, valeur in finances.items():
+            setattr(self, champ, valeur)
+        return finances
+    
+    @classmethod
+    def recalculer_finances_pour(cls, operation_ids, echeances_seulement=False):
+        """
+        Recalcule l'état financier d'un ensemble d'opérations (chemins bulk) :
+        une agrégation groupée par source, un bulk_update, quel que soit le
+        nombre d'opérations
+        """
+        operations = {
+            pk: cls(pk=pk, avec_devis=avec_devis)
+            for pk, avec_devis in cls.objects.filter(pk__in=set(operation_ids)).values_list('pk', 'avec_devis')
+        }
+        if not operations:
+            return
+        
+        champs = ['montant_encaisse', 'montant_planifie']
+        for operation in operations.values():
+            operation.montant_encaisse = Decimal('0.00')
+            operation.montant_planifie = Decimal('0.00')
+        echeances = Echeance.objects.filter(operation_id__in=operations).order_by().values('operation_id').annotate(
+            planifie=Sum('montant'),
+            encaisse=Sum('montant', filter=Q(paye=True)),
+        )
+        for ligne in echeances:
+            operation = operations[ligne['operation_id']]
+            operation.montant_encaisse = ligne['encaisse'] or Decimal('0.00')
+            operation.montant_planifie = ligne['planifie'] or Decimal('0.00')
+        
+        if not echeances_seulement:
+            champs.append('montant_total')
+            for operation in operations.values():
+                operation.montant_total = Decimal('0.00')
+            # Avec devis : devis acceptés
+            devis = Devis.objects.filter(
+                operation_id__in=[pk for pk, op in operations.items() if op.avec_devis], statut='accepte'
+            ).order_by().values('operation_id').annotate(total=Sum('total_ttc'))
+            for ligne in devis:
+                operations[ligne['operation_id']].montant_total = ligne['total'] or Decimal('0.00')
+            # Sans devis : interventions (TVA arrondie par ligne, comme calculer_totaux)
+            lignes = defaultdict(list)
+            for operation_id, montant, taux_tva in Intervention.objects.filter(
+                operation_id__in=[pk for pk, op in operations.items() if not op.avec_devis]
+            ).order_by().values_list('operation_id', 'montant', 'taux_tva'):
+                lignes[operation_id].append((montant, taux_tva))
+            for operation_id, couples in lignes.items():
+                operations[operation_id].montant_total = calculer_totaux(couples)['total_ttc']
+        
+        cls.objects.bulk_update(operations.values(), champs, batch_size=500)
+    
+    @property
+    def reste_a_payer(self):
+        """Montant TTC restant à encaisser"""
+        return self.montant_total - self.montant_encaisse
+    
+    @property
+    def reste_a_planifier(self):
+        """Montant TTC pas encore couvert par une échéance"""
+        return self.montant_total - self.montant_planifie
+    
+    # ========================================
+    # PROPERTIES POUR INTERVENTIONS (opérations sans devis)
+    # ========================================
+    def totaux_interventions(self):
+        """
+        Totaux (HT, TVA, TTC) des interventions : en mémoire si elles sont
+        préchargées, sinon une requête
+        """
+        interventions = precharges(self, 'interventions')
+        if interventions is not None:
+            return calculer_totaux((i.montant, i.taux_tva) for i in interventions)
+        return calculer_totaux(self.interventions.order_by().values_list('montant', 'taux_tva'))
     
     @property
     def sous_total_ht(self):
         """Sous-total HT - logique pour opérations SANS devis uniquement"""
         if self.avec_devis:
             return Decimal('0.00')
-        
-        total = self.interventions.aggregate(
-            total=Sum('montant')
-        )['total']
-        return total if total is not None else Decimal('0.00')
+        return self.totaux_interventions()['sous_total_ht']
     
     @property
     def total_tva(self):
         """Total de la TVA - logique pour opérations SANS devis uniquement"""
         if self.avec_devis:
             return Decimal('0.00')
-        
-        total_tva = Decimal('0.00')
-        for intervention in self.interventions.all():
-            total_tva += intervention.montant_tva
-        return total_tva
+        return self.totaux_interventions()['total_tva']
     
     @property
     def total_ttc(self):
         """Total TTC - logique pour opérations SANS devis uniquement"""
         if self.avec_devis:
             return Decimal('0.00')
-        
-        return self.sous_total_ht + self.total_tva
+        return self.totaux_interventions()['total_ttc']
     
     # ========================================
     # PROPERTIES POUR GESTION DEVIS
@@ -195,6 +579,9 @@ class Operation(models.Model):
     @property
     def dernier_devis(self):
         """Retourne le devis avec la version la plus élevée"""
+        devis = precharges(self, 'devis_set')
+        if devis is not None:
+            return max(devis, key=lambda d: d.version, default=None)
         return self.devis_set.order_by('-version').first()
     
     @property
@@ -206,11 +593,17 @@ class Operation(models.Model):
     @property
     def nombre_devis(self):
         """Compte le nombre total de devis"""
+        devis = precharges(self, 'devis_set')
+        if devis is not None:
+            return len(devis)
         return self.devis_set.count()
     
     @property
     def nombre_devis_acceptes(self):
         """Compte le nombre de devis acceptés"""
+        devis = precharges(self, 'devis_set')
+        if devis is not None:
+            return sum(1 for d in devis if d.statut == 'accepte')
         return self.devis_set.filter(statut='accepte').count()
     
     # ✅ NOUVELLE VERSION (utilise PassageOperation au lieu de date_prevue sur Intervention)
@@ -218,68 +611,115 @@ class Operation(models.Model):
         """Retourne stats basées sur les passages de l'opération"""
         return self.get_passages_stats()  # Utilise la méthode des passages
         
-    def update_statut_from_passages(self):
+    # ========================================
+    # STATISTIQUES ET STATUT SELON LES PASSAGES
+    # ========================================
+    @staticmethod
+    def agregats_passages(now, prefix=''):
         """
-        Recalcule le statut de l'opération selon ses passages
+        Compteurs de passages en un seul aggregate (COUNT filtrés).
+        `prefix` ('passages__') permet de les annoter sur des opérations.
         """
-        passages = self.passages.all()
-        
-        if not passages.exists():
-            # Pas de passages = À planifier
-            return
+        return {
+            'total': Count(f'{prefix}pk'),
+            'realises': Count(f'{prefix}pk', filter=Q(**{f'{prefix}realise': True})),
+            'planifies': Count(f'{prefix}pk', filter=Q(**{f'{prefix}date_prevue__isnull': False})),
+            'en_retard': Count(f'{prefix}pk', filter=Q(**{
+                f'{prefix}realise': False, f'{prefix}date_prevue__lt': now
+            })),
+        }
+    
+    @staticmethod
+    def statut_selon_passages(stats):
+        """Statut déduit des compteurs de passages (None si aucun passage)"""
+        if not stats['total']:
+            # Pas de passages = statut inchangé
+            return None
+        if stats['realises'] == stats['total']:
+            return 'realise'
+        if stats['realises'] > 0:
+            return 'en_cours'
+        if stats['en_retard']:
+            return 'a_traiter'
+        if stats['planifies'] > 0:
+            return 'planifie'
+        return 'a_planifier'
+    
+    def calculer_stats_passages(self, now=None):
+        """
+        Compteurs des passages (total, realises, planifies, en_retard).
+        Réutilise les passages préchargés (prefetch_related('passages')),
+        sinon une seule requête d'agrégation.
+        """
+        now = now or timezone.now()
         
-        nb_total = passages.count()
-        nb_realises = passages.filter(realise=True).count()
-        nb_planifies = passages.exclude(date_prevue__isnull=True).count()
+        passages = precharges(self, 'passages')
+        if passages is not None:
+            return {
+                'total': len(passages),
+                'realises': sum(1 for p in passages if p.realise),
+                'planifies': sum(1 for p in passages if p.date_prevue is not None),
+                'en_retard': sum(
+                    1 for p in passages
+                    if not p.realise and p.date_prevue is not None and p.date_prevue < now
+                ),
+            }
         
-        # Vérifier s'il y a des retards
-        from django.utils import timezone
-        en_retard = passages.filter(
-            realise=False,
-            date_prevue__lt=timezone.now()
-        ).exists()
-        
-        # Calculer le nouveau statut
-        if nb_realises == nb_total:
-            nouveau_statut = 'realise'
-        elif nb_realises > 0:
-            nouveau_statut = 'en_cours'
-        elif en_retard:
-            nouveau_statut = 'a_traiter'
-        elif nb_planifies > 0:
-            nouveau_statut = 'planifie'
-        else:
-            nouveau_statut = 'a_planifier'
+        return self.passages.order_by().aggregate(**self.agregats_passages(now))
+    
+    def update_statut_from_passages(self):
+        """
+        Recalcule le statut de l'opération selon ses passages
+        """
+        nouveau_statut = self.statut_selon_passages(self.calculer_stats_passages())
         
         # Mettre à jour si différent
-        if self.statut != nouveau_statut:
+        if nouveau_statut and self.statut != nouveau_statut:
             self.statut = nouveau_statut
             self.save(update_fields=['statut'])
-
+    
+    # Statuts que les passages ne pilotent pas : opération soldée, devis
+    # refusé (annulée) ou en attente de réponse du client
+    STATUTS_HORS_PASSAGES = ['paye', 'devis_refuse', 'en_attente_devis']
+    
+    @classmethod
+    def update_statuts_from_passages(cls, operations, now=None):
+        """
+        Variante en masse : compteurs annotés sur tout le queryset en une
+        requête, puis un UPDATE par nouveau statut. Les opérations dans un
+        statut de STATUTS_HORS_PASSAGES ne sont pas modifiées. Retourne le
+        nombre d'opérations modifiées.
+        """
+        now = now or timezone.now()
+        agregats = cls.agregats_passages(now, prefix='passages__')
+        
+        a_modifier = {}
+        lignes = operations.exclude(statut__in=cls.STATUTS_HORS_PASSAGES).order_by().annotate(
+            **{f'nb_passages_{cle}': expression for cle, expression in agregats.items()}
+        ).values_list('pk', 'statut', *[f'nb_passages_{cle}' for cle in agregats])
+        
+        for pk, statut, *compteurs in lignes:
+            nouveau_statut = cls.statut_selon_passages(dict(zip(agregats, compteurs)))
+            if nouveau_statut and nouveau_statut != statut:
+                a_modifier.setdefault(nouveau_statut, []).append(pk)
+        
+        for statut, ids in a_modifier.items():
+            cls.objects.filter(pk__in=ids).update(statut=statut)
+        return sum(len(ids) for ids in a_modifier.values())
+    
     def get_passages_stats(self):
         """
         Retourne les stats des passages
         """
-        passages = self.passages.all()
-        return {
-            'total': passages.count(),
-            'realises': passages.filter(realise=True).count(),
-            'planifies': passages.exclude(date_prevue__isnull=True).count()
-        }
+        return self.calculer_stats_passages()
     
     def renumeroter_passages(self):
         """
         Recalcule les numéros de passage par ordre chronologique
-        ✅ Appelé automatiquement après chaque save() de PassageOperation
+        ✅ Appelé automatiquement quand un passage est ajouté, supprimé
+        ou change de date prévue
         """
-        # Récupérer tous les passages triés par date
-        passages = self.passages.order_by('date_prevue', 'created_at')
-        
-        # Renumeroter
-        for index, passage in enumerate(passages, start=1):
-            if passage.numero != index:
-                # ⚠️ IMPORTANT : update_fields pour éviter boucle infinie
-                PassageOperation.objects.filter(pk=passage.pk).update(numero=index)
+        return PassageOperation.renumeroter(self.pk, using=self._state.db)
 
 # Dans models.py, APRÈS la classe Operation
 
@@ -302,26 +742,93 @@ class PassageOperation(models.Model):
         ordering = ['date_prevue', 'created_at']
         verbose_name = "Passage d'opération"
         verbose_name_plural = "Passages d'opération"
+        indexes = [
+            # Passages non réalisés d'une opération par date prévue (onglets, statuts).
+            # Partiel plutôt que (operation, realise, date_prevue) : SQLite écrit
+            # realise=False « NOT realise », inutilisable comme colonne d'index
+            models.Index(
+                fields=['operation', 'date_prevue'], condition=Q(realise=False),
+                name='passage_a_realiser_idx'
+            ),
+        ]
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Date prévue au chargement : la renumérotation n'est utile que si elle change
+        instance._date_prevue_initiale = instance.__dict__.get('date_prevue')
+        return instance
+    
     def save(self, *args, **kwargs):
         """
         Sauvegarde avec recalcul automatique des numéros chronologiques
+        (seulement pour un nouveau passage ou une date prévue modifiée :
+        un commentaire ou la réalisation ne changent pas l'ordre)
         """
-        from django.db.models import Max
-        
-        # Si nouveau passage (pas d'ID)
-        if not self.pk:
-            # Donner un numéro temporaire (sera recalculé après)
-            dernier_numero = PassageOperation.objects.filter(
-                operation=self.operation
-            ).aggregate(Max('numero'))['numero__max'] or 0
-            self.numero = dernier_numero + 1
+        update_fields = kwargs.get('update_fields')
+        renumeroter = (
+            self._state.adding
+            or self.date_prevue != getattr(self, '_date_prevue_initiale', None)
+        ) and (update_fields is None or 'date_prevue' in update_fields)
         
         # Sauvegarder d'abord
         super().save(*args, **kwargs)
+        self._date_prevue_initiale = self.date_prevue
         
         # ✅ RECALCUL AUTO des numéros après sauvegarde
-        self.operation.renumeroter_passages()
+        if renumeroter:
+            self._renumeroter()
+    
+    def delete(self, *args, **kwargs):
+        resultat = super().delete(*args, **kwargs)
+        self._renumeroter()
+        return resultat
+    
+    def _renumeroter(self):
+        nouveaux_numeros = PassageOperation.renumeroter(self.operation_id, using=self._state.db)
+        if self.pk in nouveaux_numeros:
+            self.numero = nouveaux_numeros[self.pk]
+    
+    @classmethod
+    def renumeroter(cls, operation_id, using='default'):
+        """
+        Une seule requête : UPDATE avec ROW_NUMBER() sur (date_prevue,
+        created_at), qui n'écrit que les passages dont le numéro change.
+        Retourne {id du passage: nouveau numéro} pour ces passages.
+        
+        Sans UPDATE ... RETURNING (SQLite < 3.35) : lecture des passages
+        puis un seul bulk_update des numéros qui changent.
+        """
+        connection = connections[using]
+        if not connection.features.can_return_columns_from_insert:
+            passages = list(
+                cls.objects.using(using).filter(operation_id=operation_id)
+                .order_by('date_prevue', 'created_at', 'pk').only('pk', 'numero')
+            )
+            modifies = []
+            for rang, passage in enumerate(passages, start=1):
+                if passage.numero != rang:
+                    passage.numero = rang
+                    modifies.append(passage)
+            cls.objects.using(using).bulk_update(modifies, ['numero'], batch_size=500)
+            return {passage.pk: passage.numero for passage in modifies}
+        
+        table = connection.ops.quote_name(cls._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                UPDATE {table} SET numero = rangs.rang
+                FROM (
+                    SELECT id, ROW_NUMBER() OVER (ORDER BY date_prevue, created_at) AS rang
+                    FROM {table}
+                    WHERE operation_id = %s
+                ) AS rangs
+                WHERE {table}.id = rangs.id AND {table}.numero <> rangs.rang
+                RETURNING {table}.id, {table}.numero
+                """,
+                [operation_id]
+            )
+            return dict(cursor.fetchall())
     
     @property
     def est_planifie(self):
@@ -420,6 +927,37 @@ class Devis(models.Model):
         help_text="Nombre de jours de validité"
     )
     
+    # Totaux stockés (maintenus automatiquement par les lignes du devis)
+    sous_total_ht = models.DecimalField(
+        max_digits=12,
+        decimal_places=2,
+        default=Decimal('0.00'),
+        editable=False,
+        verbose_name="Sous-total HT"
+    )
+    
+    total_tva = models.DecimalField(
+        max_digits=12,
+        decimal_places=2,
+        default=Decimal('0.00'),
+        editable=False,
+        verbose_name="Total TVA"
+    )
+    
+    total_ttc = models.DecimalField(
+        max_digits=12,
+        decimal_places=2,
+        default=Decimal('0.00'),
+        editable=False,
+        verbose_name="Total TTC"
+    )
+    
+    CHAMPS_TOTAUX = ['sous_total_ht', 'total_tva', 'total_ttc']
+    
+    # ✅ Compteur incrémenté à chaque écriture des totaux : un ajustement
+    # incrémental n'est appliqué que sur les totaux qu'il a lus
+    revision_totaux = models.PositiveIntegerField(default=0, editable=False)
+    
     class Meta:
         ordering = ['version']  # Du plus ancien au plus récent
         verbose_name = "Devis"
@@ -429,35 +967,20 @@ class Devis(models.Model):
     def __str__(self):
         return f"{self.numero_devis} - Version {self.version}"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Statut au chargement : l'état financier n'est recalculé que s'il change
+        instance._statut_initial = instance.__dict__.get('statut')
+        return instance
+    
+    # ✅ Numéro alloué dans la même transaction que l'enregistrement :
+    # en cas d'échec, le numéro n'est pas consommé (pas de trou)
+    @transaction.atomic
     def save(self, *args, **kwargs):
-        from django.db.models import Max
-        
         # Auto-générer le numéro si nouveau devis
         if not self.numero_devis:
-            import re
-            from datetime import datetime
-            
-            annee_courante = timezone.now().year
-            prefix = f'DEVIS-{annee_courante}-U{self.operation.user.id}-'
-            
-            # Récupérer tous les devis existants de cet utilisateur pour cette année
-            derniers_devis = Devis.objects.filter(
-                operation__user=self.operation.user,
-                numero_devis__startswith=prefix
-            ).values_list('numero_devis', flat=True)
-            
-            # Extraire le numéro le plus élevé
-            max_numero = 0
-            for devis in derniers_devis:
-                match = re.search(r'-(\d+)$', devis)
-                if match:
-                    numero = int(match.group(1))
-                    if numero > max_numero:
-                        max_numero = numero
-            
-            # Nouveau numéro = max + 1
-            nouveau_numero = max_numero + 1
-            self.numero_devis = f'{prefix}{nouveau_numero:05d}'
+            self.numero_devis = SequenceNumerotation.prochain_numero(self.operation.user, 'devis')
         
         # ✅ CORRECTION FINALE : Auto-incrémenter la version
         if not self.pk:  # Seulement pour les nouveaux devis
@@ -472,31 +995,92 @@ class Devis(models.Model):
             
             self.version = max_version + 1
         
+        # Le statut (accepté ou non) change le montant total de l'opération
+        update_fields = kwargs.get('update_fields')
+        if self._state.adding:
+            statut_modifie = self.statut == 'accepte'
+        else:
+            statut_modifie = (
+                (update_fields is None or 'statut' in update_fields)
+                and self.statut != getattr(self, '_statut_initial', None)
+            )
+        
+        # ✅ Les totaux ne sont écrits que par recalculer_totaux() / ajuster_totaux() :
+        # un devis chargé avant l'ajout d'une ligne ne doit pas les écraser
+        if not self._state.adding and update_fields is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.CHAMPS_TOTAUX + ['revision_totaux']
+            ]
+        
         super().save(*args, **kwargs)
+        self._statut_initial = self.statut
+        
+        if statut_modifie:
+            self.operation.recalculer_finances()
+    
+    def delete(self, *args, **kwargs):
+        operation = self.operation
+        resultat = super().delete(*args, **kwargs)
+        operation.recalculer_finances()
+        return resultat
     
     # ========================================
-    # PROPERTIES POUR CALCULS
+    # TOTAUX STOCKÉS
     # ========================================
-    @property
-    def sous_total_ht(self):
-        """Sous-total HT (somme des lignes HT)"""
-        total = self.lignes.aggregate(
-            total=Sum('montant')
-        )['total']
-        return total if total is not None else Decimal('0.00')
+    def recalculer_totaux(self):
+        """Recalcule et enregistre les totaux depuis les lignes (1 lecture + 1 UPDATE)"""
+        totaux = calculer_totaux(
+            self.lignes.order_by().values_list('montant', 'taux_tva')
+        )
+        Devis.objects.filter(pk=self.pk).update(**totaux, revision_totaux=F('revision_totaux') + 1)
+        for champ, valeur in totaux.items():
+            setattr(self, champ, valeur)
+        # Révision inconnue en mémoire : le prochain ajustement recalculera
+        self.revision_totaux = None
+        
+        # Seuls les devis acceptés comptent dans le montant de l'opération
+        if self.statut == 'accepte':
+            self.operation.recalculer_finances()
+        return totaux
     
-    @property
-    def total_tva(self):
-        """Total de la TVA"""
-        total_tva = Decimal('0.00')
-        for ligne in self.lignes.all():
-            total_tva += ligne.montant_tva
-        return total_tva
+    def ajuster_totaux(self, delta_ht, delta_tva):
+        """
+        Totaux après l'ajout, la modification ou la suppression d'une ligne
+        (écarts HT et TVA de cette ligne), sans relire les lignes : 1 UPDATE.
+        
+        L'UPDATE n'est appliqué que si la révision n'a pas changé depuis le
+        chargement du devis. Sinon (autre écriture entre-temps, révision
+        inconnue), les totaux en mémoire sont périmés : recalcul complet.
+        """
+        if self.revision_totaux is None:
+            return self.recalculer_totaux()
+        
+        totaux = {
+            'sous_total_ht': self.sous_total_ht + delta_ht,
+            'total_tva': self.total_tva + delta_tva,
+        }
+        totaux['total_ttc'] = totaux['sous_total_ht'] + totaux['total_tva']
+        
+        a_jour = Devis.objects.filter(pk=self.pk, revision_totaux=self.revision_totaux).update(
+            **totaux, revision_totaux=self.revision_totaux + 1
+        )
+        if not a_jour:
+            return self.recalculer_totaux()
+        
+        for champ, valeur in totaux.items():
+            setattr(self, champ, valeur)
+        self.revision_totaux += 1
+        
+        if self.statut == 'accepte':
+            self.operation.recalculer_finances()
+        return totaux
     
-    @property
-    def total_ttc(self):
-        """Total TTC (ce que paie le client)"""
-        return self.sous_total_ht + self.total_tva
+    @classmethod
+    def recalculer_totaux_pour(cls, devis_ids):
+        """Recalcule les totaux d'un ensemble de devis (chemins bulk)"""
+        for devis in cls.objects.filter(pk__in=set(devis_ids)).only('pk', 'statut', 'operation_id'):
+            devis.recalculer_totaux()
     
     @property
     def date_limite(self):
@@ -539,6 +1123,46 @@ class Devis(models.Model):
 # ========================================
 # NOUVEAU MODÈLE : LIGNE DE DEVIS
 # ========================================
+class LigneDevisQuerySet(models.QuerySet):
+    """
+    Les opérations en masse contournent save()/delete() :
+    on y recalcule donc les totaux des devis concernés.
+    
+    recalculer=False : l'appelant enchaîne plusieurs opérations en masse
+    sur un même devis et recalcule ses totaux une seule fois à la fin.
+    """
+    
+    def bulk_create(self, objs, *args, recalculer=True, **kwargs):
+        objs = list(objs)
+        for ligne in objs:
+            ligne.montant = ligne.calculer_montant()
+        resultat = super().bulk_create(objs, *args, **kwargs)
+        if recalculer:
+            Devis.recalculer_totaux_pour(ligne.devis_id for ligne in objs)
+        return resultat
+    
+    def bulk_update(self, objs, fields, *args, recalculer=True, **kwargs):
+        objs = list(objs)
+        fields = list(fields)
+        if 'quantite' in fields or 'prix_unitaire_ht' in fields:
+            for ligne in objs:
+                ligne.montant = ligne.calculer_montant()
+            if 'montant' not in fields:
+                fields.append('montant')
+        resultat = super().bulk_update(objs, fields, *args, **kwargs)
+        if recalculer:
+            Devis.recalculer_totaux_pour(ligne.devis_id for ligne in objs)
+        return resultat
+    
+    def delete(self, recalculer=True):
+        if not recalculer:
+            return super().delete()
+        devis_ids = list(self.values_list('devis_id', flat=True).distinct())
+        resultat = super().delete()
+        Devis.recalculer_totaux_pour(devis_ids)
+        return resultat
+
+
 class LigneDevis(models.Model):
     UNITES_CHOICES = [
         ('unite', 'Unité'),
@@ -593,23 +1217,66 @@ class LigneDevis(models.Model):
     
     ordre = models.PositiveIntegerField(default=1)
     
+    objects = LigneDevisQuerySet.as_manager()
+    
     class Meta:
         ordering = ['ordre']
         verbose_name = "Ligne de devis"
         verbose_name_plural = "Lignes de devis"
+        indexes = [
+            # Lignes d'un devis dans l'ordre, dernier ordre (ajout d'une ligne)
+            models.Index(fields=['devis', 'ordre'], name='ligne_devis_ordre_idx'),
+        ]
     
     def __str__(self):
         return f"{self.description} - {self.montant}€ HT"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._part_enregistree = instance._part_totaux()
+        return instance
+    
+    def calculer_montant(self):
+        """Montant HT (quantité × prix unitaire HT), au centime comme en base"""
+        return arrondir_montant(self.quantite * self.prix_unitaire_ht)
+    
+    def _part_totaux(self):
+        """(HT, TVA) de la ligne dans les totaux du devis, None si champs non chargés"""
+        if 'montant' not in self.__dict__ or 'taux_tva' not in self.__dict__:
+            return None
+        return self.montant, calculer_tva(self.montant, Decimal(str(self.taux_tva)))
+    
     def save(self, *args, **kwargs):
-        """Calcul automatique du montant HT"""
-        self.montant = self.quantite * self.prix_unitaire_ht
+        """Calcul automatique du montant HT + ajustement des totaux du devis"""
+        self.montant = self.calculer_montant()
+        avant = None if self._state.adding else getattr(self, '_part_enregistree', None)
+        # Enregistrement partiel : la part en base n'est pas forcément celle en mémoire
+        incremental = kwargs.get('update_fields') is None and (self._state.adding or avant is not None)
         super().save(*args, **kwargs)
+        
+        apres = self._part_totaux()
+        self._part_enregistree = apres if incremental else None
+        if incremental:
+            avant = avant or (Decimal('0.00'), Decimal('0.00'))
+            self.devis.ajuster_totaux(apres[0] - avant[0], apres[1] - avant[1])
+        else:
+            self.devis.recalculer_totaux()
+    
+    def delete(self, *args, **kwargs):
+        devis = self.devis
+        part = getattr(self, '_part_enregistree', None)
+        resultat = super().delete(*args, **kwargs)
+        if part is not None:
+            devis.ajuster_totaux(-part[0], -part[1])
+        else:
+            devis.recalculer_totaux()
+        return resultat
     
     @property
     def montant_tva(self):
         """Montant de la TVA pour cette ligne"""
-        return (self.montant * self.taux_tva) / Decimal('100')
+        return calculer_tva(self.montant, self.taux_tva)
     
     @property
     def montant_ttc(self):
@@ -685,6 +1352,8 @@ class Intervention(models.Model):
     
     ordre = models.PositiveIntegerField(default=1)
     
+    objects = FinancesOperationQuerySet.as_manager()
+    
     class Meta:
         ordering = ['ordre']
         verbose_name = "Intervention"
@@ -699,10 +1368,17 @@ class Intervention(models.Model):
             self.montant = self.quantite * self.prix_unitaire_ht
         
         super().save(*args, **kwargs)
+        self.operation.recalculer_finances()
+    
+    def delete(self, *args, **kwargs):
+        operation = self.operation
+        resultat = super().delete(*args, **kwargs)
+        operation.recalculer_finances()
+        return resultat
     
     @property
     def montant_tva(self):
-        return (self.montant * self.taux_tva) / Decimal('100')
+        return calculer_tva(self.montant, self.taux_tva)
     
     @property
     def montant_ttc(self):
@@ -748,14 +1424,36 @@ class Echeance(models.Model):
         verbose_name="Type de facture"
     )
     
+    objects = FinancesOperationQuerySet.as_manager()
+    
     class Meta:
         ordering = ['ordre']
         verbose_name = "Échéance de paiement"
         verbose_name_plural = "Échéances de paiement"
+        indexes = [
+            # Échéances impayées / en retard d'une opération (partiel, cf. PassageOperation)
+            models.Index(
+                fields=['operation', 'date_echeance'], condition=Q(paye=False),
+                name='echeance_impayee_idx'
+            ),
+        ]
     
     def __str__(self):
         return f"Échéance {self.numero} - {self.montant}€ ({self.operation.id_operation})"
     
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # Seuls le montant et le statut payé influent sur l'opération
+        champs = kwargs.get('update_fields')
+        if champs is None or {'montant', 'paye', 'operation'} & set(champs):
+            self.operation.recalculer_finances(echeances_seulement=True)
+    
+    def delete(self, *args, **kwargs):
+        operation = self.operation
+        resultat = super().delete(*args, **kwargs)
+        operation.recalculer_finances(echeances_seulement=True)
+        return resultat
+    
     def statut_display(self):
         """Retourne le statut dynamique de l'échéance"""
         if self.paye:
@@ -771,6 +1469,95 @@ class Echeance(models.Model):
         return self.paye and not self.facture_generee
 
 
+# ========================================
+# NUMÉROTATION DES DEVIS ET FACTURES
+# ========================================
+class SequenceNumerotation(models.Model):
+    """
+    Compteur par utilisateur, année et type de document.
+
+    L'allocation incrémente la ligne par un UPDATE : la base pose un verrou
+    sur la ligne jusqu'à la fin de la transaction, deux requêtes parallèles
+    ne peuvent donc pas obtenir le même numéro. Si la transaction échoue,
+    l'incrément est annulé avec elle : pas de trou dans la numérotation.
+    """
+    
+    TYPE_CHOICES = [
+        ('devis', 'Devis'),
+        ('facture', 'Facture'),
+    ]
+    
+    PREFIXES = {
+        'devis': 'DEVIS',
+        'facture': 'FACTURE',
+    }
+    
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sequences_numerotation')
+    annee = models.PositiveIntegerField(verbose_name="Année")
+    type_document = models.CharField(max_length=20, choices=TYPE_CHOICES, verbose_name="Type de document")
+    dernier_numero = models.PositiveIntegerField(default=0, verbose_name="Dernier numéro attribué")
+    
+    class Meta:
+        verbose_name = "Séquence de numérotation"
+        verbose_name_plural = "Séquences de numérotation"
+        unique_together = [['user', 'annee', 'type_document']]
+    
+    def __str__(self):
+        return f"{self.prefixe(self.user_id, self.annee, self.type_document)}{self.dernier_numero:05d}"
+    
+    @classmethod
+    def prefixe(cls, user_id, annee, type_document):
+        return f'{cls.PREFIXES[type_document]}-{annee}-U{user_id}-'
+    
+    @classmethod
+    def numeros_existants(cls, user_id, annee, type_document):
+        """Numéros déjà attribués (parcours de l'historique, pour l'initialisation seulement)"""
+        prefix = cls.prefixe(user_id, annee, type_document)
+        if type_document == 'devis':
+            numeros = Devis.objects.filter(
+                operation__user_id=user_id, numero_devis__startswith=prefix
+            ).values_list('numero_devis', flat=True)
+        else:
+            numeros = Echeance.objects.filter(
+                operation__user_id=user_id, numero_facture__startswith=prefix
+            ).values_list('numero_facture', flat=True)
+        
+        for numero in numeros:
+            match = re.search(r'-(\d+)$', numero)
+            if match:
+                yield int(match.group(1))
+    
+    @classmethod
+    def allouer(cls, user, type_document, annee=None):
+        """Alloue le prochain numéro de la séquence (O(1), verrou de ligne)"""
+        annee = annee or timezone.now().year
+        sequence = cls.objects.filter(user=user, annee=annee, type_document=type_document)
+        
+        with transaction.atomic():
+            if not sequence.update(dernier_numero=F('dernier_numero') + 1):
+                # Première allocation de l'année : on repart des numéros existants
+                depart = max(cls.numeros_existants(user.id, annee, type_document), default=0)
+                try:
+                    with transaction.atomic():
+                        cls.objects.create(
+                            user=user, annee=annee, type_document=type_document,
+                            dernier_numero=depart + 1
+                        )
+                    return depart + 1
+                except IntegrityError:
+                    # Séquence créée en parallèle : on incrémente la sienne
+                    sequence.update(dernier_numero=F('dernier_numero') + 1)
+            
+            return sequence.values_list('dernier_numero', flat=True).get()
+    
+    @classmethod
+    def prochain_numero(cls, user, type_document, annee=None):
+        """Numéro formaté, ex : FACTURE-2025-U3-00042"""
+        annee = annee or timezone.now().year
+        numero = cls.allouer(user, type_document, annee=annee)
+        return f'{cls.prefixe(user.id, annee, type_document)}{numero:05d}'
+
+
 # ========================================
 # MODÈLE HISTORIQUE (INCHANGÉ)
 # ========================================
@@ -782,6 +1569,10 @@ class HistoriqueOperation(models.Model):
     
     class Meta:
         ordering = ['-date']
+        indexes = [
+            # Dernières entrées d'une opération (détail, liste des opérations)
+            models.Index(fields=['operation', '-date'], name='historique_op_date_idx'),
+        ]
     
     def __str__(self):
         return f"{self.operation.id_operation} - {self.action}"
@@ -0,0 +1,95 @@
+# ================================
+# core/pagination.py - Pagination par curseur (keyset)
+# ================================
+#
+# Au lieu d'un OFFSET (coût proportionnel à la position dans la liste),
+# chaque page repart des valeurs de tri de la dernière ligne affichée :
+# WHERE (date_creation, id) < (curseur) ORDER BY date_creation DESC, id DESC
+# LIMIT n. Le coût d'une page dépend de sa taille, pas du volume du compte.
+
+import base64
+import json
+import operator
+from functools import reduce
+
+from django.db.models import Q
+
+
+TAILLE_PAGE = 50
+
+
+def encoder_curseur(valeurs):
+    """Curseur opaque (base64 url) à partir des valeurs de tri d'une ligne"""
+    brut = json.dumps([v.isoformat() if hasattr(v, 'isoformat') else v for v in valeurs])
+    return base64.urlsafe_b64encode(brut.encode()).decode().rstrip('=')
+
+
+def decoder_curseur(curseur, model, ordre):
+    """Valeurs de tri d'un curseur, converties selon les champs ; None si invalide"""
+    try:
+        brut = base64.urlsafe_b64decode(curseur + '=' * (-len(curseur) % 4))
+        valeurs = json.loads(brut)
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(valeurs, list) or len(valeurs) != len(ordre):
+        return None
+
+    converties = []
+    for champ, valeur in zip(ordre, valeurs):
+        nom = champ.lstrip('-')
+        field = model._meta.pk if nom == 'pk' else model._meta.get_field(nom)
+        try:
+            converties.append(field.to_python(valeur))
+        except Exception:
+            return None
+    return converties
+
+
+def q_apres(ordre, valeurs):
+    """
+    Lignes situées après `valeurs` dans l'ordre donné (comparaison de tuples) :
+    (a > va) OR (a = va AND b > vb) OR ...
+    """
+    conditions = []
+    egalites = {}
+    for champ, valeur in zip(ordre, valeurs):
+        nom = champ.lstrip('-')
+        lookup = 'lt' if champ.startswith('-') else 'gt'
+        conditions.append(Q(**egalites, **{f'{nom}__{lookup}': valeur}))
+        egalites[nom] = valeur
+    return reduce(operator.or_, conditions)
+
+
+def paginer(queryset, ordre, curseur=None, taille=TAILLE_PAGE):
+    """
+    Page de `taille` lignes après le curseur, dans l'ordre `ordre` (dont le
+    dernier champ doit être unique, typiquement 'pk' ou '-pk').
+
+    Deux requêtes : les clés de la page (colonnes de tri seulement, sans
+    les annotations du SELECT), puis les lignes complètes de ces clés. Les
+    annotations coûteuses ne sont ainsi calculées que pour la page, pas
+    pour toutes les lignes à trier.
+
+    Retourne (lignes, curseur_suivant) ; curseur_suivant est None sur la
+    dernière page. Un curseur invalide repart du début.
+    """
+    champs = [champ.lstrip('-') for champ in ordre]
+
+    cles = queryset.order_by(*ordre)
+    if curseur:
+        valeurs = decoder_curseur(curseur, queryset.model, ordre)
+        if valeurs is not None:
+            cles = cles.filter(q_apres(ordre, valeurs))
+    cles = list(cles.values_list(*champs)[:taille + 1])
+
+    curseur_suivant = None
+    if len(cles) > taille:
+        cles = cles[:taille]
+        curseur_suivant = encoder_curseur(cles[-1])
+
+    position = {cle[-1]: index for index, cle in enumerate(cles)}
+    lignes = sorted(
+        queryset.order_by().filter(pk__in=list(position)),
+        key=lambda ligne: position[ligne.pk]
+    )
+    return lignes, curseur_suivant
@@ -0,0 +1,254 @@
+# ================================
+# core/recherche.py - Recherche indexée (opérations, clients)
+# ================================
+#
+# Chaque opération / client stocke un document de recherche normalisé
+# (texte_recherche : minuscules, sans accents) maintenu à l'enregistrement.
+# La recherche « contient » porte sur cette seule colonne :
+#
+# - PostgreSQL : index GIN trigrammes (pg_trgm) sur texte_recherche,
+#   utilisé par LIKE '%...%'
+# - SQLite : table FTS5 (tokenizer trigram) indexée par l'id de la ligne
+# - identifiants exacts (U12OPAB12CD) et numéros de téléphone complets :
+#   chemin rapide sur une colonne indexée (btree)
+
+import re
+import unicodedata
+
+from django.db import connections
+from django.db.models.expressions import RawSQL
+
+
+# Identifiants générés par Operation.save() / Client.save()
+ID_OPERATION_REGEX = re.compile(r'^U\d+OP[A-Z0-9]{6}$')
+ID_CLIENT_REGEX = re.compile(r'^U\d+CL[A-Z0-9]{6}$')
+
+# Numéro de téléphone complet (chiffres seulement, avec ou sans indicatif)
+TELEPHONE_MIN_CHIFFRES = 10
+
+# Champs qui composent les documents de recherche
+CHAMPS_RECHERCHE_CLIENT = ['id_client', 'nom', 'prenom', 'email', 'telephone', 'ville', 'adresse']
+CHAMPS_RECHERCHE_OPERATION = ['id_operation', 'type_prestation', 'adresse_intervention', 'commentaires']
+# Champs du client repris dans le document de ses opérations
+CHAMPS_CLIENT_OPERATION = ['nom', 'prenom', 'telephone', 'ville']
+
+# Champs dont un mot peut commencer par le terme saisi (saisie semi-automatique),
+# dans l'ordre du document de suggestion : le nom en tête
+CHAMPS_SUGGESTION_CLIENT = ['nom', 'prenom', 'ville']
+
+# Le tokenizer trigram ne sait chercher qu'à partir de 3 caractères
+FTS_MIN_CARACTERES = 3
+
+
+def normaliser(texte):
+    """Minuscules, sans accents, espaces compactés"""
+    texte = unicodedata.normalize('NFKD', str(texte or ''))
+    texte = ''.join(c for c in texte if not unicodedata.combining(c))
+    return ' '.join(texte.lower().split())
+
+
+def chiffres(texte):
+    """Chiffres seuls d'un numéro de téléphone ('06 01-02' -> '060102')"""
+    return re.sub(r'\D', '', texte or '')
+
+
+def document_client(valeurs):
+    """Document de recherche d'un client (valeurs : dict des champs)"""
+    morceaux = [valeurs.get(champ) for champ in CHAMPS_RECHERCHE_CLIENT]
+    morceaux.append(chiffres(valeurs.get('telephone')))
+    return normaliser(' '.join(m for m in morceaux if m))
+
+
+def document_suggestion(valeurs):
+    """
+    Mots du nom, du prénom et de la ville d'un client, chacun précédé d'une
+    espace (' dupont jean paris') : « un mot commence par X » s'écrit
+    LIKE '% X%', « le nom commence par X » est un intervalle indexé.
+    """
+    texte = normaliser(' '.join(valeurs.get(champ) or '' for champ in CHAMPS_SUGGESTION_CLIENT))
+    return ' ' + texte if texte else ''
+
+
+def document_operation(valeurs, client):
+    """Document de recherche d'une opération, avec les champs de son client"""
+    morceaux = [valeurs.get(champ) for champ in CHAMPS_RECHERCHE_OPERATION]
+    morceaux += [client.get(champ) for champ in CHAMPS_CLIENT_OPERATION]
+    morceaux.append(chiffres(client.get('telephone')))
+    return normaliser(' '.join(m for m in morceaux if m))
+
+
+# ========================================
+# INDEX FTS5 (SQLite)
+# ========================================
+
+def table_fts(model):
+    return f'{model._meta.db_table}_fts'
+
+
+# (alias, table) des tables FTS5 déjà trouvées
+_tables_fts = set()
+
+
+def fts_disponible(model, using='default'):
+    """La table FTS5 du modèle existe (SQLite avec FTS5 et tokenizer trigram)"""
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return False
+    cle = (using, table_fts(model))
+    if cle not in _tables_fts:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [table_fts(model)]
+            )
+            if cursor.fetchone() is None:
+                return False
+        _tables_fts.add(cle)
+    return True
+
+
+def indexer(model, documents, using='default'):
+    """
+    Met à jour l'index FTS5 pour {pk: texte_recherche}. Sans effet hors
+    SQLite : l'index trigramme PostgreSQL suit la colonne.
+
+    Les lignes supprimées n'ont pas besoin d'être retirées : les ids ne sont
+    pas réutilisés et la recherche repasse par la table du modèle.
+    """
+    if not documents or not fts_disponible(model, using):
+        return
+    table = table_fts(model)
+    with connections[using].cursor() as cursor:
+        cursor.executemany(f'DELETE FROM {table} WHERE rowid = %s', [[pk] for pk in documents])
+        cursor.executemany(
+            f'INSERT INTO {table} (rowid, texte_recherche) VALUES (%s, %s)',
+            list(documents.items())
+        )
+
+
+def reconstruire_index(model, using='default'):
+    """Recharge tout l'index FTS5 depuis texte_recherche"""
+    if not fts_disponible(model, using):
+        return
+    table = table_fts(model)
+    with connections[using].cursor() as cursor:
+        cursor.execute(f'DELETE FROM {table}')
+        cursor.execute(
+            f'INSERT INTO {table} (rowid, texte_recherche) '
+            f'SELECT id, texte_recherche FROM {model._meta.db_table}'
+        )
+
+
+# ========================================
+# FILTRES
+# ========================================
+
+def filtrer_texte(queryset, terme):
+    """Lignes dont le document de recherche contient le terme normalisé"""
+    terme = normaliser(terme)
+    if not terme:
+        return queryset
+
+    model = queryset.model
+    if len(terme) >= FTS_MIN_CARACTERES and fts_disponible(model, queryset.db):
+        # Phrase FTS5 : sous-chaîne exacte avec le tokenizer trigram
+        phrase = '"' + terme.replace('"', '""') + '"'
+        ids = RawSQL(
+            f'SELECT rowid FROM {table_fts(model)} WHERE texte_recherche MATCH %s', [phrase]
+        )
+        return queryset.filter(pk__in=ids)
+
+    # PostgreSQL : LIKE '%terme%' servi par l'index GIN trigrammes
+    return queryset.filter(texte_recherche__contains=terme)
+
+
+def chemin_rapide(queryset, terme, regex_id, champ_id, champ_telephone):
+    """
+    Filtre exact indexé si le terme est un identifiant ou un numéro complet
+    et qu'il trouve au moins une ligne, sinon None.
+    """
+    terme = terme.strip()
+    if regex_id.match(terme.upper()):
+        exact = queryset.filter(**{champ_id: terme.upper()})
+    elif len(chiffres(terme)) >= TELEPHONE_MIN_CHIFFRES and not re.search(r'[^\d\s.\-+()]', terme):
+        exact = queryset.filter(**{champ_telephone: chiffres(terme)})
+    else:
+        return None
+    return exact if exact.exists() else None
+
+
+def rechercher_operations(queryset, terme):
+    """Recherche libre dans les opérations (et leur client)"""
+    if not terme or not terme.strip():
+        return queryset
+    exact = chemin_rapide(
+        queryset, terme, ID_OPERATION_REGEX, 'id_operation', 'client__telephone_chiffres'
+    )
+    return exact if exact is not None else filtrer_texte(queryset, terme)
+
+
+def rechercher_clients(queryset, terme):
+    """Recherche libre dans les clients"""
+    if not terme or not terme.strip():
+        return queryset
+    exact = chemin_rapide(queryset, terme, ID_CLIENT_REGEX, 'id_client', 'telephone_chiffres')
+    return exact if exact is not None else filtrer_texte(queryset, terme)
+
+
+# ========================================
+# SAISIE SEMI-AUTOMATIQUE
+# ========================================
+
+SUGGESTIONS_DEFAUT = 10
+SUGGESTIONS_MAX = 20
+
+# Préfixe de numéro : au moins 2 chiffres (« 06 »), préfixe de nom : 2 caractères (« Du »)
+TELEPHONE_PREFIXE_MIN_CHIFFRES = 2
+SUGGESTION_MIN_CARACTERES = 2
+
+
+def suivant(prefixe):
+    """Plus petite chaîne qui suit tous les textes commençant par le préfixe"""
+    return prefixe[:-1] + chr(ord(prefixe[-1]) + 1)
+
+
+def suggerer_clients(queryset, terme, limite=SUGGESTIONS_DEFAUT):
+    """
+    Clients pour la saisie semi-automatique, triés par nom, au plus
+    `limite` (LIMIT en SQL) :
+
+    - terme numérique : numéro de téléphone commençant par ces chiffres
+      (intervalle sur la colonne indexée telephone_chiffres)
+    - sinon : chaque mot du terme commence un mot du nom, du prénom ou de
+      la ville, vérifié en SQL sur texte_suggestion (ces seuls champs).
+      Les lignes candidates viennent d'un index : recherche plein texte sur
+      le mot le plus long (au moins FTS_MIN_CARACTERES), sinon début du nom
+      (intervalle sur (user, texte_suggestion)) pour un terme court (« Du »).
+    """
+    terme = (terme or '').strip()
+    if not terme:
+        return []
+
+    clients = queryset.order_by('nom', 'prenom', 'pk')
+
+    numero = chiffres(terme)
+    if numero and not re.search(r'[^\d\s.\-+()]', terme):
+        if len(numero) < TELEPHONE_PREFIXE_MIN_CHIFFRES:
+            return []
+        # 'numero' <= telephone_chiffres < 'numero' suivant : préfixe servi par l'index
+        return list(clients.filter(telephone_chiffres__gte=numero, telephone_chiffres__lt=suivant(numero))[:limite])
+
+    mots = normaliser(terme).split()
+    plus_long = max(mots, key=len)
+    if len(plus_long) < SUGGESTION_MIN_CARACTERES:
+        return []
+
+    if len(plus_long) >= FTS_MIN_CARACTERES:
+        clients = filtrer_texte(clients, plus_long)
+    else:
+        debut = ' ' + mots[0]
+        clients = clients.filter(texte_suggestion__gte=debut, texte_suggestion__lt=suivant(debut))
+
+    # Début d'un mot du nom, du prénom ou de la ville, pour chaque mot du terme
+    for mot in mots:
+        clients = clients.filter(texte_suggestion__contains=' ' + mot)
+    return list(clients[:limite])
@@ -0,0 +1,1936 @@
+import io
+import json
+import re
+import threading
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock, skipIf
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, connections, transaction
+from django.template import Context, Template
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .calendrier import construire_evenements_calendrier
+from .dates import intervalle_jours, jour_local, q_jours
+from .management.commands.verifier_plans_requetes import NOM_UTILISATEUR_GENERE, expliquer, tri_sans_index
+from .facturation import FacturationError, emettre_facture
+from .recherche import fts_disponible, rechercher_clients, rechercher_operations, reconstruire_index
+from .compteurs import (
+    annoter_categories,
+    annoter_clients,
+    annoter_dernier_devis,
+    calculer_compteurs_devis,
+    calculer_compteurs_operations,
+    calculer_kpi_dashboard,
+    calculer_kpi_financiers,
+    calculer_totaux_client,
+)
+from .models import (
+    Client,
+    Operation,
+    Devis,
+    LigneDevis,
+    Intervention,
+    Echeance,
+    HistoriqueOperation,
+    PassageOperation,
+    SequenceNumerotation,
+    calculer_totaux,
+)
+
+
+class DonneesMixin:
+    """Helpers de création de données de test"""
+
+    def creer_user(self, username='artisan'):
+        return User.objects.create_user(username=username, password='motdepasse-test')
+
+    def creer_client(self, user, nom='Dupont'):
+        return Client.objects.create(
+            user=user, nom=nom, prenom='Jean', telephone='0601020304',
+            adresse='1 rue de la Paix', ville='Paris'
+        )
+
+    def creer_operation(self, user, client, **kwargs):
+        kwargs.setdefault('type_prestation', 'Plomberie')
+        kwargs.setdefault('adresse_intervention', '1 rue de la Paix')
+        return Operation.objects.create(user=user, client=client, **kwargs)
+
+    def creer_devis(self, operation, lignes=(), **kwargs):
+        devis = Devis.objects.create(operation=operation, **kwargs)
+        for ordre, (prix, tva) in enumerate(lignes, start=1):
+            LigneDevis.objects.create(
+                devis=devis, description=f'Ligne {ordre}', quantite=Decimal('1'),
+                prix_unitaire_ht=Decimal(prix), taux_tva=Decimal(tva), ordre=ordre
+            )
+        return devis
+
+
+class CompteursOperationsTests(DonneesMixin, TestCase):
+
+    def setUp(self):
+        self.user = self.creer_user()
+        self.client_crm = self.creer_client(self.user)
+        self.now = timezone.now()
+        self.today = self.now.date()
+
+    def test_compteurs_par_categorie(self):
+        # Réalisée, échéance en retard et reste à encaisser
+        op_retard = self.creer_operation(self.user, self.client_crm, statut='realise')
+        Intervention.objects.create(
+            operation=op_retard, description='Pose', prix_unitaire_ht=Decimal('100'),
+            taux_tva=Decimal('10')
+        )
+        Echeance.objects.create(
+            operation=op_retard, numero=1, montant=Decimal('50'),
+            date_echeance=self.today - timedelta(days=3), paye=False
+        )
+
+        # Devis envoyé et expiré
+        op_expire = self.creer_operation(self.user, self.client_crm, avec_devis=True)
+        self.creer_devis(
+            op_expire, statut='envoye', validite_jours=10,
+            date_envoi=self.today - timedelta(days=20)
+        )
+
+        # Devis envoyé en attente (non expiré) + passage à venir
+        op_attente = self.creer_operation(self.user, self.client_crm, avec_devis=True, statut='planifie')
+        self.creer_devis(
+            op_attente, statut='envoye', validite_jours=30,
+            date_envoi=self.today - timedelta(days=5)
+        )
+        PassageOperation.objects.create(operation=op_attente, date_prevue=self.now + timedelta(days=10))
+
+        # À planifier, avec devis brouillon
+        op_brouillon = self.creer_operation(self.user, self.client_crm, avec_devis=True, statut='a_planifier')
+        self.creer_devis(op_brouillon, statut='brouillon')
+
+        # Payée (archivée)
+        self.creer_operation(self.user, self.client_crm, statut='paye')
+
+        # Opération d'un autre utilisateur : ignorée
+        autre = self.creer_user('autre')
+        self.creer_operation(autre, self.creer_client(autre), statut='a_planifier')
+
+        compteurs = calculer_compteurs_operations(self.user, now=self.now)
+
+        self.assertEqual(compteurs['nb_total'], 5)
+        self.assertEqual(compteurs['nb_paiements_retard'], 1)
+        self.assertEqual(compteurs['nb_devis_expire'], 1)
+        self.assertEqual(compteurs['nb_urgences'], 2)
+        self.assertEqual(compteurs['nb_a_encaisser'], 1)
+        self.assertEqual(compteurs['nb_operations_sans_paiement'], 1)
+        self.assertEqual(compteurs['nb_a_faire'], 1)
+        self.assertEqual(compteurs['nb_en_cours'], 2)
+        self.assertEqual(compteurs['nb_a_venir'], 1)
+        self.assertEqual(compteurs['nb_archivees'], 1)
+        self.assertEqual(compteurs['nb_devis_brouillon'], 1)
+        self.assertEqual(compteurs['nb_devis_en_attente'], 1)
+        self.assertEqual(compteurs['nb_sans_devis'], 0)
+
+    def test_nombre_de_requetes_constant(self):
+        for i in range(5):
+            op = self.creer_operation(self.user, self.client_crm, statut='realise')
+            Echeance.objects.create(
+                operation=op, numero=1, montant=Decimal('10'),
+                date_echeance=self.today - timedelta(days=1)
+            )
+
+        with CaptureQueriesContext(connection) as requetes_5:
+            calculer_compteurs_operations(self.user, now=self.now)
+
+        for i in range(20):
+            self.creer_operation(self.user, self.client_crm, statut='planifie')
+
+        with CaptureQueriesContext(connection) as requetes_25:
+            calculer_compteurs_operations(self.user, now=self.now)
+
+        self.assertEqual(len(requetes_5), len(requetes_25))
+        self.assertLessEqual(len(requetes_25), 2)
+
+
+class DernierDevisTests(DonneesMixin, TestCase):
+
+    def setUp(self):
+        self.user = self.creer_user()
+        self.client_crm = self.creer_client(self.user)
+        self.today = timezone.now().date()
+
+    def test_classement_selon_le_dernier_devis(self):
+        # Version 1 acceptée, version 2 envoyée puis expirée : c'est la v2 qui compte
+        op_expire = self.creer_operation(self.user, self.client_crm, avec_devis=True)
+        self.creer_devis(op_expire, statut='accepte')
+        self.creer_devis(
+            op_expire, statut='envoye', validite_jours=15,
+            date_envoi=self.today - timedelta(days=30)
+        )
+
+        op_envoye = self.creer_operation(self.user, self.client_crm, avec_devis=True)
+        self.creer_devis(
+            op_envoye, statut='envoye', validite_jours=15,
+            date_envoi=self.today - timedelta(days=15)
+        )
+
+        op_brouillon = self.creer_operation(self.user, self.client_crm, avec_devis=True)
+        self.creer_devis(op_brouillon, statut='refuse')
+        self.creer_devis(op_brouillon, statut='brouillon')
+
+        # Avec devis mais aucun devis créé : non comptée
+        self.creer_operation(self.user, self.client_crm, avec_devis=True)
+
+        operations = annoter_dernier_devis(Operation.objects.filter(user=self.user), today=self.today)
+        categories = dict(operations.values_list('id', 'dernier_devis_categorie'))
+
+        self.assertEqual(categories[op_expire.id], 'expire')
+        self.assertEqual(categories[op_envoye.id], 'envoye')
+        self.assertEqual(categories[op_brouillon.id], 'brouillon')
+
+        with self.assertNumQueries(1):
+            compteurs = calculer_compteurs_devis(Operation.objects.filter(user=self.user), today=self.today)
+
+        self.assertEqual(compteurs['nb_devis_total'], 3)
+        self.assertEqual(compteurs['nb_devis_expire'], 1)
+        self.assertEqual(compteurs['nb_devis_envoye'], 1)
+        self.assertEqual(compteurs['nb_devis_brouillon'], 1)
+        self.assertEqual(compteurs['nb_devis_accepte'], 0)
+
+
+class TotauxDevisTests(DonneesMixin, TestCase):
+
+    def setUp(self):
+        self.user = self.creer_user()
+        self.operation = self.creer_operation(self.user, self.creer_client(self.user), avec_devis=True)
+        self.devis = self.creer_devis(self.operation)
+
+    def assertTotaux(self, devis, ht, tva, ttc):
+        devis.refresh_from_db()
+        self.assertEqual(devis.sous_total_ht, Decimal(ht))
+        self.assertEqual(devis.total_tva, Decimal(tva))
+        self.assertEqual(devis.total_ttc, Decimal(ttc))
+
+    def test_totaux_maintenus_par_les_lignes(self):
+        ligne = LigneDevis.objects.create(
+            devis=self.devis, description='Pose', quantite=Decimal('2'),
+            prix_unitaire_ht=Decimal('33.33'), taux_tva=Decimal('5.5')
+        )
+        # TVA arrondie au centime par ligne : 66.66 × 5.5 % = 3.6663 → 3.67
+        self.assertTotaux(self.devis, '66.66', '3.67', '70.33')
+
+        ligne.quantite = Decimal('1')
+        ligne.save()
+        self.assertTotaux(self.devis, '33.33', '1.83', '35.16')
+
+        ligne.delete()
+        self.assertTotaux(self.devis, '0.00', '0.00', '0.00')
+
+    def test_totaux_maintenus_en_masse(self):
+        lignes = LigneDevis.objects.bulk_create([
+            LigneDevis(devis=self.devis, description='A', prix_unitaire_ht=Decimal('100'), taux_tva=Decimal('20')),
+            LigneDevis(devis=self.devis, description='B', prix_unitaire_ht=Decimal('50'), taux_tva=Decimal('10')),
+        ])
+        self.assertTotaux(self.devis, '150.00', '25.00', '175.00')
+
+        lignes = list(self.devis.lignes.all())
+        for ligne in lignes:
+            ligne.quantite = Decimal('2')
+        LigneDevis.objects.bulk_update(lignes, ['quantite'])
+        self.assertTotaux(self.devis, '300.00', '50.00', '350.00')
+
+        self.devis.lignes.filter(description='A').delete()
+        self.assertTotaux(self.devis, '100.00', '10.00', '110.00')
+
+    def test_sauvegarde_devis_n_ecrase_pas_les_totaux(self):
+        devis_perime = Devis.objects.get(pk=self.devis.pk)
+        LigneDevis.objects.create(
+            devis=self.devis, description='Pose', prix_unitaire_ht=Decimal('100'), taux_tva=Decimal('10')
+        )
+        devis_perime.notes = 'Notes'
+        devis_perime.save()
+        self.assertTotaux(self.devis, '100.00', '10.00', '110.00')
+
+    def test_commande_recalcul_et_verification(self):
+        LigneDevis.objects.create(
+            devis=self.devis, description='Pose', prix_unitaire_ht=Decimal('100'), taux_tva=Decimal('10')
+        )
+        Devis.objects.filter(pk=self.devis.pk).update(total_ttc=Decimal('1.00'))
+
+        with self.assertRaises(CommandError):
+            call_command('recalculer_totaux_devis', '--verifier', stdout=io.StringIO())
+
+        call_command('recalculer_totaux_devis', stdout=io.StringIO())
+        self.assertTotaux(self.devis, '100.00', '10.00', '110.00')
+        call_command('recalculer_totaux_devis', '--verifier', stdout=io.StringIO())
+
+    def test_montant_arrondi_au_centime(self):
+        # 1,5 × 3,33 = 4,995 → 5,00 (arrondi commercial, comme la colonne en base)
+        ligne = LigneDevis.objects.create(
+            devis=self.devis, description='Joint', quantite=Decimal('1.5'),
+            prix_unitaire_ht=Decimal('3.33'), taux_tva=Decimal('20')
+        )
+        self.assertEqual(ligne.montant, Decimal('5.00'))
+        self.assertTotaux(self.devis, '5.00', '1.00', '6.00')
+
+    def test_ajustement_incremental_sans_relire_les_lignes(self):
+        devis = self.creer_devis(self.operation, lignes=[('100.00', '20')] * 5)
+        devis.refresh_from_db()
+
+        with CaptureQueriesContext(connection) as requetes:
+            ligne = LigneDevis.objects.create(
+                devis=devis, description='Pose', prix_unitaire_ht=Decimal('33.33'), taux_tva=Decimal('5.5')
+            )
+        # INSERT + UPDATE conditionnel des totaux : aucune lecture des lignes
+        self.assertEqual(len(requetes), 2)
+        self.assertEqual(devis.sous_total_ht, Decimal('533.33'))
+        self.assertEqual(devis.total_tva, Decimal('101.83'))
+
+        ligne = LigneDevis.objects.get(pk=ligne.pk)
+        ligne.devis = devis
+        ligne.quantite = Decimal('3')
+        ligne.save()
+        ligne.delete()
+        self.assertTotaux(devis, '500.00', '100.00', '600.00')
+
+    def test_revision_perimee_recalcul_complet(self):
+        devis_perime = Devis.objects.get(pk=self.devis.pk)
+        # Ligne ajoutée par une autre instance : les totaux de devis_perime sont périmés
+        LigneDevis.objects.create(
+            devis=self.devis, description='Pose', prix_unitaire_ht=Decimal('100'), taux_tva=Decimal('10')
+        )
+        LigneDevis.objects.create(
+            devis=devis_perime, description='Dépose', prix_unitaire_ht=Decimal('50'), taux_tva=Decimal('20')
+        )
+        self.assertEqual(devis_perime.total_ttc, Decimal('170.00'))
+        self.assertTotaux(self.devis, '150.00', '20.00', '170.00')
+        call_command('recalculer_totaux_devis', '--verifier', stdout=io.StringIO())
+
+
+class LignesDevisAjaxTests(DonneesMixin, TestCase):
+
+    def setUp(self):
+        self.user = self.creer_user()
+        self.client.force_login(self.user)
+        self.operation = self.creer_operation(self.user, self.creer_client(self.user), avec_devis=True)
+
+    def ajouter(self, devis):
+        return self.client.post(
+            reverse('ajax_add_ligne_devis', args=[self.operation.pk]),
+            {'devis_id': devis.pk, 'description': 'Pose', 'quantite': '1.5',
+             'prix_unitaire_ht': '3.33', 'taux_tva': '20'},
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+        )
+
+    def supprimer(self, ligne_id):
+        return self.client.post(
+            reverse('ajax_delete_ligne_devis', args=[self.operation.pk]),
+            {'ligne_id': ligne_id}, HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+        )
+
+    def test_requetes_independantes_du_nombre_de_lignes(self):
+        petit = self.creer_devis(self.operation, lignes=[('10.00', '20')] * 5)
+        grand = self.creer_devis(self.operation, lignes=[('10.00', '20')] * 100)
+
+        nombres = []
+        for devis in (petit, grand):
+            with CaptureQueriesContext(connection) as ajout:
+                response = self.ajouter(devis)
+            ligne_id = response.json()['ligne']['id']
+            with CaptureQueriesContext(connection) as suppression:
+                self.supprimer(ligne_id)
+            nombres.append((len(ajout), len(suppression)))
+        self.assertEqual(nombres[0], nombres[1])
+
+    def test_totaux_identiques_au_recalcul_complet(self):
+        devis = self.creer_devis(self.operation, lignes=[('33.33', '5.5'), ('12.50', '10')])
+
+        data = self.ajouter(devis).json()
+        self.assertEqual(data['ligne']['montant'], 5.0)
+        attendu = calculer_totaux(devis.lignes.values_list('montant', 'taux_tva'))
+        self.assertEqual(data['totaux'], {champ: float(valeur) for champ, valeur in attendu.items()})
+
+        data = self.supprimer(devis.lignes.get(description='Ligne 1').pk).json()
+        attendu = calculer_totaux(devis.lignes.values_list('montant', 'taux_tva'))
+        self.assertEqual(data['totaux'], {champ: float(valeur) for champ, valeur in attendu.items()})
+        call_command('recalculer_totaux_devis', '--verifier', stdout=io.StringIO())
+
+
+class FinancesOperationTests(DonneesMixin, TestCase):
+
+    def setUp(self):
+        self.user = self.creer_user()
+        self.client_crm = self.creer_client(self.user)
+        self.today = timezone.now().date()
+
+    def assertFinances(self, operation, total, encaisse, planifie):
+        operation.refresh_from_db()
+        self.assertEqual(operation.montant_total, Decimal(total))
+        self.assertEqual(operation.montant_encaisse, Decimal(encaisse))
+        self.assertEqual(operation.montant_planifie, Decimal(planifie))
+
+    def test_finances_sans_devis(self):
+        operation = self.creer_operation(self.user, self.client_crm)
+        intervention = Intervention.objects.create(
+            operation=operation, description='Pose', quantite=Decimal('1'),
+            prix_unitaire_ht=Decimal('33.33'), taux_tva=Decimal('10')
+        )
+        # TVA arrondie au centime : 3.333 → 3.33
+        self.assertFinances(operation, '36.66', '0.00', '0.00')
+
+        echeance = Echeance.objects.create(
+            operation=operation, numero=1, montant=Decimal('20'), date_echeance=self.today
+        )
+        self.assertFinances(operation, '36.66', '0.00', '20.00')
+
+        echeance.paye = True
+        echeance.save()
+        self.assertFinances(operation, '36.66', '20.00', '20.00')
+        self.assertEqual(operation.reste_a_payer, Decimal('16.66'))
+
+        intervention.delete()
+        echeance.delete()
+        self.assertFinances(operation, '0.00', '0.00', '0.00')
+
+    def test_finances_avec_devis(self):
+        operation = self.creer_operation(self.user, self.client_crm, avec_devis=True)
+        devis = self.creer_devis(operation, lignes=[('100', '20')])
+        self.assertFinances(operation, '0.00', '0.00', '0.00')
+
+        devis.statut = 'accepte'
+        devis.save()
+        self.assertFinances(operation, '120.00', '0.00', '0.00')
+
+        devis.delete()
+        self.assertFinances(operation, '0.00', '0.00', '0.00')
+
+    def test_finances_maintenues_en_masse(self):
+        operation = self.creer_operation(self.user, self.client_crm)
+        Echeance.objects.bulk_create([
+            Echeance(operation=operation, numero=1, montant=Decimal('10'), date_echeance=self.today),
+            Echeance(operation=operation, numero=2, montant=Decimal('30'), date_echeance=self.today),
+        ])
+        self.assertFinances(operation, '0.00', '0.00', '40.00')
+
+        operation.echeances.filter(numero=1).update(paye=True)
+        self.assertFinances(operation, '0.00', '10.00', '40.00')
+
+        operation.echeances.all().delete()
+        self.assertFinances(operation, '0.00', '0.00', '0.00')
+
+    def test_recalcul_en_masse_en_requetes_constantes(self):
+        def ecrire_en_masse(nombre):
+            operations = [self.creer_operation(self.user, self.client_crm) for _ in range(nombre)]
+            avec_devis = self.creer_operation(self.user, self.client_crm, avec_devis=True)
+            self.creer_devis(avec_devis, lignes=[('100.00', '20')], statut='accepte')
+            Intervention.objects.bulk_create([
+                Intervention(operation=operation, description='Pose', quantite=Decimal('1'),
+                             prix_unitaire_ht=Decimal('33.33'), montant=Decimal('33.33'), taux_tva=Decimal('10'))
+                for operation in operations
+            ])
+            cibles = Intervention.objects.filter(operation__in=operations)
+            echeances = [
+                Echeance(operation=operation, numero=1, montant=Decimal('20'), date_echeance=self.today, paye=True)
+                for operation in operations + [avec_devis]
+            ]
+            with CaptureQueriesContext(connection) as requetes:
+                Echeance.objects.bulk_create(echeances)
+                cibles.update(description='Pose bis')
+            return operations + [avec_devis], len(requetes)
+
+        _, petit = ecrire_en_masse(2)
+        operations, grand = ecrire_en_masse(20)
+        self.assertEqual(petit, grand)
+
+        for operation in operations[:-1]:
+            self.assertFinances(operation, '36.66', '20.00', '20.00')
+        self.assertFinances(operations[-1], '120.00', '20.00', '20.00')
+
+    def test_changement_de_mode_recalcule_le_total(self):
+        operation = self.creer_operation(self.user, self.client_crm)
+        Intervention.objects.create(
+            operation=operation, description='Pose', quantite=Decimal('1'),
+            prix_unitaire_ht=Decimal('100'), taux_tva=Decimal('20')
+        )
+        self.creer_devis(operation, lignes=[('50.00', '10')], statut='accepte')
+        self.assertFinances(operation, '120.00', '0.00', '0.00')
+
+        operation = Operation.objects.get(pk=operation.pk)
+        operation.avec_devis = True
+        operation.save()
+        self.assertFinances(operation, '55.00', '0.00', '0.00')
+
+    def test_devis_recalcule_seulement_si_le_statut_change(self):
+        operation = self.creer_operation(self.user, self.client_crm, avec_devis=True)
+        self.creer_devis(operation, lignes=[('100.00', '20')], statut='envoye')
+
+        devis = Devis.objects.get(operation=operation)
+        devis.notes = 'Accès par la cour'
+        with CaptureQueriesContext(connection) as requetes:
+            devis.save()
+        self.assertFalse([r for r in requetes if 'core_echeance' in r['sql']])
+
+        devis.statut = 'accepte'
+        devis.save(update_fields=['statut'])
+        self.assertFinances(operation, '120.00', '0.00', '0.00')
+
+    def test_sauvegarde_operation_n_ecrase_pas_les_finances(self):
+        operation = self.creer_operation(self.user, self.client_crm)
+        operation_perimee = Operation.objects.get(pk=operation.pk)
+        Echeance.objects.create(
+            operation=operation, numero=1, montant=Decimal('50'), date_echeance=self.today, paye=True
+        )
+        operation_perimee.statut = 'paye'
+        operation_perimee.save()
+        self.assertFinances(operation, '0.00', '50.00', '50.00')
+
+    def test_kpi_financiers(self):
+        operation = self.creer_operation(
+            self.user, self.client_crm, statut='realise', date_realisation=timezone.now()
+        )
+        Intervention.objects.create(
+            operation=operation, description='Pose', prix_unitaire_ht=Decimal('100'), taux_tva=Decimal('10')
+        )
+        Echeance.objects.create(
+            operation=operation, numero=1, montant=Decimal('30'), date_echeance=self.today, paye=True
+        )
+        Echeance.objects.create(
+            operation=operation, numero=2, montant=Decimal('50'),
+            date_echeance=self.today - timedelta(days=2)
+        )
+
+        with self.assertNumQueries(2):
+            kpi = calculer_kpi_financiers(
+                self.user, self.today - timedelta(days=7), self.today + timedelta(days=1), today=self.today
+            )
+
+        self.assertEqual(kpi['ca_encaisse'], Decimal('30'))
+        self.assertEqual(kpi['ca_en_attente_total'], Decimal('80'))
+        self.assertEqual(kpi['ca_non_planifies'], Decimal('30'))
+        self.assertEqual(kpi['ca_retard'], Decimal('50'))
+
+    def test_commande_recalcul_et_verification(self):
+        operation = self.creer_operation(self.user, self.client_crm)
+        Echeance.objects.create(
+            operation=operation, numero=1, montant=Decimal('50'), date_echeance=self.today, paye=True
+        )
+        Operation.objects.filter(pk=operation.pk).update(montant_encaisse=Decimal('0'))
+
+        with self.assertRaises(CommandError):
+            call_command('recalculer_finances_operations', '--verifier', stdout=io.StringIO())
+
+        call_command('recalculer_finances_operations', stdout=io.StringIO())
+        self.assertFinances(operation, '0.00', '50.00', '50.00')
+        call_command('recalculer_finances_operations', '--verifier', stdout=io.StringIO())
+
+
+class ProprietesPrechargeesTests(DonneesMixin, TestCase):
+
+    LIGNE = (
+        '{% for op in operations %}'
+        '{{ op.dernier_devis.version }} {{ op.statut_devis_global }} {{ op.nombre_devis }} '
+        '{{ op.nombre_devis_acceptes }} {{ op.sous_total_ht }} {{ op.total_tva }} {{ op.total_ttc }} '
+        '{{ op.get_passages_stats.total }} {{ op.client.derniere_operation.pk }} '
+        '{{ op.client.prochaine_operation.pk }}|'
+        '{% endfor %}'
+    )
+
+    def setUp(self):
+        self.user = self.creer_user()
+
+    def creer_operations(self, nombre):
+        for i in range(nombre):
+            client = self.creer_client(self.user, nom=f'Client{i}')
+            avec_devis = self.creer_operation(self.user, client, avec_devis=True)
+            self.creer_devis(avec_devis, lignes=[('100.00', '20')], statut='refuse')
+            self.creer_devis(avec_devis, lignes=[('150.00', '20')], statut='accepte')
+            sans_devis = self.creer_operation(
+                self.user, client, statut='planifie', date_prevue=timezone.now() + timedelta(days=i + 1)
+            )
+            Intervention.objects.create(
+                operation=sans_devis, description='Pose', quantite=Decimal('1'),
+                prix_unitaire_ht=Decimal('33.33'), taux_tva=Decimal('10')
+            )
+            PassageOperation.objects.create(operation=sans_devis, numero=1)
+
+    def operations(self):
+        return Operation.objects.filter(user=self.user).select_related('client').prefetch_related(
+            'devis_set', 'interventions', 'passages', 'client__operations'
+        ).order_by('pk')
+
+    def rendre(self, operations):
+        return Template(self.LIGNE).render(Context({'operations': operations}))
+
+    def test_liste_prechargee_sans_requete_par_ligne(self):
+        self.creer_operations(5)
+        # Opérations, devis, interventions, passages, opérations des clients
+        with self.assertNumQueries(5):
+            self.rendre(list(self.operations()))
+
+    def test_memes_valeurs_qu_en_sql(self):
+        self.creer_operations(3)
+        sans_prefetch = list(Operation.objects.filter(user=self.user).select_related('client').order_by('pk'))
+        self.assertEqual(self.rendre(list(self.operations())), self.rendre(sans_prefetch))
+
+        operation = next(op for op in self.operations() if not op.avec_devis)
+        self.assertEqual(operation.total_ttc, Decimal('36.66'))
+        avec_devis = next(op for op in self.operations() if op.avec_devis)
+        self.assertEqual((avec_devis.dernier_devis.version, avec_devis.nombre_devis_acceptes), (2, 1))
+
+
+class FicheOperationTests(DonneesMixin, TestCase):
+
+    def setUp(self):
+        self.user = self.creer_user()
+        self.client.force_login(self.user)
+        self.operation = self.creer_operation(self.user, self.creer_client(self.user), avec_devis=True)
+        self.url = reverse('operation_detail', args=[self.operation.pk])
+        self.today = timezone.now().date()
+
+    def completer(self, nombre):
+        for _ in range(nombre):
+            self.creer_devis(self.operation, lignes=[('100.00', '20'), ('50.00', '10')])
+            Echeance.objects.create(
+                operation=self.operation, numero=Echeance.objects.filter(operation=self.operation).count() + 1,
+                montant=Decimal('30.00'), date_echeance=self.today, paye=True
+            )
+            Echeance.objects.create(
+                operation=self.operation, numero=Echeance.objects.filter(operation=self.operation).count() + 1,
+                montant=Decimal('20.00'), date_echeance=self.today
+            )
+            PassageOperation.objects.create(operation=self.operation, numero=1)
+            Intervention.objects.create(
+                operation=self.operation, description='Pose', quantite=Decimal('1'),
+                prix_unitaire_ht=Decimal('10.00'), taux_tva=Decimal('10')
+            )
+            for _ in range(6):
+                HistoriqueOperation.objects.create(operation=self.operation, action='Action', utilisateur=self.user)
+
+    def test_nombre_de_requetes_fixe(self):
+        self.completer(1)
+        # Session, utilisateur, opération + client, puis une requête par
+        # relation : devis, lignes, interventions, échéances, passages, historique
+        with self.assertNumQueries(9):
+            self.client.get(self.url)
+
+        self.completer(3)
+        with self.assertNumQueries(9):
+            response = self.client.get(self.url)
+
+        self.assertEqual(len(response.context['historique']), 10)
+        self.assertContains(response, '10 événements')
+        self.assertEqual([d.version for d in response.context['devis_list']], [1, 2, 3, 4])
+        self.assertEqual(len(response.context['devis_list'][0].lignes_list), 2)
+        self.assertEqual(response.context['total_echeances'], Decimal('120.00'))
+        self.assertEqual(response.context['total_echeances_prevus'], Decimal('80.00'))
+        self.assertEqual(response.context['total_echeances_tout'], Decimal('200.00'))
+        self.assertEqual(response.context['passages_non_realises'], 4)
+
+    def test_totaux_echeances_en_memoire_ou_en_une_requete(self):
+        self.assertEqual(self.operation.totaux_echeances(), {'payees': 0, 'prevues': 0, 'tout': 0})
+        self.completer(2)
+
+        operation = Operation.objects.get(pk=self.operation.pk)
+        with self.assertNumQueries(1):
+            en_sql = operation.totaux_echeances()
+        operation = Operation.objects.prefetch_related('echeances').get(pk=self.operation.pk)
+        with self.assertNumQueries(0):
+            en_memoire = operation.totaux_echeances()
+
+        self.assertEqual(en_sql, en_memoire)
+        self.assertEqual(en_sql['prevues'], Decimal('40.00'))
+
+
+class ActionsFicheAjaxTests(DonneesMixin, TestCase):
+
+    def setUp(self):
+        self.user = self.creer_user()
+        self.client.force_login(self.user)
+        self.operation = self.creer_operation(self.user, self.creer_client(self.user), statut='realise')
+        Intervention.objects.create(
+            operation=self.operation, description='Pose', prix_unitaire_ht=Decimal('100'), taux_tva=Decimal('20')
+        )
+        self.url = reverse('ajax_action_operation', args=[self.operation.pk])
+        self.today = timezone.now().date()
+
+    def poster(self, donnees, url=None):
+        return self.client.post(url or self.url, donnees, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+
+    def test_paiement_renvoie_les_fragments_modifies(self):
+        response = self.poster({
+            'action': 'add_paiement', 'montant': '50', 'date_paiement': self.today.isoformat(), 'paye': 'true',
+            'generer_facture_auto': 'true',
+        })
+        data = response.json()
+
+        self.assertTrue(data['success'])
+        self.assertEqual(data['statut'], {'code': 'realise', 'libelle': 'Réalisé'})
+        self.assertEqual(data['totaux']['montant_total'], 120.0)
+        self.assertEqual(data['totaux']['total_echeances'], 50.0)
+        self.assertEqual(data['totaux']['reste_a_enregistrer'], 70.0)
+        self.assertIn('id="recap-paiements"', data['recap_html'])
+
+        echeance = self.operation.echeances.get()
+        self.assertEqual(data['echeance']['id'], echeance.id)
+        self.assertIn(echeance.numero_facture, data['echeance']['html'])
+        # Paiement et facture automatique, du plus récent au plus ancien
+        self.assertEqual(len(data['historique']), 2)
+        self.assertIn(echeance.numero_facture, data['historique'][0]['action'])
+        self.assertIn('Paiement payé : 50', data['historique'][1]['action'])
+
+        # Le solde passe l'opération en payé
+        data = self.poster({'action': 'add_paiement', 'montant': '70', 'date_paiement': self.today.isoformat(),
+                            'paye': 'true'}).json()
+        self.assertEqual(data['statut']['code'], 'paye')
+        self.assertEqual(data['totaux']['reste_a_payer'], 0.0)
+
+    def test_historique_limite_aux_entrees_de_l_action(self):
+        # Entrée écrite au même moment par une autre requête sur la même opération
+        autre = HistoriqueOperation.objects.create(
+            operation=self.operation, action='Commentaires mis à jour (autre onglet)', utilisateur=self.user
+        )
+        HistoriqueOperation.objects.filter(pk=autre.pk).update(date=timezone.now() + timedelta(seconds=5))
+
+        data = self.poster({'action': 'change_status', 'statut': 'paye'}).json()
+
+        self.assertEqual([entree['action'] for entree in data['historique']], ['Statut changé : Réalisé → Payé'])
+
+    def test_accepter_devis_renvoie_la_carte_et_le_statut(self):
+        operation = self.creer_operation(self.user, self.operation.client, avec_devis=True)
+        devis = self.creer_devis(operation, lignes=[('100.00', '10')], statut='envoye')
+
+        data = self.poster(
+            {'action': 'accepter_devis', 'devis_id': devis.id},
+            url=reverse('ajax_action_operation', args=[operation.pk])
+        ).json()
+
+        self.assertEqual(data['statut']['code'], 'a_planifier')
+        self.assertEqual(data['totaux']['montant_total'], 110.0)
+        self.assertEqual(data['devis']['statut'], 'accepte')
+        self.assertIn(f'id="devis-card-{devis.id}"', data['devis']['html'])
+        self.assertEqual(data['niveau'], 'success')
+
+    def test_erreurs(self):
+        response = self.poster({'action': 'add_paiement', 'montant': '500', 'date_paiement': self.today.isoformat()})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Dépassement', response.json()['error'])
+
+        self.assertEqual(self.poster({'action': 'add_paiement', 'montant': 'abc',
+                                      'date_paiement': self.today.isoformat()}).status_code, 400)
+        self.assertEqual(self.poster({'action': 'marquer_paye', 'echeance_id': 999}).status_code, 404)
+        self.assertEqual(self.poster({'action': 'supprimer_devis'}).status_code, 400)
+        self.assertEqual(self.client.post(self.url, {'action': 'update_commentaires'}).status_code, 400)
+
+        autre = self.creer_user('autre')
+        self.client.force_login(autre)
+        self.assertEqual(self.poster({'action': 'update_commentaires'}).status_code, 404)
+        self.assertFalse(self.operation.echeances.exists())
+
+    def test_nombre_de_requetes_independant_de_la_fiche(self):
+        def confirmer_paiement():
+            echeance = Echeance.objects.create(
+                operation=self.operation, numero=Echeance.objects.filter(operation=self.operation).count() + 1,
+                montant=Decimal('1.00'), date_echeance=self.today
+            )
+            with CaptureQueriesContext(connection) as requetes:
+                data = self.poster({'action': 'marquer_paye_echeance', 'echeance_id': echeance.id}).json()
+            self.assertTrue(data['echeance']['paye'])
+            return len(requetes)
+
+        premiere = confirmer_paiement()
+        for _ in range(10):
+            HistoriqueOperation.objects.create(operation=self.operation, action='Action', utilisateur=self.user)
+            self.creer_devis(self.operation, lignes=[('10.00', '20')])
+            confirmer_paiement()
+        self.assertEqual(confirmer_paiement(), premiere)
+
+    def test_formulaire_classique_inchange(self):
+        url = reverse('operation_detail', args=[self.operation.pk])
+        response = self.client.post(url, {'action': 'update_commentaires', 'commentaires': ' Portail bleu '})
+        self.assertRedirects(response, url)
+        self.operation.refresh_from_db()
+        self.assertEqual(self.operation.commentaires, 'Portail bleu')
+
+        response = self.client.post(url, {'action': 'change_status', 'statut': 'inconnu'}, follow=True)
+        self.assertContains(response, 'Statut invalide')
+
+
+class LignesDevisLotTests(DonneesMixin, TestCase):
+
+    def setUp(self):
+        self.user = self.creer_user()
+        self.client.force_login(self.user)
+        self.operation = self.creer_operation(self.user, self.creer_client(self.user), avec_devis=True)
+        self.devis = self.creer_devis(self.operation, lignes=[('100.00', '20'), ('50.00', '10'), ('10.00', '20')])
+        self.a, self.b, self.c = self.devis.lignes.order_by('ordre')
+        self.url = reverse('ajax_lignes_devis_lot', args=[self.operation.pk])
+
+    def envoyer(self, operations, devis=None):
+        return self.client.post(
+            self.url, json.dumps({'devis_id': (devis or self.devis).pk, 'operations': operations}),
+            content_type='application/json', HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+        )
+
+    def coller(self, nombre):
+        return [
+            {'action': 'creer', 'description': f'Poste {i}', 'quantite': '2', 'unite': 'Heure',
+             'prix_unitaire_ht': '12,50 €', 'taux_tva': '20 %'}
+            for i in range(nombre)
+        ]
+
+    def test_collage_en_un_envoi(self):
+        with CaptureQueriesContext(connection) as petit:
+            self.envoyer(self.coller(5))
+        with CaptureQueriesContext(connection) as grand:
+            response = self.envoyer(self.coller(60))
+
+        # Nombre de requêtes indépendant du nombre de lignes
+        self.assertEqual(len(petit), len(grand))
+        data = response.json()
+        self.assertEqual(len(data['lignes']), 68)
+        self.assertEqual(data['lignes'][-1]['unite'], 'heure')
+        self.assertEqual(data['lignes'][-1]['montant'], 25.0)
+
+        self.devis.refresh_from_db()
+        self.assertEqual(self.devis.sous_total_ht, Decimal('160.00') + 65 * Decimal('25.00'))
+        self.assertEqual(data['totaux']['total_ttc'], float(self.devis.total_ttc))
+        self.assertEqual(
+            list(self.devis.lignes.order_by('ordre').values_list('ordre', flat=True)), list(range(1, 69))
+        )
+        self.assertEqual(
+            self.operation.historique.filter(action__startswith='✏️ Lignes du devis').count(), 2
+        )
+
+    def test_operations_appliquees_dans_l_ordre(self):
+        response = self.envoyer([
+            {'action': 'modifier', 'id': self.b.pk, 'prix_unitaire_ht': '60'},
+            {'action': 'supprimer', 'id': self.a.pk},
+            {'action': 'creer', 'description': 'Déplacement', 'prix_unitaire_ht': '30', 'position': 1},
+            {'action': 'deplacer', 'id': self.c.pk, 'position': 1},
+        ])
+
+        self.assertEqual([ligne['description'] for ligne in response.json()['lignes']],
+                         ['Ligne 3', 'Déplacement', 'Ligne 2'])
+        lignes = list(self.devis.lignes.order_by('ordre'))
+        self.assertEqual([ligne.ordre for ligne in lignes], [1, 2, 3])
+        self.assertEqual(lignes[2].montant, Decimal('60.00'))
+        self.assertFalse(LigneDevis.objects.filter(pk=self.a.pk).exists())
+
+        self.devis.refresh_from_db()
+        self.assertEqual(self.devis.sous_total_ht, Decimal('100.00'))
+        self.assertEqual(self.devis.total_tva, Decimal('11.00'))
+        self.assertEqual(
+            self.operation.historique.get().action,
+            f"✏️ Lignes du devis {self.devis.numero_devis} : 1 ajoutée(s), 1 modifiée(s), 1 supprimée(s), ordre modifié"
+        )
+
+    def test_lot_refuse_sans_ecriture(self):
+        response = self.envoyer(self.coller(2) + [{'action': 'modifier', 'id': self.a.pk, 'quantite': 'x'}])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Opération 3', response.json()['error'])
+
+        self.assertEqual(self.envoyer([{'action': 'supprimer', 'id': 999}]).status_code, 400)
+        self.assertEqual(self.envoyer([{'action': 'creer', 'description': 'Sans prix'}]).status_code, 400)
+        self.assertEqual(self.envoyer([{'action': 'creer', 'description': 'X', 'prix_unitaire_ht': '1',
+                                        'unite': 'tonne'}]).status_code, 400)
+        self.assertEqual(self.envoyer([]).status_code, 400)
+
+        verrouille = self.creer_devis(self.operation, lignes=[('10.00', '20')], statut='envoye')
+        self.assertEqual(self.envoyer(self.coller(1), devis=verrouille).status_code, 403)
+
+        self.assertEqual(self.devis.lignes.count(), 3)
+        self.assertFalse(self.operation.historique.exists())
+
+        # Rien ne change : ni écriture ni historique
+        response = self.envoyer([{'action': 'deplacer', 'id': self.a.pk, 'position': 1}])
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(self.operation.historique.exists())
+
+
+class NouvelleVersionDevisTests(DonneesMixin, TestCase):
+
+    def setUp(self):
+        self.user = self.creer_user()
+        self.client.force_login(self.user)
+        self.operation = self.creer_operation(self.user, self.creer_client(self.user), avec_devis=True)
+        self.url = reverse('operation_detail', args=[self.operation.pk])
+
+    def reprendre(self, devis=None):
+        donnees = {'action': 'nouvelle_version_devis'}
+        if devis:
+            donnees['devis_id'] = devis.pk
+        return self.client.post(self.url, donnees)
+
+    def test_copie_des_lignes_en_un_insert(self):
+        petit = self.creer_devis(self.operation, lignes=[('10.00', '20')] * 3, statut='refuse')
+        with CaptureQueriesContext(connection) as requetes_petit:
+            self.reprendre(petit)
+
+        grand = self.creer_devis(self.operation, lignes=[('33.33', '5.5'), ('12.50', '10')] * 20, notes='Notes')
+        grand.lignes.filter(ordre=1).update(ordre=50)
+        with CaptureQueriesContext(connection) as requetes_grand:
+            response = self.reprendre()
+        self.assertRedirects(response, self.url)
+
+        # Nombre de requêtes indépendant du nombre de lignes copiées
+        self.assertEqual(len(requetes_petit), len(requetes_grand))
+
+        nouveau = self.operation.devis_set.order_by('-version').first()
+        self.assertEqual((nouveau.version, nouveau.statut, nouveau.notes), (4, 'brouillon', 'Notes'))
+        colonnes = ['description', 'quantite', 'unite', 'prix_unitaire_ht', 'taux_tva', 'montant']
+        self.assertEqual(
+            list(nouveau.lignes.order_by('ordre').values_list(*colonnes)),
+            list(grand.lignes.order_by('ordre').values_list(*colonnes))
+        )
+        self.assertEqual(list(nouveau.lignes.values_list('ordre', flat=True)), list(range(1, 41)))
+
+        grand.refresh_from_db()
+        self.assertEqual(
+            [getattr(nouveau, champ) for champ in Devis.CHAMPS_TOTAUX],
+            [getattr(grand, champ) for champ in Devis.CHAMPS_TOTAUX]
+        )
+        self.assertEqual(
+            self.operation.historique.filter(action__contains=f'à partir de {grand.numero_devis}').count(), 1
+        )
+
+    def test_devis_introuvable(self):
+        autre = self.creer_operation(self.user, self.creer_client(self.user))
+        devis = self.creer_devis(autre, lignes=[('10.00', '20')])
+
+        self.reprendre(devis)
+        self.assertFalse(self.operation.devis_set.exists())
+
+
+class SequenceNumerotationTests(DonneesMixin, TestCase):
+
+    def setUp(self):
+        self.user = self.creer_user()
+        self.operation = self.creer_operation(self.user, self.creer_client(self.user), avec_devis=True)
+        self.annee = timezone.now().year
+
+    def test_allocation_sequentielle_par_type(self):
+        premier = self.creer_devis(self.operation)
+        second = self.creer_devis(self.operation)
+        self.assertEqual(premier.numero_devis, f'DEVIS-{self.annee}-U{self.user.id}-00001')
+        self.assertEqual(second.numero_devis, f'DEVIS-{self.annee}-U{self.user.id}-00002')
+
+        self.assertEqual(
+            SequenceNumerotation.prochain_numero(self.user, 'facture'),
+            f'FACTURE-{self.annee}-U{self.user.id}-00001'
+        )
+
+        # Une séquence par utilisateur
+        autre = self.creer_user('autre')
+        self.assertEqual(SequenceNumerotation.allouer(autre, 'devis'), 1)
+
+    def test_premiere_allocation_reprend_les_numeros_existants(self):
+        Echeance.objects.create(
+            operation=self.operation, numero=1, montant=Decimal('10'), date_echeance=timezone.now().date(),
+            paye=True, facture_generee=True, numero_facture=f'FACTURE-{self.annee}-U{self.user.id}-00007'
+        )
+        self.assertEqual(SequenceNumerotation.allouer(self.user, 'facture'), 8)
+
+    def test_allocation_annulee_avec_la_transaction(self):
+        SequenceNumerotation.allouer(self.user, 'facture')
+        try:
+            with transaction.atomic():
+                SequenceNumerotation.allouer(self.user, 'facture')
+                raise ValueError('échec après allocation')
+        except ValueError:
+            pass
+        self.assertEqual(SequenceNumerotation.allouer(self.user, 'facture'), 2)
+
+    def test_allocation_en_temps_constant(self):
+        for i in range(5):
+            self.creer_devis(self.operation)
+        # SAVEPOINT, UPDATE, SELECT, RELEASE : indépendant de l'historique
+        with self.assertNumQueries(4):
+            SequenceNumerotation.allouer(self.user, 'devis')
+
+    def test_commande_initialisation(self):
+        self.creer_devis(self.operation)
+        Devis.objects.filter(operation=self.operation).update(numero_devis=f'DEVIS-{self.annee}-U{self.user.id}-00041')
+
+        call_command('initialiser_sequences', stdout=io.StringIO())
+        self.assertEqual(SequenceNumerotation.allouer(self.user, 'devis'), 42)
+
+        # Relancer la commande ne fait jamais reculer une séquence
+        call_command('initialiser_sequences', stdout=io.StringIO())
+        self.assertEqual(SequenceNumerotation.allouer(self.user, 'devis'), 43)
+
+
+@skipIf(
+    connection.vendor == 'sqlite',
+    "La base SQLite de test (mémoire partagée) refuse les écritures concurrentes au lieu de les mettre en attente"
+)
+class SequenceNumerotationConcurrenceTests(DonneesMixin, TransactionTestCase):
+    """Allocations parallèles : ni doublon, ni trou"""
+
+    NB_THREADS = 8
+    NB_ALLOCATIONS = 25
+
+    def test_allocations_paralleles(self):
+        user = self.creer_user()
+        numeros = []
+        erreurs = []
+        depart = threading.Barrier(self.NB_THREADS)
+
+        def allouer():
+            try:
+                depart.wait()
+                for i in range(self.NB_ALLOCATIONS):
+                    with transaction.atomic():
+                        numeros.append(SequenceNumerotation.allouer(user, 'facture'))
+            except Exception as e:
+                erreurs.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=allouer) for i in range(self.NB_THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(erreurs, [])
+        total = self.NB_THREADS * self.NB_ALLOCATIONS
+        self.assertEqual(sorted(numeros), list(range(1, total + 1)))
+
+
+class FacturationTests(DonneesMixin, TestCase):
+
+    def setUp(self):
+        self.user = self.creer_user()
+        self.operation = self.creer_operation(self.user, self.creer_client(self.user), statut='realise')
+        Intervention.objects.create(
+            operation=self.operation, description='Pose', prix_unitaire_ht=Decimal('100'), taux_tva=Decimal('20')
+        )
+        self.today = timezone.now().date()
+
+    def creer_echeance(self, numero, montant, paye=True):
+        return Echeance.objects.create(
+            operation=self.operation, numero=numero, ordre=numero, montant=Decimal(montant),
+            date_echeance=self.today, paye=paye
+        )
+
+    def test_facture_globale(self):
+        echeance = self.creer_echeance(1, '120')
+        emettre_facture(echeance, self.user)
+
+        echeance.refresh_from_db()
+        self.assertTrue(echeance.facture_generee)
+        self.assertEqual(echeance.facture_type, 'globale')
+        self.assertEqual(echeance.numero_facture, f'FACTURE-{self.today.year}-U{self.user.id}-00001')
+        self.assertTrue(self.operation.historique.filter(action__contains=echeance.numero_facture).exists())
+
+    def test_facture_acompte_puis_solde(self):
+        # 50 € restent à enregistrer : acompte
+        acompte = self.creer_echeance(1, '40')
+        self.creer_echeance(2, '30', paye=False)
+        emettre_facture(acompte, self.user)
+        self.assertEqual(acompte.facture_type, 'acompte')
+
+        # Dernière échéance payée à facturer, plus rien à enregistrer : solde
+        solde = self.creer_echeance(3, '50')
+        emettre_facture(solde, self.user)
+        self.assertEqual(solde.facture_type, 'solde')
+        self.assertEqual(solde.numero_facture, f'FACTURE-{self.today.year}-U{self.user.id}-00002')
+
+    def test_echeance_non_facturable(self):
+        with self.assertRaises(FacturationError):
+            emettre_facture(self.creer_echeance(1, '50', paye=False), self.user)
+
+        echeance = self.creer_echeance(2, '50')
+        emettre_facture(echeance, self.user)
+        with self.assertRaises(FacturationError):
+            emettre_facture(echeance, self.user)
+
+    def test_echeance_perimee_deja_facturee(self):
+        echeance = self.creer_echeance(1, '120')
+        # Chargée par une seconde requête avant que la première ne facture
+        perimee = Echeance.objects.get(pk=echeance.pk)
+        emettre_facture(echeance, self.user)
+
+        with self.assertRaises(FacturationError):
+            emettre_facture(perimee, self.user)
+
+        echeance.refresh_from_db()
+        self.assertEqual(echeance.numero_facture, f'FACTURE-{self.today.year}-U{self.user.id}-00001')
+        # Le numéro suivant n'a pas été consommé
+        self.assertEqual(
+            SequenceNumerotation.objects.get(user=self.user, type_document='facture').dernier_numero, 1
+        )
+
+    def test_marquer_paye_nombre_de_requetes_constant(self):
+        self.client.force_login(self.user)
+        url = reverse('operation_detail', args=[self.operation.id])
+
+        def marquer_paye(echeance):
+            with CaptureQueriesContext(connection) as requetes:
+                self.client.post(url, {'action': 'marquer_paye', 'echeance_id': echeance.id})
+            echeance.refresh_from_db()
+            self.assertTrue(echeance.facture_generee)
+            return len(requetes)
+
+        # La première facture de l'année crée la séquence : on mesure ensuite
+        marquer_paye(self.creer_echeance(1, '10', paye=False))
+        premiere = marquer_paye(self.creer_echeance(2, '10', paye=False))
+        for numero in range(3, 10):
+            self.creer_echeance(numero, '1')
+        derniere = marquer_paye(self.creer_echeance(10, '10', paye=False))
+
+        self.assertEqual(premiere, derniere)
+        self.assertLessEqual(derniere, 20)
+
+
+class RenumerotationPassagesTests(DonneesMixin, TestCase):
+
+    def setUp(self):
+        self.user = self.creer_user()
+        self.operation = self.creer_operation(self.user, self.creer_client(self.user))
+        self.now = timezone.now()
+
+    def numeros(self):
+        return list(self.operation.passages.order_by('numero').values_list('date_prevue', flat=True))
+
+    def test_numeros_chronologiques(self):
+        p3 = PassageOperation.objects.create(operation=self.operation, date_prevue=self.now + timedelta(days=3))
+        p1 = PassageOperation.objects.create(operation=self.operation, date_prevue=self.now + timedelta(days=1))
+        self.assertEqual(p1.numero, 1)
+        p2 = PassageOperation.objects.create(operation=self.operation, date_prevue=self.now + timedelta(days=2))
+        self.assertEqual(p2.numero, 2)
+
+        p3.refresh_from_db()
+        self.assertEqual(p3.numero, 3)
+
+        # Changement de date : le passage repasse en tête
+        p3.date_prevue = self.now
+        p3.save()
+        self.assertEqual(p3.numero, 1)
+        self.assertEqual(self.numeros(), [p3.date_prevue, p1.date_prevue, p2.date_prevue])
+
+        # Suppression : plus de trou dans la numérotation
+        p3.delete()
+        self.assertEqual(
+            list(self.operation.passages.order_by('numero').values_list('pk', 'numero')),
+            [(p1.pk, 1), (p2.pk, 2)]
+        )
+
+    def test_sans_update_returning(self):
+        # SQLite < 3.35 : lecture des passages puis un seul bulk_update
+        with mock.patch.object(connection.features, 'can_return_columns_from_insert', False):
+            with CaptureQueriesContext(connection) as requetes:
+                self.test_numeros_chronologiques()
+        self.assertFalse([r for r in requetes if 'RETURNING' in r['sql']])
+
+    def test_commentaire_sans_renumerotation(self):
+        for jour in range(10):
+            PassageOperation.objects.create(operation=self.operation, date_prevue=self.now + timedelta(days=jour))
+        passage = self.operation.passages.get(numero=5)
+
+        passage.commentaire = 'Prévoir une échelle'
+        with self.assertNumQueries(1):
+            passage.save()
+
+
+class StatutPassagesTests(DonneesMixin, TestCase):
+
+    def setUp(self):
+        self.user = self.creer_user()
+        self.client_crm = self.creer_client(self.user)
+        self.now = timezone.now()
+
+    def creer_operation_avec_passages(self, *passages):
+        operation = self.creer_operation(self.user, self.client_crm, statut='a_planifier')
+        for decalage, realise in passages:
+            PassageOperation.objects.create(
+                operation=operation, realise=realise,
+                date_prevue=self.now + timedelta(days=decalage) if decalage is not None else None
+            )
+        return operation
+
+    def test_stats_en_une_requete(self):
+        operation = self.creer_operation_avec_passages((-2, True), (-1, False), (3, False), (None, False))
+
+        with self.assertNumQueries(1):
+            stats = operation.calculer_stats_passages(now=self.now)
+        self.assertEqual(stats, {'total': 4, 'realises': 1, 'planifies': 3, 'en_retard': 1})
+
+        # Passages préchargés : aucune requête
+        operation = Operation.objects.prefetch_related('passages').get(pk=operation.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(operation.calculer_stats_passages(now=self.now), stats)
+
+        operation.update_statut_from_passages()
+        operation.refresh_from_db()
+        self.assertEqual(operation.statut, 'en_cours')
+
+    def test_recalcul_en_masse(self):
+        attendus = {
+            self.creer_operation_avec_passages((-2, True)).pk: 'realise',
+            self.creer_operation_avec_passages((-1, False), (2, False)).pk: 'a_traiter',
+            self.creer_operation_avec_passages((2, False)).pk: 'planifie',
+            self.creer_operation_avec_passages((None, False)).pk: 'a_planifier',
+            self.creer_operation_avec_passages().pk: 'a_planifier',
+        }
+
+        with CaptureQueriesContext(connection) as requetes:
+            nb_modifiees = Operation.update_statuts_from_passages(Operation.objects.filter(user=self.user))
+
+        self.assertEqual(nb_modifiees, 3)
+        # 1 lecture annotée + 1 UPDATE par nouveau statut
+        self.assertEqual(len(requetes), 4)
+        self.assertEqual(dict(Operation.objects.values_list('pk', 'statut')), attendus)
+
+    def test_recalcul_en_masse_sans_toucher_aux_statuts_hors_passages(self):
+        attendus = {}
+        for statut in Operation.STATUTS_HORS_PASSAGES:
+            operation = self.creer_operation_avec_passages((None, False), (-1, False))
+            Operation.objects.filter(pk=operation.pk).update(statut=statut)
+            attendus[operation.pk] = statut
+
+        call_command('recalculer_statuts_passages', stdout=io.StringIO())
+        self.assertEqual(dict(Operation.objects.values_list('pk', 'statut')), attendus)
+
+
+class KpiDashboardTests(DonneesMixin, TestCase):
+
+    def setUp(self):
+        self.user = self.creer_user()
+        self.client_crm = self.creer_client(self.user)
+        self.now = timezone.now()
+        self.today = self.now.date()
+
+    def creer_operations_variees(self):
+        # Réalisée : échéance en retard et reste à encaisser (urgence)
+        op_retard = self.creer_operation(self.user, self.client_crm, statut='realise')
+        Intervention.objects.create(
+            operation=op_retard, description='Pose', prix_unitaire_ht=Decimal('100'), taux_tva=Decimal('10')
+        )
+        Echeance.objects.create(
+            operation=op_retard, numero=1, montant=Decimal('50'),
+            date_echeance=self.today - timedelta(days=3)
+        )
+        Echeance.objects.create(
+            operation=op_retard, numero=2, montant=Decimal('20'), date_echeance=self.today, paye=True
+        )
+
+        # Devis envoyé en attente + passage aujourd'hui (urgence)
+        op_devis = self.creer_operation(self.user, self.client_crm, avec_devis=True, statut='planifie')
+        self.creer_devis(op_devis, statut='envoye', validite_jours=30, date_envoi=self.today)
+        PassageOperation.objects.create(operation=op_devis, date_prevue=self.now)
+
+        for i in range(8):
+            self.creer_operation(self.user, self.client_crm, statut='a_planifier')
+
+    def test_kpi(self):
+        self.creer_operations_variees()
+        kpi = calculer_kpi_dashboard(self.user, now=self.now)
+
+        self.assertEqual(kpi['nb_clients'], 1)
+        self.assertEqual(kpi['nb_urgences'], 2)
+        self.assertEqual(kpi['nb_aujourdhui'], 1)
+        self.assertEqual(kpi['nb_a_planifier'], 8)
+        self.assertEqual(kpi['nb_a_encaisser'], 1)
+        self.assertEqual(kpi['nb_operations_sans_paiement'], 1)
+        self.assertEqual(kpi['nb_paiements_retard'], 1)
+        self.assertEqual(kpi['nb_en_attente_devis'], 1)
+        self.assertEqual(kpi['ca_mois'], Decimal('20'))
+
+    def test_nombre_de_requetes_constant_de_10_a_10000_operations(self):
+        self.creer_operations_variees()
+        self.assertEqual(Operation.objects.filter(user=self.user).count(), 10)
+
+        with CaptureQueriesContext(connection) as requetes_10:
+            calculer_kpi_dashboard(self.user, now=self.now)
+
+        Operation.objects.bulk_create([
+            Operation(
+                user=self.user, client=self.client_crm, id_operation=f'BULK{i}',
+                type_prestation='Entretien', adresse_intervention='1 rue de la Paix',
+                statut=('a_planifier', 'planifie', 'realise', 'paye')[i % 4],
+            )
+            for i in range(9990)
+        ], batch_size=500)
+        self.assertEqual(Operation.objects.filter(user=self.user).count(), 10000)
+
+        with CaptureQueriesContext(connection) as requetes_10000:
+            kpi = calculer_kpi_dashboard(self.user, now=self.now)
+
+        self.assertEqual(len(requetes_10), len(requetes_10000))
+        self.assertLessEqual(len(requetes_10000), 4)
+        self.assertEqual(kpi['nb_a_planifier'], 8 + 2498)
+
+
+class CalendrierTests(DonneesMixin, TestCase):
+
+    def setUp(self):
+        self.user = self.creer_user()
+        self.client_crm = self.creer_client(self.user)
+        self.now = timezone.now()
+        self.today = self.now.date()
+        self.debut = self.today - timedelta(days=7)
+        self.fin = self.today + timedelta(days=7)
+
+    def creer_passages(self, nombre):
+        for i in range(nombre):
+            operation = self.creer_operation(self.user, self.client_crm)
+            PassageOperation.objects.create(
+                operation=operation, date_prevue=self.now + timedelta(days=1, hours=i % 5)
+            )
+
+    def test_statuts_et_retards_de_paiement(self):
+        op_retard = self.creer_operation(self.user, self.client_crm, statut='realise')
+        PassageOperation.objects.create(
+            operation=op_retard, date_prevue=self.now - timedelta(days=2),
+            date_realisation=self.now - timedelta(days=2), realise=True
+        )
+        for montant in ('40', '60'):
+            Echeance.objects.create(
+                operation=op_retard, numero=int(montant), montant=Decimal(montant),
+                date_echeance=self.today - timedelta(days=1), paye=False
+            )
+        # Échéance à venir : pas en retard
+        Echeance.objects.create(
+            operation=op_retard, numero=3, montant=Decimal('500'),
+            date_echeance=self.today + timedelta(days=5), paye=False
+        )
+
+        op_a_traiter = self.creer_operation(self.user, self.client_crm)
+        PassageOperation.objects.create(operation=op_a_traiter, date_prevue=self.now - timedelta(days=1))
+
+        op_planifie = self.creer_operation(self.user, self.client_crm)
+        PassageOperation.objects.create(operation=op_planifie, date_prevue=self.now + timedelta(days=1))
+
+        # Hors période
+        op_hors = self.creer_operation(self.user, self.client_crm)
+        PassageOperation.objects.create(operation=op_hors, date_prevue=self.now + timedelta(days=30))
+
+        evenements = {
+            e['id']: e for e in construire_evenements_calendrier(self.user, self.debut, self.fin, now=self.now)
+        }
+
+        self.assertEqual(set(evenements), {op_retard.id, op_a_traiter.id, op_planifie.id})
+        self.assertEqual(evenements[op_retard.id]['statut'], 'realise')
+        self.assertEqual(evenements[op_retard.id]['color_class'], 'event-realise')
+        self.assertTrue(evenements[op_retard.id]['has_retard_paiement'])
+        self.assertEqual(evenements[op_retard.id]['nb_retards'], 2)
+        self.assertEqual(evenements[op_retard.id]['montant_retard'], 100.0)
+        self.assertEqual(evenements[op_a_traiter.id]['statut'], 'a_traiter')
+        self.assertFalse(evenements[op_a_traiter.id]['has_retard_paiement'])
+        self.assertEqual(evenements[op_a_traiter.id]['montant_retard'], 0.0)
+        self.assertEqual(evenements[op_planifie.id]['statut'], 'planifie')
+        self.assertFalse(evenements[op_planifie.id]['is_past'])
+
+    def test_une_seule_requete_quel_que_soit_le_nombre_de_passages(self):
+        self.creer_passages(3)
+        with self.assertNumQueries(1):
+            evenements = construire_evenements_calendrier(self.user, self.debut, self.fin, now=self.now)
+        self.assertEqual(len(evenements), 3)
+
+        self.creer_passages(50)
+        with self.assertNumQueries(1):
+            evenements = construire_evenements_calendrier(self.user, self.debut, self.fin, now=self.now)
+        self.assertEqual(len(evenements), 53)
+
+
+class CalendrierApiTests(DonneesMixin, TestCase):
+
+    def setUp(self):
+        self.user = self.creer_user()
+        self.client_crm = self.creer_client(self.user)
+        self.client.force_login(self.user)
+        self.now = timezone.now()
+        self.today = self.now.date()
+        self.operation = self.creer_operation(self.user, self.client_crm)
+        self.passage = PassageOperation.objects.create(
+            operation=self.operation, date_prevue=self.now + timedelta(days=1)
+        )
+        self.params = {
+            'debut': (self.today - timedelta(days=3)).isoformat(),
+            'fin': (self.today + timedelta(days=3)).isoformat(),
+        }
+        self.url = reverse('calendrier_evenements')
+
+    def test_evenements_en_colonnes(self):
+        autre = self.creer_operation(self.user, self.client_crm)
+        PassageOperation.objects.create(operation=autre, date_prevue=self.now + timedelta(days=30))
+
+        response = self.client.get(self.url, self.params)
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['nb'], 1)
+        self.assertEqual(data['colonnes']['passage_id'], [self.passage.id])
+        self.assertEqual(data['colonnes']['statut'], ['planifie'])
+        self.assertIn('ETag', response)
+        self.assertIn('Last-Modified', response)
+
+    def test_304_tant_que_rien_ne_change(self):
+        etag = self.client.get(self.url, self.params)['ETag']
+
+        # Revalidation : une seule requête d'agrégat, pas de construction des événements
+        with CaptureQueriesContext(connection) as requetes:
+            response = self.client.get(self.url, self.params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len([q for q in requetes.captured_queries if 'core_passageoperation' in q['sql']]), 1)
+
+        self.passage.commentaire = 'Sonner deux fois'
+        self.passage.save()
+        response = self.client.get(self.url, self.params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_etag_change_apres_modification_du_client(self):
+        etag = self.client.get(self.url, self.params)['ETag']
+
+        self.client_crm.nom = 'Durand'
+        self.client_crm.telephone = '0611223344'
+        self.client_crm.save()
+        response = self.client.get(self.url, self.params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['colonnes']['client_nom'], ['Durand Jean'])
+        self.assertEqual(response.json()['colonnes']['phone'], ['0611223344'])
+
+    def test_etag_change_apres_suppression_ou_retard_de_paiement(self):
+        autre = PassageOperation.objects.create(
+            operation=self.operation, date_prevue=self.now + timedelta(days=2)
+        )
+        etag = self.client.get(self.url, self.params)['ETag']
+        PassageOperation.objects.filter(pk=autre.pk).delete()
+        etag_apres_suppression = self.client.get(self.url, self.params)['ETag']
+        self.assertNotEqual(etag_apres_suppression, etag)
+
+        Echeance.objects.create(
+            operation=self.operation, numero=1, montant=Decimal('80'),
+            date_echeance=self.today - timedelta(days=1), paye=False
+        )
+        response = self.client.get(self.url, self.params, HTTP_IF_NONE_MATCH=etag_apres_suppression)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['colonnes']['nb_retards'], [1])
+
+    def test_periode_invalide(self):
+        self.assertEqual(self.client.get(self.url, {'debut': 'hier', 'fin': '2026-01-01'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'debut': '2026-03-01', 'fin': '2026-01-01'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'debut': '2026-01-01', 'fin': '2026-12-31'}).status_code, 400)
+
+    def test_passages_des_autres_utilisateurs_exclus(self):
+        autre_user = self.creer_user('autre')
+        autre_op = self.creer_operation(autre_user, self.creer_client(autre_user))
+        PassageOperation.objects.create(operation=autre_op, date_prevue=self.now + timedelta(days=1))
+
+        data = self.client.get(self.url, self.params).json()
+        self.assertEqual(data['colonnes']['id'], [self.operation.id])
+
+
+class RechercheTests(DonneesMixin, TestCase):
+
+    def setUp(self):
+        self.user = self.creer_user()
+        self.client_crm = Client.objects.create(
+            user=self.user, nom='Lefèvre', prenom='Hélène', telephone='06 01 02 03 04',
+            email='helene@example.com', adresse='3 impasse des Lilas', ville='Besançon'
+        )
+        self.autre_client = self.creer_client(self.user, nom='Martin')
+        self.autre_client.telephone = '0799887766'
+        self.autre_client.save()
+        self.operation = self.creer_operation(
+            self.user, self.client_crm, type_prestation='Entretien chaudière',
+            commentaires='Chien méchant, sonner deux fois'
+        )
+        self.autre_operation = self.creer_operation(self.user, self.autre_client, type_prestation='Peinture')
+        self.operations = Operation.objects.filter(user=self.user)
+
+    def ids(self, queryset):
+        return set(queryset.values_list('pk', flat=True))
+
+    def test_index_fts_present_sous_sqlite(self):
+        if connection.vendor == 'sqlite':
+            self.assertTrue(fts_disponible(Operation))
+
+    def test_recherche_sans_accents_ni_casse(self):
+        for terme in ('chaudiere', 'MÉCHANT', 'lefevre', 'besancon', 'Hélène'):
+            with self.subTest(terme=terme):
+                self.assertEqual(self.ids(rechercher_operations(self.operations, terme)), {self.operation.pk})
+
+        self.assertEqual(
+            self.ids(rechercher_clients(Client.objects.filter(user=self.user), 'lilas')),
+            {self.client_crm.pk}
+        )
+
+    def test_terme_court_et_sans_resultat(self):
+        self.assertEqual(self.ids(rechercher_operations(self.operations, 'pe')), {self.autre_operation.pk})
+        self.assertEqual(self.ids(rechercher_operations(self.operations, 'introuvable')), set())
+        self.assertEqual(self.ids(rechercher_operations(self.operations, '  ')), self.ids(self.operations))
+
+    def test_index_maintenu_a_l_enregistrement(self):
+        self.operation.commentaires = 'Digicode 4512'
+        self.operation.save()
+        self.assertEqual(self.ids(rechercher_operations(self.operations, 'digicode')), {self.operation.pk})
+        self.assertEqual(self.ids(rechercher_operations(self.operations, 'méchant')), set())
+
+        # Le client renommé est retrouvé via ses opérations
+        self.client_crm.nom = 'Rousseau'
+        self.client_crm.save()
+        self.assertEqual(self.ids(rechercher_operations(self.operations, 'rousseau')), {self.operation.pk})
+        self.assertEqual(self.ids(rechercher_operations(self.operations, 'lefevre')), set())
+
+    def test_enregistrement_sans_champ_recherche_ne_relit_pas_le_client(self):
+        operation = Operation.objects.get(pk=self.operation.pk)
+        operation.statut = 'planifie'
+        with self.assertNumQueries(1):
+            operation.save()
+
+    def test_chemin_rapide_identifiant_et_telephone(self):
+        with CaptureQueriesContext(connection) as requetes:
+            resultat = self.ids(rechercher_operations(self.operations, self.operation.id_operation.lower()))
+        self.assertEqual(resultat, {self.operation.pk})
+        self.assertFalse(any('_fts' in q['sql'] or 'texte_recherche' in q['sql'] for q in requetes.captured_queries))
+
+        self.assertEqual(self.ids(rechercher_operations(self.operations, '0601020304')), {self.operation.pk})
+        self.assertEqual(
+            self.ids(rechercher_clients(Client.objects.filter(user=self.user), '06.01.02.03.04')),
+            {self.client_crm.pk}
+        )
+        # Numéro partiel : recherche texte
+        self.assertEqual(self.ids(rechercher_operations(self.operations, '020304')), {self.operation.pk})
+
+    def test_vue_operations_recherche(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('operations'), {'recherche': 'chaudiere'})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, self.operation.id_operation)
+        self.assertNotContains(response, self.autre_operation.id_operation)
+
+
+class SuggestionsClientsTests(DonneesMixin, TestCase):
+
+    def setUp(self):
+        self.user = self.creer_user()
+        self.client.force_login(self.user)
+        self.helene = Client.objects.create(
+            user=self.user, nom='Lefèvre', prenom='Hélène', telephone='06 01 02 03 04',
+            email='contact@dupontel.fr', adresse='3 impasse des Lilas', ville='Besançon'
+        )
+        self.jean = Client.objects.create(
+            user=self.user, nom='Dupont', prenom='Jean', telephone='0799887766',
+            adresse='1 rue Lefebvre', ville='Paris'
+        )
+        self.url = reverse('clients_suggestions')
+
+    def suggestions(self, terme, **params):
+        response = self.client.get(self.url, {'q': terme, **params})
+        self.assertEqual(response.status_code, 200)
+        return [client['id'] for client in response.json()['clients']]
+
+    def test_prefixe_nom_prenom_ville_sans_accents(self):
+        for terme, attendu in (
+            ('lef', [self.helene.pk]),
+            ('HELE', [self.helene.pk]),
+            ('besan', [self.helene.pk]),
+            ('jean dup', [self.jean.pk]),
+            ('par', [self.jean.pk]),
+        ):
+            with self.subTest(terme=terme):
+                self.assertEqual(self.suggestions(terme), attendu)
+
+    def test_pas_de_correspondance_hors_debut_de_mot_ni_autres_champs(self):
+        # « upon » au milieu de Dupont, « lilas » dans l'adresse, email
+        for terme in ('upon', 'lilas', 'dupontel.fr'):
+            with self.subTest(terme=terme):
+                self.assertEqual(self.suggestions(terme), [])
+
+    def test_prefixe_telephone(self):
+        self.assertEqual(self.suggestions('06 01'), [self.helene.pk])
+        self.assertEqual(self.suggestions('07'), [self.jean.pk])
+        self.assertEqual(self.suggestions('0102'), [])
+
+    def test_termes_courts(self):
+        # 2 caractères : début du nom (intervalle indexé)
+        self.assertEqual(self.suggestions('du'), [self.jean.pk])
+        self.assertEqual(self.suggestions('LE'), [self.helene.pk])
+        self.assertEqual(self.suggestions('je'), [])
+        self.assertEqual(self.suggestions('d'), [])
+        self.assertEqual(self.suggestions('0'), [])
+
+    def test_mot_courant_de_l_adresse_limite_en_sql(self):
+        Client.objects.bulk_create([
+            Client(user=self.user, id_client=f'RUE{i:04d}', nom=f'Martin{i:02d}', prenom='Paul',
+                   telephone='0600000000', adresse=f'{i} rue des Lilas', ville='Lyon',
+                   texte_recherche=f'martin{i:02d} paul {i} rue des lilas lyon',
+                   texte_suggestion=f' martin{i:02d} paul lyon')
+            for i in range(30)
+        ])
+        reconstruire_index(Client)
+
+        # « rue » est dans toutes les adresses, dans aucun nom, prénom ou ville
+        with CaptureQueriesContext(connection) as requetes:
+            self.assertEqual(self.suggestions('rue'), [])
+        self.assertIn('LIMIT', requetes[-1]['sql'])
+        self.assertEqual(len(self.suggestions('martin')), 10)
+
+    def test_limite_et_autres_comptes(self):
+        Client.objects.bulk_create([
+            Client(user=self.user, id_client=f'SUGG{i:04d}', nom=f'Durand{i:02d}', prenom='Paul',
+                   telephone='0600000000', ville='Lyon', texte_recherche=f'durand{i:02d} paul lyon',
+                   texte_suggestion=f' durand{i:02d} paul lyon')
+            for i in range(30)
+        ])
+        reconstruire_index(Client)
+        autre = self.creer_user('autre')
+        self.creer_client(autre, nom='Dupont')
+
+        self.assertEqual(len(self.suggestions('durand')), 10)
+        self.assertEqual(len(self.suggestions('durand', limite=50)), 20)
+        self.assertEqual(self.suggestions('dupont'), [self.jean.pk])
+
+    def test_formulaire_sans_liste_des_clients(self):
+        response = self.client.get(reverse('operation_create'), {'client': self.jean.pk})
+        self.assertNotContains(response, '<option value="%s"' % self.helene.pk)
+        self.assertNotContains(response, 'Lefèvre')
+        self.assertEqual(response.context['client_choisi'], self.jean)
+        self.assertContains(response, 'value="Dupont Jean - Paris"')
+
+
+class OperationsListePaginationTests(DonneesMixin, TestCase):
+
+    def setUp(self):
+        self.user = self.creer_user()
+        self.client_crm = self.creer_client(self.user)
+        self.client.force_login(self.user)
+        self.url = reverse('operations')
+
+    def creer_operations(self, nombre):
+        Operation.objects.bulk_create([
+            Operation(
+                user=self.user, client=self.client_crm, id_operation=f'PAGE{i:05d}',
+                type_prestation='Entretien', adresse_intervention='1 rue de la Paix',
+                statut='a_planifier',
+            )
+            for i in range(nombre)
+        ])
+        # Dates de création identiques par paquets : le départage se fait par l'id
+        for i, pk in enumerate(Operation.objects.filter(user=self.user).order_by('pk').values_list('pk', flat=True)):
+            Operation.objects.filter(pk=pk).update(date_creation=timezone.now() - timedelta(days=i // 3))
+
+    def parcourir(self, tri):
+        response = self.client.get(self.url, {'tri': tri})
+        ids = [op.pk for op in response.context['operations']]
+        curseur = response.context['curseur_suivant']
+        while curseur:
+            data = self.client.get(self.url, {'tri': tri, 'curseur': curseur}).json()
+            ids += [int(pk) for pk in re.findall(r'/operations/(\d+)/', data['html'])]
+            curseur = data['curseur']
+        return ids
+
+    def test_premiere_page_bornee_et_total(self):
+        self.creer_operations(120)
+        response = self.client.get(self.url)
+        self.assertEqual(len(response.context['operations']), 50)
+        self.assertEqual(response.context['total_operations'], 120)
+        self.assertIsNotNone(response.context['curseur_suivant'])
+
+    def test_parcours_complet_dans_l_ordre_du_tri(self):
+        self.creer_operations(120)
+        for tri, ordre in (('recent', ('-date_creation', '-pk')), ('ancien', ('date_creation', 'pk'))):
+            with self.subTest(tri=tri):
+                attendu = list(Operation.objects.filter(user=self.user).order_by(*ordre).values_list('pk', flat=True))
+                self.assertEqual(self.parcourir(tri), attendu)
+
+    def test_requetes_par_page_independantes_du_volume(self):
+        self.creer_operations(60)
+        curseur = self.client.get(self.url).context['curseur_suivant']
+        with CaptureQueriesContext(connection) as requetes_60:
+            self.client.get(self.url, {'curseur': curseur})
+
+        self.creer_operations(400)
+        curseur = self.client.get(self.url).context['curseur_suivant']
+        with CaptureQueriesContext(connection) as requetes_460:
+            self.client.get(self.url, {'curseur': curseur})
+
+        self.assertEqual(len(requetes_60), len(requetes_460))
+
+    def test_curseur_invalide_repart_du_debut(self):
+        self.creer_operations(10)
+        data = self.client.get(self.url, {'curseur': 'pas-un-curseur'}).json()
+        self.assertTrue(data['success'])
+        self.assertIsNone(data['curseur'])
+
+    def test_page_ne_charge_que_les_colonnes_et_le_dernier_devis_affiches(self):
+        operation = self.creer_operation(
+            self.user, self.client_crm, avec_devis=True, commentaires='Texte long ' * 100
+        )
+        for version in (1, 2, 3):
+            self.creer_devis(operation, version=version, statut='brouillon')
+        HistoriqueOperation.objects.create(operation=operation, action='Ancienne action', utilisateur=self.user)
+        HistoriqueOperation.objects.create(operation=operation, action='X' * 80, utilisateur=self.user)
+
+        page = self.client.get(self.url).context['operations']
+        ligne = page[0]
+
+        self.assertTrue({'commentaires', 'adresse_intervention', 'texte_recherche'} <= ligne.get_deferred_fields())
+        self.assertEqual([devis.version for devis in ligne.derniers_devis], [3])
+        self.assertEqual(ligne.dernier_devis_obj.version, 3)
+        self.assertEqual(ligne.derniere_action, 'X' * 50)
+
+
+class ClientsListeTests(DonneesMixin, TestCase):
+
+    def setUp(self):
+        self.user = self.creer_user()
+        self.client.force_login(self.user)
+        self.url = reverse('clients')
+
+    def creer_clients(self, nombre, debut=0):
+        Client.objects.bulk_create([
+            Client(
+                user=self.user, id_client=f'LISTE{i:05d}', nom=f'Nom{i:05d}', prenom='Jean',
+                telephone='0601020304', ville='Paris',
+            )
+            for i in range(debut, debut + nombre)
+        ])
+        Operation.objects.bulk_create([
+            Operation(
+                user=self.user, client=client, id_operation=f'LOP{client.pk:05d}{k}',
+                type_prestation='Entretien', statut='a_planifier',
+                date_prevue=timezone.now() + timedelta(days=k + 1),
+            )
+            for client in Client.objects.filter(user=self.user, operations__isnull=True)
+            for k in range(2)
+        ])
+
+    def test_resume_des_operations_annote(self):
+        client = self.creer_client(self.user)
+        now = timezone.now()
+        ancienne = self.creer_operation(self.user, client, type_prestation='Ancienne', statut='paye', montant_total=Decimal('300.00'))
+        Operation.objects.filter(pk=ancienne.pk).update(date_creation=now - timedelta(days=10))
+        self.creer_operation(self.user, client, type_prestation='Payée future', statut='paye',
+                             montant_total=Decimal('200.00'), date_prevue=now + timedelta(days=1))
+        self.creer_operation(self.user, client, type_prestation='Passée', statut='planifie',
+                             date_prevue=now - timedelta(days=1))
+        annulee = self.creer_operation(self.user, client, type_prestation='Annulée', statut='devis_refuse',
+                                       date_prevue=now + timedelta(days=2))
+        Operation.objects.filter(pk=annulee.pk).update(date_creation=now - timedelta(days=5))
+        self.creer_operation(self.user, client, type_prestation='Prochaine', statut='planifie',
+                             date_prevue=now + timedelta(days=3))
+        self.creer_operation(self.user, client, type_prestation='Plus tard', statut='planifie',
+                             date_prevue=now + timedelta(days=9))
+        sans_operation = self.creer_client(self.user, nom='Martin')
+
+        lignes = {c.pk: c for c in annoter_clients(Client.objects.filter(user=self.user), now)}
+        ligne = lignes[client.pk]
+
+        self.assertEqual(ligne.derniere_op_type, 'Plus tard')
+        # L'opération annulée (devis refusé), pourtant plus proche, est ignorée
+        self.assertEqual(ligne.prochaine_op_type, 'Prochaine')
+        self.assertEqual(ligne.nb_operations, 6)
+        self.assertEqual(ligne.ca_total, Decimal('500.00'))
+        self.assertIsNone(lignes[sans_operation.pk].derniere_op_date)
+        self.assertIsNone(lignes[sans_operation.pk].prochaine_op_date)
+        self.assertEqual(lignes[sans_operation.pk].nb_operations, 0)
+        self.assertEqual(lignes[sans_operation.pk].ca_total, Decimal('0.00'))
+
+    def test_page_bornee_et_total(self):
+        self.creer_clients(120)
+        response = self.client.get(self.url)
+        self.assertEqual(len(response.context['clients']), 50)
+        self.assertEqual(response.context['total_clients'], 120)
+
+        derniere = self.client.get(self.url, {'page': 3})
+        self.assertEqual([c.nom for c in derniere.context['clients']][-1], 'Nom00119')
+        self.assertFalse(derniere.context['page_obj'].has_next())
+
+    def test_requetes_independantes_du_nombre_de_clients(self):
+        self.creer_clients(10)
+        with CaptureQueriesContext(connection) as requetes_10:
+            self.client.get(self.url)
+
+        self.creer_clients(200, debut=10)
+        with CaptureQueriesContext(connection) as requetes_210:
+            self.client.get(self.url, {'page': 2})
+
+        self.assertEqual(len(requetes_10), len(requetes_210))
+
+
+class FicheClientTests(DonneesMixin, TestCase):
+
+    def setUp(self):
+        self.user = self.creer_user()
+        self.client_crm = self.creer_client(self.user)
+        self.client.force_login(self.user)
+
+    def creer_operation_chiffree(self, statut, total, encaisse):
+        operation = self.creer_operation(self.user, self.client_crm, statut=statut)
+        Operation.objects.filter(pk=operation.pk).update(
+            montant_total=Decimal(total), montant_encaisse=Decimal(encaisse)
+        )
+        return operation
+
+    def test_totaux_du_client(self):
+        self.creer_operation_chiffree('paye', '1000.00', '1000.00')
+        self.creer_operation_chiffree('realise', '500.00', '200.00')
+        self.creer_operation_chiffree('planifie', '800.00', '100.00')
+        # Trop-perçu : pas de reste négatif
+        self.creer_operation_chiffree('paye', '100.00', '150.00')
+        self.creer_operation(self.user, self.creer_client(self.user, nom='Autre'), statut='paye')
+
+        with self.assertNumQueries(1):
+            totaux = calculer_totaux_client(self.client_crm)
+
+        self.assertEqual(totaux, {
+            'nb_operations': 4,
+            'ca_total': Decimal('1100.00'),
+            'total_encaisse': Decimal('1450.00'),
+            'reste_a_encaisser': Decimal('300.00'),
+        })
+
+    def test_solde_par_operation(self):
+        operation = self.creer_operation_chiffree('realise', '500.00', '200.00')
+        response = self.client.get(reverse('client_detail', args=[self.client_crm.pk]))
+
+        ligne = response.context['operations'][0]
+        self.assertEqual(ligne.pk, operation.pk)
+        self.assertEqual(ligne.reste_du, Decimal('300.00'))
+        self.assertEqual(response.context['reste_a_encaisser'], Decimal('300.00'))
+
+    def test_requetes_independantes_du_nombre_d_operations(self):
+        url = reverse('client_detail', args=[self.client_crm.pk])
+        self.creer_operation_chiffree('paye', '100.00', '100.00')
+        with CaptureQueriesContext(connection) as requetes_1:
+            self.client.get(url)
+
+        for _ in range(10):
+            self.creer_operation_chiffree('paye', '100.00', '100.00')
+        with CaptureQueriesContext(connection) as requetes_11:
+            self.client.get(url)
+
+        self.assertEqual(len(requetes_1), len(requetes_11))
+
+
+class PlansRequetesTests(DonneesMixin, TestCase):
+
+    def test_pages_principales_servies_par_des_index(self):
+        sortie = io.StringIO()
+        call_command('verifier_plans_requetes', '--operations', '60', stdout=sortie)
+
+        self.assertIn('operations (page 2)', sortie.getvalue())
+        # Jeu généré annulé
+        self.assertFalse(User.objects.filter(username=NOM_UTILISATEUR_GENERE).exists())
+
+    def test_mesure_memoire_sur_jeu_genere(self):
+        sortie = io.StringIO()
+        call_command('mesurer_memoire_liste', '--operations', '60', '--repetitions', '1', stdout=sortie)
+
+        self.assertIn('Jeu généré : 60 opérations', sortie.getvalue())
+        self.assertIn('HTTP 200', sortie.getvalue())
+        self.assertFalse(User.objects.filter(username='mesure_memoire').exists())
+
+    def test_tri_sans_index_avant_limit_detecte(self):
+        user = self.creer_user()
+        operation = self.creer_operation(user, self.creer_client(user))
+
+        with CaptureQueriesContext(connection) as requetes:
+            list(operation.historique.order_by('-date')[:10])
+            list(HistoriqueOperation.objects.order_by('action')[:10])
+        (sql_indexe, sql_non_indexe) = [requete['sql'] for requete in requetes]
+
+        self.assertFalse(tri_sans_index(sql_indexe, expliquer(sql_indexe)))
+        self.assertTrue(tri_sans_index(sql_non_indexe, expliquer(sql_non_indexe)))
+
+
+class DatesLocalesTests(DonneesMixin, TestCase):
+    """Jours locaux (Europe/Paris) -> intervalles de dates-heures, changements d'heure compris"""
+
+    PASSAGE_HEURE_ETE = date(2026, 3, 29)   # 02:00 -> 03:00 : jour de 23 h
+    PASSAGE_HEURE_HIVER = date(2026, 10, 25)  # 03:00 -> 02:00 : jour de 25 h
+
+    def setUp(self):
+        self.user = self.creer_user()
+        self.client_crm = self.creer_client(self.user)
+        self.operation = self.creer_operation(self.user, self.client_crm)
+
+    def local(self, *args, fold=0):
+        return datetime(*args, tzinfo=timezone.get_current_timezone(), fold=fold)
+
+    def test_duree_des_jours_de_changement_d_heure(self):
+        # Durées réelles : comparer en UTC (entre deux datetimes du même fuseau,
+        # Python soustrait les heures affichées)
+        debut, fin = [borne.astimezone(dt_timezone.utc) for borne in intervalle_jours(self.PASSAGE_HEURE_ETE)]
+        self.assertEqual(fin - debut, timedelta(hours=23))
+        self.assertEqual(debut, datetime(2026, 3, 28, 23, tzinfo=dt_timezone.utc))
+
+        debut, fin = [borne.astimezone(dt_timezone.utc) for borne in intervalle_jours(self.PASSAGE_HEURE_HIVER)]
+        self.assertEqual(fin - debut, timedelta(hours=25))
+        self.assertEqual(fin, datetime(2026, 10, 25, 23, tzinfo=dt_timezone.utc))
+
+    def test_meme_resultat_que_le_lookup_date(self):
+        instants = [
+            self.local(2026, 3, 28, 23, 59),
+            self.local(2026, 3, 29, 0, 0),
+            self.local(2026, 3, 29, 1, 59),
+            self.local(2026, 3, 29, 3, 0),
+            self.local(2026, 3, 29, 23, 59),
+            self.local(2026, 3, 30, 0, 0),
+            self.local(2026, 10, 24, 23, 59),
+            self.local(2026, 10, 25, 0, 0),
+            self.local(2026, 10, 25, 2, 30),
+            self.local(2026, 10, 25, 2, 30, fold=1),
+            self.local(2026, 10, 25, 23, 59),
+            self.local(2026, 10, 26, 0, 0),
+        ]
+        for numero, instant in enumerate(instants, start=1):
+            PassageOperation.objects.create(operation=self.operation, numero=numero, date_prevue=instant)
+
+        passages = PassageOperation.objects.filter(operation=self.operation)
+        for jour in (self.PASSAGE_HEURE_ETE, self.PASSAGE_HEURE_HIVER):
+            with self.subTest(jour=jour):
+                attendus = set(passages.filter(date_prevue__date=jour).values_list('pk', flat=True))
+                obtenus = set(passages.filter(q_jours('date_prevue', jour, jour)).values_list('pk', flat=True))
+                self.assertEqual(obtenus, attendus)
+                self.assertEqual(len(obtenus), 4)
+
+        # Bornes ouvertes d'un côté
+        self.assertEqual(
+            passages.filter(q_jours('date_prevue', dernier=self.PASSAGE_HEURE_ETE)).count(),
+            passages.filter(date_prevue__date__lte=self.PASSAGE_HEURE_ETE).count(),
+        )
+        self.assertEqual(
+            passages.filter(q_jours('date_prevue', premier=self.PASSAGE_HEURE_HIVER)).count(),
+            passages.filter(date_prevue__date__gte=self.PASSAGE_HEURE_HIVER).count(),
+        )
+
+    def test_aujourdhui_est_le_jour_local(self):
+        # 00:30 à Paris le 25/10, encore le 24/10 en UTC
+        now = self.local(2026, 10, 25, 0, 30)
+        self.assertEqual(now.astimezone(dt_timezone.utc).date(), date(2026, 10, 24))
+        self.assertEqual(jour_local(now), self.PASSAGE_HEURE_HIVER)
+
+        PassageOperation.objects.create(
+            operation=self.operation, numero=1, date_prevue=self.local(2026, 10, 25, 23, 30)
+        )
+        operation = annoter_categories(Operation.objects.filter(pk=self.operation.pk), now=now).get()
+        self.assertTrue(operation.est_aujourdhui)
+        self.assertFalse(operation.est_demain)
+
+    def test_calendrier_sur_un_jour_de_25_heures(self):
+        PassageOperation.objects.create(
+            operation=self.operation, numero=1, date_prevue=self.local(2026, 10, 25, 23, 30)
+        )
+        autre = self.creer_operation(self.user, self.client_crm)
+        PassageOperation.objects.create(operation=autre, numero=1, date_prevue=self.local(2026, 10, 26, 0, 0))
+
+        evenements = construire_evenements_calendrier(
+            self.user, self.PASSAGE_HEURE_HIVER, self.PASSAGE_HEURE_HIVER, now=self.local(2026, 10, 20, 12, 0)
+        )
+        self.assertEqual([e['id'] for e in evenements], [self.operation.id])
+
+    @skipIf(connection.vendor != 'sqlite', "Plan d'exécution propre à SQLite")
+    def test_intervalle_sert_l_index(self):
+        jour = self.PASSAGE_HEURE_ETE
+        plan = PassageOperation.objects.filter(
+            q_jours('date_prevue', jour, jour), operation=self.operation, realise=False
+        ).explain()
+        self.assertIn('passage_a_realiser_idx (operation_id=? AND date_prevue>? AND date_prevue<?)', plan)
@@ -5,6 +5,7 @@ from . import views
 urlpatterns = [
     # Dashboard
     path('', views.dashboard, name='dashboard'),
+    path('calendrier/evenements/', views.calendrier_evenements, name='calendrier_evenements'),
     
     # Opérations
     path('operations/', views.operations_list, name='operations'),
@@ -21,6 +22,7 @@ urlpatterns = [
     # Clients
     path('clients/', views.clients_list, name='clients'),
     path('clients/nouveau/', views.client_create, name='client_create'),
+    path('clients/suggestions/', views.clients_suggestions, name='clients_suggestions'),
     path('clients/<int:client_id>/', views.client_detail, name='client_detail'),
     path('clients/<int:client_id>/modifier/', views.client_edit, name='client_edit'),
     path('clients/<int:client_id>/supprimer/', views.client_delete, name='client_delete'),
@@ -34,6 +36,8 @@ urlpatterns = [
     
     path('operations/<int:operation_id>/ajax/add-ligne-devis/', views.ajax_add_ligne_devis, name='ajax_add_ligne_devis'),
     path('operations/<int:operation_id>/ajax/delete-ligne-devis/', views.ajax_delete_ligne_devis, name='ajax_delete_ligne_devis'),
+    path('operations/<int:operation_id>/ajax/action/', views.ajax_action_operation, name='ajax_action_operation'),
+    path('operations/<int:operation_id>/ajax/lignes-devis/', views.ajax_lignes_devis_lot, name='ajax_lignes_devis_lot'),
     
     # ✅ ROUTES POUR INTERVENTIONS MULTIPLES
     path('operation/<int:operation_id>/intervention/<int:intervention_id>/planifier/', 
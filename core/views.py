@@ -5,14 +5,20 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.http import HttpResponse, JsonResponse
-from django.db.models import Q, Sum,Max, Count, Subquery, Exists, OuterRef
+from django.template.loader import render_to_string
+from django.db.models import Q, Sum,Max, Count, Subquery, Exists, OuterRef, Prefetch, prefetch_related_objects
+from django.db.models.functions import Substr
 from django.db import models
 from django.contrib import messages
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth import login, logout
 from django.core.management import call_command
+from django.core.paginator import Paginator
 from decimal import Decimal
 from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import require_GET
 import io
 import sys
 import json
@@ -30,12 +36,34 @@ from .models import (
     HistoriqueOperation, 
     Echeance, 
     ProfilEntreprise,
-    PassageOperation
+    PassageOperation,
 )
 
 from .fix_database import fix_client_constraint
-import re
 from .pdf_generator import generer_devis_pdf
+from .facturation import LIBELLES_TYPE_FACTURE, FacturationError, emettre_facture
+from .actions_operation import ACTIONS_OPERATION, ActionOperationError, totaux_paiements, totaux_stockes
+from .lignes_devis import LignesDevisError, appliquer_lot, ligne_json, nouvelle_version, totaux_json
+from .dates import jour_local, q_jours
+from .pagination import TAILLE_PAGE, paginer
+from .recherche import (
+    SUGGESTIONS_DEFAUT, SUGGESTIONS_MAX, rechercher_clients, rechercher_operations, suggerer_clients,
+)
+from .calendrier import construire_evenements_calendrier, evenements_en_colonnes, version_calendrier
+from .compteurs import (
+    CATEGORIES_DEVIS,
+    annoter_categories,
+    annoter_clients,
+    annoter_dernier_devis,
+    annoter_soldes,
+    calculer_compteurs_devis,
+    calculer_compteurs_operations,
+    calculer_kpi_dashboard,
+    calculer_kpi_financiers,
+    calculer_totaux_client,
+    expr_date_limite_devis,
+    q_devis_expire,
+)
 
 
 @login_required
@@ -44,236 +72,29 @@ def dashboard(request):
     #fix_client_constraint()
     try:
         
-        today = timezone.now().date()
-        
-        # ========================================
-        # KPI ESSENTIELS (INCHANGÉS)
         # ========================================
-        nb_clients = Client.objects.filter(user=request.user).count()
-        
-        debut_mois = timezone.now().replace(day=1)
-        
-        ca_mois = Echeance.objects.filter(
-            operation__user=request.user,
-            paye=True,
-            date_echeance__gte=debut_mois
-        ).aggregate(total=Sum('montant'))['total'] or 0
-        
-        # ✅ Compter les DEVIS en attente (envoyés, non expirés, non répondus)
-        nb_en_attente_devis = 0
-        for op in Operation.objects.filter(user=request.user, avec_devis=True):
-            for devis in op.devis_set.filter(statut='envoye', date_envoi__isnull=False):
-                if not devis.est_expire:
-                    nb_en_attente_devis += 1
-        
-        nb_a_planifier = Operation.objects.filter(
-            user=request.user, 
-            statut='a_planifier'
-        ).count()
-        
-        operations_realises = Operation.objects.filter(
-            user=request.user,
-            statut='realise'
-        ).prefetch_related('echeances')
-        
-        nb_paiements_retard = 0
-        nb_operations_sans_paiement = 0
-        
-        for op in operations_realises:
-            retards = op.echeances.filter(
-                paye=False,
-                date_echeance__lt=timezone.now().date()
-            )
-            nb_paiements_retard += retards.count()
-            
-            total_planifie = op.echeances.aggregate(
-                total=Sum('montant')
-            )['total'] or 0
-            
-            reste_a_planifier = op.montant_total - total_planifie
-            
-            if reste_a_planifier > 0:
-                nb_operations_sans_paiement += 1
-        
-                # ========================================
-        # NOUVEAUX KPI ESSENTIELS
+        # KPI ESSENTIELS
         # ========================================
+        # ✅ Nombre fixe de requêtes d'agrégation, quel que soit le volume
+        kpi = calculer_kpi_dashboard(request.user)
         
-        # 1. URGENCES (total)
-        # Déjà calculé dans operations_list, on le refait ici pour le dashboard
-        
-        # Paiements en retard
-        ops_paiements_retard = []
-        for op in Operation.objects.filter(user=request.user, statut='realise').prefetch_related('echeances'):
-            retards = op.echeances.filter(paye=False, date_echeance__lt=today)
-            if retards.exists():
-                ops_paiements_retard.append(op.id)
-        
-        nb_paiements_retard_dashboard = len(ops_paiements_retard)
-        
-        # Devis expirés
-        ops_devis_expires = []
-        for op in Operation.objects.filter(user=request.user, avec_devis=True).prefetch_related('devis_set'):
-            for devis in op.devis_set.filter(statut='envoye'):
-                if devis.est_expire:
-                    ops_devis_expires.append(op.id)
-                    break
-        
-        nb_devis_expire_dashboard = len(ops_devis_expires)
-        
-        # Interventions aujourd'hui
-        nb_aujourdhui = PassageOperation.objects.filter(
-            operation__user=request.user,
-            date_prevue__date=today,
-            realise=False
-        ).values('operation').distinct().count()
-        
-        # Interventions demain
-        demain = today + timedelta(days=1)
-        nb_demain = PassageOperation.objects.filter(
-            operation__user=request.user,
-            date_prevue__date=demain,
-            realise=False
-        ).values('operation').distinct().count()
-        
-        # Total urgences (sans doublons)
-        ids_urgences = set(ops_paiements_retard + ops_devis_expires)
-        # + opérations avec passage aujourd'hui/demain
-        ids_aujourdhui = set(PassageOperation.objects.filter(
-            operation__user=request.user,
-            date_prevue__date=today,
-            realise=False
-        ).values_list('operation_id', flat=True))
-        ids_demain = set(PassageOperation.objects.filter(
-            operation__user=request.user,
-            date_prevue__date=demain,
-            realise=False
-        ).values_list('operation_id', flat=True))
-        
-        ids_urgences = ids_urgences | ids_aujourdhui | ids_demain
-        nb_urgences = len(ids_urgences)
-        
-        # 2. À ENCAISSER (réalisées avec reste à payer)
-        nb_a_encaisser = 0
-        for op in Operation.objects.filter(user=request.user, statut='realise').prefetch_related('echeances'):
-            total_paye = op.echeances.filter(paye=True).aggregate(total=Sum('montant'))['total'] or 0
-            if op.montant_total and total_paye < op.montant_total:
-                nb_a_encaisser += 1
-        
-        # ========================================
-        # 🔥 CALENDRIER - VERSION PASSAGES
-        # ========================================
-        start_date = today - timedelta(days=30)
-        end_date = today + timedelta(days=14)
-
         # ========================================
-        # 🔥 CALENDRIER - VERSION HYBRIDE
+        # 🔥 CALENDRIER : chargé par le JS via calendrier_evenements
+        # (fenêtre visible uniquement, 304 si rien n'a changé)
         # ========================================
-        
-        # 1️⃣ Passages AVEC dates (dans la période)
-        passages_avec_dates = PassageOperation.objects.filter(
-            operation__user=request.user
-        ).filter(
-            Q(date_prevue__isnull=False, date_prevue__date__gte=start_date, date_prevue__date__lte=end_date) |
-            Q(date_realisation__isnull=False, date_realisation__date__gte=start_date, date_realisation__date__lte=end_date)
-        ).select_related('operation', 'operation__client')
-        
-        # ✅ SEULEMENT les passages avec dates (pas les "à planifier")
-        passages_calendrier = list(passages_avec_dates)
-
-        calendar_events = []
-        
-        for passage in passages_calendrier:
-            op = passage.operation
-            
-            #   ✅ Utiliser date_prevue du PASSAGE en priorité
-            # Si pas de date, afficher à aujourd'hui (pour les "à planifier")
-            date_affichage = passage.date_prevue or passage.date_realisation or timezone.now()
-
-            
-            is_past = date_affichage < timezone.now()
-            
-            # ✅ CODE COULEUR basé sur le STATUT DU PASSAGE
-            if passage.realise:
-                # Si passage réalisé mais opération pas payée
-                if op.statut == 'paye':
-                    color_class = 'event-paye'
-                    status_text = "Payé"
-                else:
-                    color_class = 'event-realise'
-                    status_text = "Réalisé"
-            elif passage.est_en_retard:
-                # Passage prévu dans le passé mais pas réalisé
-                color_class = 'event-a-traiter'
-                status_text = "À traiter (en retard)"
-            elif passage.est_planifie:
-                # Passage planifié dans le futur
-                color_class = 'event-planifie'
-                status_text = "Planifié"
-            else:
-                # Passage sans date prévue
-                color_class = 'event-default'
-                status_text = "À planifier"
-            
-            # Détecter retards paiement de l'OPÉRATION
-            paiements_retard_op = op.echeances.filter(
-                paye=False,
-                date_echeance__lt=timezone.now().date()
-            )
-            
-            has_retard = paiements_retard_op.exists()
-            nb_retards_op = paiements_retard_op.count()
-            montant_retard_op = paiements_retard_op.aggregate(
-                total=Sum('montant')
-            )['total'] or 0
-            
-            # ✅ Déterminer le statut brut pour le JS
-            if passage.realise:
-                statut_brut = 'realise'
-            elif passage.est_en_retard:
-                statut_brut = 'a_traiter'
-            elif passage.est_planifie:
-                statut_brut = 'planifie'
-            else:
-                statut_brut = 'a_planifier'
-
-            calendar_events.append({
-                'id': op.id,
-                'passage_id': passage.id,
-                'client_nom': f"{op.client.nom} {op.client.prenom}",
-                'service': f"{op.type_prestation} - Passage #{passage.numero}",
-                'date': date_affichage.strftime('%Y-%m-%d'),
-                'time': date_affichage.strftime('%H:%M'),
-                'address': op.adresse_intervention,
-                'phone': op.client.telephone,
-                'url': f'/operations/{op.id}/',
-                'statut': statut_brut,  # ✅ Valeur brute pour JS
-                'statut_display': status_text,  # ✅ Texte pour affichage
-                'color_class': color_class,
-                'is_past': is_past,
-                'commentaires': passage.commentaire or op.commentaires or '',
-                'has_retard_paiement': has_retard,
-                'nb_retards': nb_retards_op,
-                'montant_retard': float(montant_retard_op)
-            })
-        
         context = {
             # KPI essentiels (NOUVEAU)
-            'nb_urgences': nb_urgences,
-            'nb_aujourdhui': nb_aujourdhui,
-            'nb_en_attente_devis': nb_en_attente_devis,  # Déjà existant
-            'nb_a_encaisser': nb_a_encaisser,
-            'ca_mois': ca_mois,  # Déjà existant
-            
-            # Calendrier (existant)
-            'calendar_events_json': json.dumps(calendar_events),
-            'calendar_events': calendar_events,
+            'nb_urgences': kpi['nb_urgences'],
+            'nb_aujourdhui': kpi['nb_aujourdhui'],
+            'nb_en_attente_devis': kpi['nb_en_attente_devis'],  # Déjà existant
+            'nb_a_encaisser': kpi['nb_a_encaisser'],
+            'ca_mois': kpi['ca_mois'],  # Déjà existant
             
             # Anciens KPI (garder pour compatibilité si besoin)
-            'nb_clients': nb_clients,
-            'nb_a_planifier': nb_a_planifier,
-            'nb_paiements_retard': nb_paiements_retard,
-            'nb_operations_sans_paiement': nb_operations_sans_paiement,
+            'nb_clients': kpi['nb_clients'],
+            'nb_a_planifier': kpi['nb_a_planifier'],
+            'nb_paiements_retard': kpi['nb_paiements_retard'],
+            'nb_operations_sans_paiement': kpi['nb_operations_sans_paiement'],
         }
         
         return render(request, 'core/dashboard.html', context)
@@ -281,6 +102,53 @@ def dashboard(request):
     except Exception as e:
         return HttpResponse(f"<h1>CRM Artisans</h1><p>Erreur : {str(e)}</p>")
 
+# Fenêtre maximale servie par l'API calendrier (vue mois = 6 semaines)
+CALENDRIER_MAX_JOURS = 62
+
+
+@login_required
+@require_GET
+def calendrier_evenements(request):
+    """
+    API JSON du calendrier : passages entre ?debut= et ?fin= (AAAA-MM-JJ,
+    inclus), en colonnes. ETag / Last-Modified calculés par une requête
+    d'agrégat : 304 sans construire les événements si rien n'a changé.
+    """
+    try:
+        start_date = datetime.strptime(request.GET.get('debut', ''), '%Y-%m-%d').date()
+        end_date = datetime.strptime(request.GET.get('fin', ''), '%Y-%m-%d').date()
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'Dates invalides (format AAAA-MM-JJ)'}, status=400)
+
+    if end_date < start_date or (end_date - start_date).days > CALENDRIER_MAX_JOURS:
+        return JsonResponse({
+            'success': False,
+            'error': f'Période invalide (au plus {CALENDRIER_MAX_JOURS} jours)'
+        }, status=400)
+
+    now = timezone.now()
+    etag, last_modified = version_calendrier(request.user, start_date, end_date, now=now)
+    etag = quote_etag(etag)
+    last_modified = last_modified and int(last_modified.timestamp())
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        evenements = construire_evenements_calendrier(request.user, start_date, end_date, now=now)
+        response = JsonResponse({
+            'success': True,
+            'debut': start_date.isoformat(),
+            'fin': end_date.isoformat(),
+            'nb': len(evenements),
+            'colonnes': evenements_en_colonnes(evenements),
+        })
+
+    response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified)
+    # Toujours revalider : données propres à l'utilisateur
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
 # ════════════════════════════════════════════════════════════════════════════════
 # FONCTION 1 : COMPTEURS DEVIS
 # ════════════════════════════════════════════════════════════════════════════════
@@ -299,60 +167,9 @@ def get_devis_counters(request, all_operations):
     - nb_devis_refuse : Dernier devis en statut 'refuse'
     
     IMPORTANT : On compte par OPÉRATION (pas par devis), basé sur le DERNIER devis de chaque opération.
+    ✅ Le dernier devis est classé en base : une seule requête d'agrégation.
     """
-    
-    # Filtrer les opérations avec devis
-    operations_avec_devis = all_operations.filter(avec_devis=True).prefetch_related('devis_set')
-    
-    # Initialiser les compteurs
-    nb_devis_total = 0
-    nb_devis_brouillon = 0
-    nb_devis_pret = 0
-    nb_devis_envoye = 0
-    nb_devis_expire = 0
-    nb_devis_accepte = 0
-    nb_devis_refuse = 0
-    
-    # Parcourir chaque opération avec devis
-    for op in operations_avec_devis:
-        # Récupérer le DERNIER devis (version la plus élevée)
-        dernier_devis = op.devis_set.order_by('-version').first()
-        
-        if not dernier_devis:
-            continue
-        
-        # Compter le total
-        nb_devis_total += 1
-        
-        # Classer selon le statut du dernier devis
-        if dernier_devis.statut == 'brouillon':
-            nb_devis_brouillon += 1
-            
-        elif dernier_devis.statut == 'pret':
-            nb_devis_pret += 1
-            
-        elif dernier_devis.statut == 'envoye':
-            # Vérifier si expiré ou en attente
-            if dernier_devis.est_expire:
-                nb_devis_expire += 1
-            else:
-                nb_devis_envoye += 1
-                
-        elif dernier_devis.statut == 'accepte':
-            nb_devis_accepte += 1
-            
-        elif dernier_devis.statut == 'refuse':
-            nb_devis_refuse += 1
-    
-    return {
-        'nb_devis_total': nb_devis_total,
-        'nb_devis_brouillon': nb_devis_brouillon,
-        'nb_devis_pret': nb_devis_pret,
-        'nb_devis_envoye': nb_devis_envoye,
-        'nb_devis_expire': nb_devis_expire,
-        'nb_devis_accepte': nb_devis_accepte,
-        'nb_devis_refuse': nb_devis_refuse,
-    }
+    return calculer_compteurs_devis(all_operations)
 
 def filter_operations_by_devis(request, filtre_actif, sous_filtre, all_operations):
     """
@@ -372,331 +189,75 @@ def filter_operations_by_devis(request, filtre_actif, sous_filtre, all_operation
     if filtre_actif != 'devis':
         return None
     
-    # Filtrer les opérations avec devis
-    operations_avec_devis = all_operations.filter(avec_devis=True).prefetch_related('devis_set')
-    
-    # Liste des IDs à retourner
-    filtered_ids = []
-    
-    # Parcourir chaque opération
-    for op in operations_avec_devis:
-        # Récupérer le DERNIER devis
-        dernier_devis = op.devis_set.order_by('-version').first()
-        
-        if not dernier_devis:
-            continue
-        
-        # Appliquer le filtre selon le sous-filtre
-        should_include = False
-        
-        if not sous_filtre:
-            # Pas de sous-filtre = TOUS les devis
-            should_include = True
-            
-        elif sous_filtre == 'brouillon':
-            should_include = (dernier_devis.statut == 'brouillon')
-            
-        elif sous_filtre == 'pret':
-            should_include = (dernier_devis.statut == 'pret')
-            
-        elif sous_filtre == 'envoye':
-            # En attente = envoyé mais PAS expiré
-            should_include = (dernier_devis.statut == 'envoye' and not dernier_devis.est_expire)
-            
-        elif sous_filtre == 'expire':
-            # Expiré = envoyé ET date dépassée
-            should_include = (dernier_devis.statut == 'envoye' and dernier_devis.est_expire)
-            
-        elif sous_filtre == 'accepte':
-            should_include = (dernier_devis.statut == 'accepte')
-            
-        elif sous_filtre == 'refuse':
-            should_include = (dernier_devis.statut == 'refuse')
-        
-        if should_include:
-            filtered_ids.append(op.id)
-    
-    # Retourner le QuerySet filtré
-    return all_operations.filter(id__in=filtered_ids)
-
-
-@login_required
-def operations_list(request):
+    # Opérations avec devis, annotées avec la catégorie de leur DERNIER devis
+    operations_avec_devis = annoter_dernier_devis(all_operations.filter(avec_devis=True))
+    
+    if not sous_filtre:
+        # Pas de sous-filtre = TOUS les devis
+        return operations_avec_devis.filter(dernier_devis_statut__isnull=False)
+    
+    if sous_filtre in CATEGORIES_DEVIS:
+        # 'envoye' = envoyé mais PAS expiré, 'expire' = envoyé ET date dépassée
+        return operations_avec_devis.filter(dernier_devis_categorie=sous_filtre)
+    
+    # Sous-filtre inconnu : aucune opération
+    return operations_avec_devis.none()
+
+
+# Tri de la liste des opérations, départagé par l'id : ordre total pour la
+# pagination par curseur (recent, ancien, activite)
+TRIS_OPERATIONS = {
+    'recent': ('-date_creation', '-pk'),
+    'ancien': ('date_creation', 'pk'),
+    'activite': ('-date_modification', '-pk'),
+}
+
+# Colonnes lues par les lignes de la liste (operations/_lignes.html) :
+# ni les champs texte longs (adresse, commentaires, document de recherche)
+# ni les colonnes inutiles du client et des devis
+CHAMPS_OPERATION_LISTE = [
+    'id_operation', 'client', 'type_prestation', 'statut', 'avec_devis',
+    'date_creation', 'date_modification', 'date_prevue',
+    'montant_total', 'montant_encaisse',
+    'client__nom', 'client__prenom', 'client__ville', 'client__telephone',
+]
+CHAMPS_DEVIS_LISTE = [
+    'operation', 'numero_devis', 'version', 'statut', 'total_ttc',
+    'date_creation', 'date_envoi', 'validite_jours',
+]
+
+# Colonnes lues par l'historique des opérations de la fiche client
+CHAMPS_OPERATION_CLIENT = [
+    'client', 'type_prestation', 'statut', 'date_creation', 'date_prevue',
+    'montant_total', 'montant_encaisse',
+]
+
+# Colonnes lues par la saisie semi-automatique des clients
+CHAMPS_CLIENT_SUGGESTION = ['nom', 'prenom', 'ville', 'telephone']
+
+
+def filtrer_operations_liste(request, user, now):
     """
-    Page Opérations avec filtres intelligents :
-    - Urgences (paiements retard, devis expirés, interventions aujourd'hui/demain)
-    - À faire (à planifier, devis brouillon, paiements non planifiés)
-    - En cours (triées par dernière activité)
-    - À venir (interventions futures)
-    - À encaisser (réalisées non payées)
-    - Archivées (payées)
+    Opérations de l'onglet / sous-filtre / recherche demandés (QuerySet non
+    évalué, non trié : le tri est appliqué par page_operations).
     """
-    
-    today = timezone.now().date()
-    now = timezone.now()
-    demain = today + timedelta(days=1)
+    today = jour_local(now)
     fin_semaine = today + timedelta(days=(6 - today.weekday()))  # Dimanche
     fin_semaine_prochaine = fin_semaine + timedelta(days=7)
     fin_mois = today.replace(day=28) + timedelta(days=4)
     fin_mois = fin_mois - timedelta(days=fin_mois.day)  # Dernier jour du mois
     
-    # ========================================
-    # GESTION DE LA PÉRIODE (CONSERVÉ)
-    # ========================================
-    periode = request.GET.get('periode', 'this_month')
-    mois_param = request.GET.get('mois', '')
-    nav = request.GET.get('nav', '')
-    
-    if mois_param and nav:
-        try:
-            date_ref = datetime.strptime(mois_param, '%Y-%m').date()
-            if nav == 'prev':
-                date_ref = date_ref - relativedelta(months=1)
-            elif nav == 'next':
-                date_ref = date_ref + relativedelta(months=1)
-            
-            periode_start = date_ref.replace(day=1)
-            periode_end = (periode_start + relativedelta(months=1)) - timedelta(days=1)
-            periode = 'custom'
-        except:
-            periode_start = today.replace(day=1)
-            periode_end = (periode_start + relativedelta(months=1)) - timedelta(days=1)
-    elif mois_param:
-        try:
-            date_ref = datetime.strptime(mois_param, '%Y-%m').date()
-            periode_start = date_ref.replace(day=1)
-            periode_end = (periode_start + relativedelta(months=1)) - timedelta(days=1)
-            periode = 'custom'
-        except:
-            periode_start = today.replace(day=1)
-            periode_end = (periode_start + relativedelta(months=1)) - timedelta(days=1)
-    elif periode == 'this_month':
-        periode_start = today.replace(day=1)
-        periode_end = (periode_start + relativedelta(months=1)) - timedelta(days=1)
-    elif periode == 'last_month':
-        periode_start = (today.replace(day=1) - relativedelta(months=1))
-        periode_end = today.replace(day=1) - timedelta(days=1)
-    elif periode == 'last_3':
-        periode_start = (today.replace(day=1) - relativedelta(months=2))
-        periode_end = (periode_start + relativedelta(months=3)) - timedelta(days=1)
-    elif periode == 'ytd':
-        periode_start = today.replace(month=1, day=1)
-        periode_end = today
-    else:
-        periode_start = today.replace(day=1)
-        periode_end = (periode_start + relativedelta(months=1)) - timedelta(days=1)
-    
-    # ========================================
-    # RÉCUPÉRER TOUTES LES OPÉRATIONS
-    # ========================================
-    all_operations = Operation.objects.filter(
-        user=request.user
-    ).select_related('client').prefetch_related(
-        'interventions', 'echeances', 'historique', 'devis_set', 'passages'
-    )
-    
-    # --- COMPTEURS DEVIS ---
-    devis_counters = get_devis_counters(request, all_operations)
-    
-    # ========================================
-    # CALCULS FINANCIERS (CONSERVÉ)
-    # ========================================
-    operations_periode = Operation.objects.filter(
-        user=request.user,
-        statut__in=['realise', 'paye'],
-        date_realisation__gte=periode_start,
-        date_realisation__lte=periode_end
-    ).prefetch_related('echeances')
-
-    ca_encaisse = 0
-    ca_en_attente_total = 0
-    ca_retard = 0
-    ca_non_planifies = 0
-
-    for op in operations_periode:
-        montant_total = op.montant_total
-        montant_paye = op.echeances.filter(paye=True).aggregate(total=Sum('montant'))['total'] or 0
-        ca_encaisse += montant_paye
-        
-        total_planifie = op.echeances.aggregate(total=Sum('montant'))['total'] or 0
-        reste = montant_total - montant_paye
-        
-        if reste > 0:
-            ca_en_attente_total += reste
-        
-        retards = op.echeances.filter(paye=False, date_echeance__lt=today)
-        if retards.exists():
-            montant_retard = retards.aggregate(total=Sum('montant'))['total'] or 0
-            ca_retard += montant_retard
-        
-        reste_a_planifier = montant_total - total_planifie
-        if reste_a_planifier > 0:
-            ca_non_planifies += reste_a_planifier
-
-    # CA Prévisionnel 30 jours
-    date_dans_30j = today + timedelta(days=30)
-    operations_previsionnel = Operation.objects.filter(
-        user=request.user,
-        statut='planifie',
-        date_prevue__gte=today,
-        date_prevue__lte=date_dans_30j
-    )
-    ca_previsionnel_30j = sum(op.montant_total for op in operations_previsionnel if op.montant_total)
-    
-    # Variation vs période précédente
-    duree = (periode_end - periode_start).days
-    periode_prec_start = periode_start - timedelta(days=duree + 1)
-    periode_prec_end = periode_start - timedelta(days=1)
-    
-    ca_encaisse_prec = Echeance.objects.filter(
-        operation__user=request.user,
-        operation__date_realisation__gte=periode_prec_start,
-        operation__date_realisation__lte=periode_prec_end,
-        paye=True
-    ).aggregate(total=Sum('montant'))['total'] or 0
-    
-    if ca_encaisse_prec > 0:
-        ca_encaisse_var = int(((ca_encaisse - ca_encaisse_prec) / ca_encaisse_prec) * 100)
-    else:
-        ca_encaisse_var = 0 if ca_encaisse == 0 else 100
-    
-    # ========================================
-    # CALCUL DES COMPTEURS PAR CATÉGORIE
-    # ========================================
-    
-    # --- URGENCES ---
-    # 1. Paiements en retard
-    ops_paiements_retard = []
-    for op in all_operations.filter(statut='realise'):
-        retards = op.echeances.filter(paye=False, date_echeance__lt=today)
-        if retards.exists():
-            ops_paiements_retard.append(op.id)
-    
-    nb_paiements_retard = len(ops_paiements_retard)
-    
-    # 2. Devis expirés
-    ops_devis_expires = []
-    for op in all_operations.filter(avec_devis=True):
-        for devis in op.devis_set.filter(statut='envoye'):
-            if devis.est_expire:
-                ops_devis_expires.append(op.id)
-                break
-    
-    nb_devis_expire = len(ops_devis_expires)
-    
-    # 3. Interventions aujourd'hui
-    ops_aujourdhui = list(all_operations.filter(
-        Q(date_prevue__date=today) | 
-        Q(passages__date_prevue__date=today, passages__realise=False)
-    ).values_list('id', flat=True).distinct())
-    
-    nb_aujourdhui = len(ops_aujourdhui)
-    
-    # 4. Interventions demain
-    ops_demain = list(all_operations.filter(
-        Q(date_prevue__date=demain) | 
-        Q(passages__date_prevue__date=demain, passages__realise=False)
-    ).values_list('id', flat=True).distinct())
-    
-    nb_demain = len(ops_demain)
-    
-    # Total urgences (sans doublons)
-    ids_urgences = set(ops_paiements_retard + ops_devis_expires + ops_aujourdhui + ops_demain)
-    nb_urgences = len(ids_urgences)
-    
-    # --- À FAIRE ---
-    nb_a_planifier = all_operations.filter(statut='a_planifier').count()
-    
-    nb_devis_brouillon = Devis.objects.filter(
-        operation__user=request.user,
-        statut='brouillon'
-    ).values('operation').distinct().count()
-    
-    # Paiements non planifiés
-    ops_paiements_non_planifies = []
-    for op in all_operations.filter(statut='realise'):
-        total_planifie = op.echeances.aggregate(total=Sum('montant'))['total'] or 0
-        if op.montant_total and total_planifie < op.montant_total:
-            ops_paiements_non_planifies.append(op.id)
-    
-    nb_operations_sans_paiement = len(ops_paiements_non_planifies)
-    
-    # Total à faire
-    ids_a_faire = set()
-    ids_a_faire.update(all_operations.filter(statut='a_planifier').values_list('id', flat=True))
-    ids_a_faire.update(Devis.objects.filter(
-        operation__user=request.user,
-        statut='brouillon'
-    ).values_list('operation_id', flat=True))
-    ids_a_faire.update(ops_paiements_non_planifies)
-    ids_a_faire -= ids_urgences
-    nb_a_faire = len(ids_a_faire)
-    
-    # --- EN COURS ---
-    statuts_en_cours = ['en_attente_devis', 'a_planifier', 'planifie', 'en_cours', 'realise']
-    ids_en_cours = set(all_operations.filter(statut__in=statuts_en_cours).values_list('id', flat=True))
-    ids_en_cours -= ids_urgences
-    nb_en_cours = len(ids_en_cours)
-    
-    # --- À VENIR ---
-    ops_a_venir = all_operations.filter(
-        Q(statut='planifie', date_prevue__gte=now) |
-        Q(passages__date_prevue__gte=now, passages__realise=False)
-    ).distinct()
-    nb_a_venir = ops_a_venir.count()
-    
-    # --- À ENCAISSER ---
-    ops_a_encaisser_ids = []
-    for op in all_operations.filter(statut='realise'):
-        total_paye = op.echeances.filter(paye=True).aggregate(total=Sum('montant'))['total'] or 0
-        if op.montant_total and total_paye < op.montant_total:
-            ops_a_encaisser_ids.append(op.id)
-    
-    nb_a_encaisser = len(ops_a_encaisser_ids)
-    
-    # --- ARCHIVÉES ---
-    nb_archivees = all_operations.filter(statut='paye').count()
-    
-    # --- AUTRES COMPTEURS (CONSERVÉS) ---
-    nb_total = all_operations.count()
-    nb_planifie = all_operations.filter(statut='planifie').count()
-    nb_realise = all_operations.filter(statut='realise').count()
-    nb_paye = all_operations.filter(statut='paye').count()
-    
-    # Compteurs devis
-    nb_devis_genere_non_envoye = Devis.objects.filter(
-        operation__user=request.user,
-        statut='pret'
-    ).count()
-    
-    nb_sans_devis = Operation.objects.filter(
-        user=request.user,
-        avec_devis=True
-    ).annotate(nb_devis=Count('devis_set')).filter(nb_devis=0).count()
-    
-    nb_devis_en_attente = 0
-    for op in Operation.objects.filter(user=request.user, avec_devis=True):
-        for devis in op.devis_set.filter(statut='envoye', date_envoi__isnull=False):
-            if not devis.est_expire:
-                nb_devis_en_attente += 1
-    
-    # À traiter (passages en retard)
-    passages_en_retard = PassageOperation.objects.filter(
-        operation__user=request.user,
-        date_prevue__lt=now,
-        realise=False
-    ).values_list('operation_id', flat=True).distinct()
-    nb_a_traiter = len(set(passages_en_retard))
-    
-    # ========================================
-    # FILTRAGE SELON L'ONGLET SÉLECTIONNÉ
-    # ========================================
     filtre = request.GET.get('filtre', 'toutes')
     sous_filtre = request.GET.get('sous', '')
     recherche = request.GET.get('recherche', '')
-    tri = request.GET.get('tri', 'recent')  # recent, ancien, activite
     
-    # Commencer avec toutes les opérations
+    # ========================================
+    # FILTRAGE SELON L'ONGLET SÉLECTIONNÉ
+    # ========================================
+    # Opérations annotées avec leurs catégories (est_urgence, est_a_faire, ...)
+    all_operations = annoter_categories(
+        Operation.objects.filter(user=user).select_related('client'), now=now
+    )
     operations = all_operations
     
     # ========================================
@@ -704,18 +265,15 @@ def operations_list(request):
     # ========================================
     if filtre == 'urgences':
         if sous_filtre == 'retards':
-            operations = operations.filter(id__in=ops_paiements_retard)
+            operations = operations.filter(est_paiement_retard=True)
         elif sous_filtre == 'expires':
-            operations = operations.filter(id__in=ops_devis_expires)
+            operations = operations.filter(est_devis_expire=True)
         elif sous_filtre == 'aujourdhui':
-            operations = operations.filter(id__in=ops_aujourdhui)
+            operations = operations.filter(est_aujourdhui=True)
         elif sous_filtre == 'demain':
-            operations = operations.filter(id__in=ops_demain)
+            operations = operations.filter(est_demain=True)
         else:
-            operations = operations.filter(id__in=ids_urgences)
-        
-        for op in operations:
-            op.est_urgent = True
+            operations = operations.filter(est_urgence=True)
             
     elif filtre == 'devis':
         operations = filter_operations_by_devis(request, filtre, sous_filtre, all_operations)
@@ -724,55 +282,50 @@ def operations_list(request):
         if sous_filtre == 'a_planifier':
             operations = operations.filter(statut='a_planifier')
         elif sous_filtre == 'devis_brouillon':
-            ids_brouillon = Devis.objects.filter(
-                operation__user=request.user,
-                statut='brouillon'
-            ).values_list('operation_id', flat=True)
-            operations = operations.filter(id__in=ids_brouillon)
+            operations = operations.filter(a_devis_brouillon=True)
         elif sous_filtre == 'paiements_non_planifies':
-            operations = operations.filter(id__in=ops_paiements_non_planifies)
+            operations = operations.filter(est_paiement_non_planifie=True)
         else:
-            operations = operations.filter(id__in=ids_a_faire)
+            operations = operations.filter(est_a_faire=True)
             
     elif filtre == 'en_cours':
-        operations = operations.filter(id__in=ids_en_cours)
+        operations = operations.filter(est_en_cours=True)
         
     elif filtre == 'toutes':
         # Toutes les opérations, pas de filtre
         pass
         
     elif filtre == 'a_venir':
-        operations = ops_a_venir
+        operations = operations.filter(est_a_venir=True)
         
+        # ✅ Jours locaux en intervalles de dates-heures (index utilisables)
         if sous_filtre == 'semaine':
             operations = operations.filter(
-                Q(date_prevue__date__lte=fin_semaine) |
-                Q(passages__date_prevue__date__lte=fin_semaine)
+                q_jours('date_prevue', dernier=fin_semaine) |
+                q_jours('passages__date_prevue', dernier=fin_semaine)
             ).distinct()
         elif sous_filtre == 'semaine_prochaine':
+            semaine_prochaine = (fin_semaine + timedelta(days=1), fin_semaine_prochaine)
             operations = operations.filter(
-                Q(date_prevue__date__gt=fin_semaine, date_prevue__date__lte=fin_semaine_prochaine) |
-                Q(passages__date_prevue__date__gt=fin_semaine, passages__date_prevue__date__lte=fin_semaine_prochaine)
+                q_jours('date_prevue', *semaine_prochaine) |
+                q_jours('passages__date_prevue', *semaine_prochaine)
             ).distinct()
         elif sous_filtre == 'mois':
             operations = operations.filter(
-                Q(date_prevue__date__lte=fin_mois) |
-                Q(passages__date_prevue__date__lte=fin_mois)
+                q_jours('date_prevue', dernier=fin_mois) |
+                q_jours('passages__date_prevue', dernier=fin_mois)
             ).distinct()
         elif sous_filtre == 'plus_tard':
             operations = operations.filter(
-                Q(date_prevue__date__gt=fin_mois) |
-                Q(passages__date_prevue__date__gt=fin_mois)
+                q_jours('date_prevue', premier=fin_mois + timedelta(days=1)) |
+                q_jours('passages__date_prevue', premier=fin_mois + timedelta(days=1))
             ).distinct()
         
-        operations = operations.order_by('date_prevue')
-        
     elif filtre == 'a_encaisser':
-        operations = operations.filter(id__in=ops_a_encaisser_ids)
+        operations = operations.filter(est_a_encaisser=True)
         
     elif filtre == 'archivees':
         operations = operations.filter(statut='paye')
-        operations = operations.order_by('-date_paiement', '-date_modification')
     
     # ========================================
     # ANCIENS FILTRES (CONSERVÉS POUR COMPATIBILITÉ)
@@ -793,41 +346,26 @@ def operations_list(request):
         )
         
     elif filtre == 'devis_en_attente':
-        operations_en_attente_ids = []
-        for op in operations.filter(avec_devis=True):
-            devis_en_attente = op.devis_set.filter(statut='envoye', date_envoi__isnull=False)
-            for devis in devis_en_attente:
-                if devis.date_limite and devis.date_limite >= today:
-                    operations_en_attente_ids.append(op.id)
-                    break
-                elif not devis.date_limite:
-                    operations_en_attente_ids.append(op.id)
-                    break
-        operations = operations.filter(id__in=operations_en_attente_ids)
+        # ✅ Au moins un devis envoyé non expiré (ou sans date limite), en base
+        devis_en_attente = Devis.objects.filter(
+            operation=OuterRef('pk'), statut='envoye', date_envoi__isnull=False
+        ).annotate(date_limite=expr_date_limite_devis()).exclude(q_devis_expire(today))
+        operations = operations.filter(avec_devis=True).filter(Exists(devis_en_attente))
 
     elif filtre == 'expire':
-        operations = operations.filter(id__in=ops_devis_expires)
+        operations = operations.filter(est_devis_expire=True)
 
     elif filtre == 'a_traiter':
-        operations_planifiees_retard = Operation.objects.filter(
-            user=request.user, statut='planifie', date_prevue__lt=now
-        ).values_list('id', flat=True)
-        ids_a_traiter = set(passages_en_retard) | set(operations_planifiees_retard)
-        operations = operations.filter(id__in=ids_a_traiter)
+        operations = operations.filter(
+            Q(est_a_traiter=True) | Q(statut='planifie', date_prevue__lt=now)
+        )
 
     elif filtre == 'retards':
-        operations = operations.filter(id__in=ops_paiements_retard)
-        for op in operations:
-            premier_retard = op.echeances.filter(paye=False, date_echeance__lt=today).order_by('date_echeance').first()
-            if premier_retard:
-                op.premier_retard = premier_retard
-                op.jours_retard = (today - premier_retard.date_echeance).days
+        operations = operations.filter(est_paiement_retard=True)
 
     elif filtre == 'non_planifies':
-        operations = operations.filter(id__in=ops_paiements_non_planifies)
-        for op in operations:
-            total_planifie = op.echeances.aggregate(total=Sum('montant'))['total'] or 0
-            op.reste_a_planifier = op.montant_total - total_planifie
+        # reste_a_planifier : propriété calculée sur l'état financier stocké
+        operations = operations.filter(est_paiement_non_planifie=True)
 
     elif filtre in ['a_planifier', 'planifie', 'realise', 'paye']:
         operations = operations.filter(statut=filtre)
@@ -835,52 +373,53 @@ def operations_list(request):
     # ========================================
     # RECHERCHE
     # ========================================
+    # ✅ Index de recherche (client, prestation, ID, adresse, commentaires)
     if recherche:
-        operations = operations.filter(
-            Q(client__nom__icontains=recherche) |
-            Q(client__prenom__icontains=recherche) |
-            Q(client__telephone__icontains=recherche) |
-            Q(client__ville__icontains=recherche) |
-            Q(type_prestation__icontains=recherche) |
-            Q(id_operation__icontains=recherche) |
-            Q(adresse_intervention__icontains=recherche) |
-            Q(commentaires__icontains=recherche)
-        )
+        operations = rechercher_operations(operations, recherche)
     
-    # ========================================
-    # TRI DYNAMIQUE
-    # ========================================
-    if tri == 'ancien':
-        operations = operations.order_by('date_creation')
-    elif tri == 'activite':
-        operations = operations.order_by('-date_modification')
-    else:  # recent (par défaut)
-        operations = operations.order_by('-date_creation')
+    return operations
+
+
+def page_operations(operations, tri, curseur=None):
+    """
+    Une page de la liste (TAILLE_PAGE lignes après le curseur), enrichie
+    pour le template : dernier devis, dernière action, prochaine étape.
     
-    # ========================================
-    # ENRICHIR LES OPÉRATIONS
-    # ========================================
-    operations_list = list(operations)
+    Seul ce que la ligne affiche est chargé, pour les lignes de la page :
+    colonnes de CHAMPS_OPERATION_LISTE, dernier devis seulement (pas toutes
+    les versions), 50 premiers caractères de la dernière entrée d'historique.
     
-    for op in operations_list:
+    Retourne (operations, curseur_suivant).
+    """
+    derniere_version = Devis.objects.filter(
+        operation=OuterRef('operation')
+    ).order_by('-version').values('version')[:1]
+    derniers_devis = Devis.objects.filter(
+        version=Subquery(derniere_version)
+    ).only(*CHAMPS_DEVIS_LISTE)
+    
+    derniere_action = HistoriqueOperation.objects.filter(
+        operation=OuterRef('pk')
+    ).order_by('-date').values('action')[:1]
+    
+    operations = operations.only(*CHAMPS_OPERATION_LISTE).prefetch_related(
+        Prefetch('devis_set', queryset=derniers_devis, to_attr='derniers_devis')
+    ).annotate(
+        derniere_action_historique=Substr(Subquery(derniere_action), 1, 50)
+    )
+    page, curseur_suivant = paginer(operations, TRIS_OPERATIONS.get(tri, TRIS_OPERATIONS['recent']), curseur)
+    
+    for op in page:
         # Dernier devis (pour le template)
-        if op.avec_devis:
-            op.dernier_devis_obj = op.devis_set.order_by('-version').first()
-        else:
-            op.dernier_devis_obj = None
+        dernier_devis = op.derniers_devis[0] if op.derniers_devis else None
+        op.dernier_devis_obj = dernier_devis if op.avec_devis else None
         
         # Dernière action depuis l'historique
-        derniere_entree = op.historique.order_by('-date').first()
-        op.derniere_action = derniere_entree.action[:50] if derniere_entree else None
-        
-        # Reste à payer
-        total_paye = op.echeances.filter(paye=True).aggregate(total=Sum('montant'))['total'] or 0
-        op.reste_a_payer = (op.montant_total or 0) - total_paye
+        op.derniere_action = op.derniere_action_historique or None
         
         # Prochaine étape
         op.prochaine_etape = None
         if op.avec_devis:
-            dernier_devis = op.dernier_devis
             if dernier_devis:
                 if dernier_devis.statut == 'brouillon':
                     op.prochaine_etape = "Compléter le devis"
@@ -898,16 +437,145 @@ def operations_list(request):
             elif op.statut == 'realise':
                 op.prochaine_etape = "Encaisser"
         
-        # Flag urgent si pas déjà défini
-        if not hasattr(op, 'est_urgent'):
-            op.est_urgent = op.id in ids_urgences
+        op.est_urgent = op.est_urgence
+    
+    return page, curseur_suivant
+
+
+@login_required
+def operations_list(request):
+    """
+    Page Opérations avec filtres intelligents :
+    - Urgences (paiements retard, devis expirés, interventions aujourd'hui/demain)
+    - À faire (à planifier, devis brouillon, paiements non planifiés)
+    - En cours (triées par dernière activité)
+    - À venir (interventions futures)
+    - À encaisser (réalisées non payées)
+    - Archivées (payées)
+    """
+    
+    now = timezone.now()
+    today = jour_local(now)
+    
+    filtre = request.GET.get('filtre', 'toutes')
+    sous_filtre = request.GET.get('sous', '')
+    recherche = request.GET.get('recherche', '')
+    tri = request.GET.get('tri', 'recent')  # recent, ancien, activite
+    
+    # ========================================
+    # PAGE SUIVANTE (défilement) : lignes seulement, sans KPI ni compteurs
+    # ========================================
+    curseur = request.GET.get('curseur')
+    if curseur:
+        operations, curseur_suivant = page_operations(
+            filtrer_operations_liste(request, request.user, now), tri, curseur
+        )
+        html = render_to_string('operations/_lignes.html', {
+            'operations': operations,
+            'filtre_actif': filtre,
+        }, request=request)
+        return JsonResponse({'success': True, 'html': html, 'curseur': curseur_suivant})
+    
+    # ========================================
+    # GESTION DE LA PÉRIODE (CONSERVÉ)
+    # ========================================
+    periode = request.GET.get('periode', 'this_month')
+    mois_param = request.GET.get('mois', '')
+    nav = request.GET.get('nav', '')
+    
+    if mois_param and nav:
+        try:
+            date_ref = datetime.strptime(mois_param, '%Y-%m').date()
+            if nav == 'prev':
+                date_ref = date_ref - relativedelta(months=1)
+            elif nav == 'next':
+                date_ref = date_ref + relativedelta(months=1)
+            
+            periode_start = date_ref.replace(day=1)
+            periode_end = (periode_start + relativedelta(months=1)) - timedelta(days=1)
+            periode = 'custom'
+        except:
+            periode_start = today.replace(day=1)
+            periode_end = (periode_start + relativedelta(months=1)) - timedelta(days=1)
+    elif mois_param:
+        try:
+            date_ref = datetime.strptime(mois_param, '%Y-%m').date()
+            periode_start = date_ref.replace(day=1)
+            periode_end = (periode_start + relativedelta(months=1)) - timedelta(days=1)
+            periode = 'custom'
+        except:
+            periode_start = today.replace(day=1)
+            periode_end = (periode_start + relativedelta(months=1)) - timedelta(days=1)
+    elif periode == 'this_month':
+        periode_start = today.replace(day=1)
+        periode_end = (periode_start + relativedelta(months=1)) - timedelta(days=1)
+    elif periode == 'last_month':
+        periode_start = (today.replace(day=1) - relativedelta(months=1))
+        periode_end = today.replace(day=1) - timedelta(days=1)
+    elif periode == 'last_3':
+        periode_start = (today.replace(day=1) - relativedelta(months=2))
+        periode_end = (periode_start + relativedelta(months=3)) - timedelta(days=1)
+    elif periode == 'ytd':
+        periode_start = today.replace(month=1, day=1)
+        periode_end = today
+    else:
+        periode_start = today.replace(day=1)
+        periode_end = (periode_start + relativedelta(months=1)) - timedelta(days=1)
+    
+    # ========================================
+    # RÉCUPÉRER TOUTES LES OPÉRATIONS
+    # ========================================
+    all_operations = Operation.objects.filter(user=request.user).select_related('client')
+    
+    # --- COMPTEURS DEVIS ---
+    devis_counters = get_devis_counters(request, all_operations)
+    
+    # ========================================
+    # CALCULS FINANCIERS
+    # ========================================
+    # ✅ Agrégats SQL sur l'état financier stocké des opérations
+    kpi = calculer_kpi_financiers(request.user, periode_start, periode_end, today=today)
+    ca_encaisse = kpi['ca_encaisse']
+    ca_en_attente_total = kpi['ca_en_attente_total']
+    ca_retard = kpi['ca_retard']
+    ca_non_planifies = kpi['ca_non_planifies']
+    ca_previsionnel_30j = kpi['ca_previsionnel_30j']
+    
+    # Variation vs période précédente
+    duree = (periode_end - periode_start).days
+    periode_prec_start = periode_start - timedelta(days=duree + 1)
+    periode_prec_end = periode_start - timedelta(days=1)
+    
+    ca_encaisse_prec = Echeance.objects.filter(
+        q_jours('operation__date_realisation', periode_prec_start, periode_prec_end),
+        operation__user=request.user,
+        paye=True
+    ).aggregate(total=Sum('montant'))['total'] or 0
+    
+    if ca_encaisse_prec > 0:
+        ca_encaisse_var = int(((ca_encaisse - ca_encaisse_prec) / ca_encaisse_prec) * 100)
+    else:
+        ca_encaisse_var = 0 if ca_encaisse == 0 else 100
+    
+    # ========================================
+    # CALCUL DES COMPTEURS PAR CATÉGORIE
+    # ========================================
+    # ✅ Classement fait en base : nombre de requêtes fixe quel que soit le volume
+    compteurs = calculer_compteurs_operations(request.user, now=now)
+    
+    # ========================================
+    # PREMIÈRE PAGE (les suivantes sont chargées au défilement)
+    # ========================================
+    operations = filtrer_operations_liste(request, request.user, now)
+    operations_list, curseur_suivant = page_operations(operations, tri)
     
     # ========================================
     # CONTEXTE
     # ========================================
     context = {
         'operations': operations_list,
-        'total_operations': len(operations_list),
+        'total_operations': operations.count(),
+        'curseur_suivant': curseur_suivant,
         'filtre_actif': filtre,
         'sous_filtre': sous_filtre,
         'recherche': recherche,
@@ -927,33 +595,33 @@ def operations_list(request):
         'ca_previsionnel_30j': ca_previsionnel_30j,
         
         # Compteurs onglets principaux (NOUVEAU)
-        'nb_total': nb_total,
-        'nb_urgences': nb_urgences,
-        'nb_a_faire': nb_a_faire,
-        'nb_en_cours': nb_en_cours,
-        'nb_a_venir': nb_a_venir,
-        'nb_a_encaisser': nb_a_encaisser,
-        'nb_archivees': nb_archivees,
+        'nb_total': compteurs['nb_total'],
+        'nb_urgences': compteurs['nb_urgences'],
+        'nb_a_faire': compteurs['nb_a_faire'],
+        'nb_en_cours': compteurs['nb_en_cours'],
+        'nb_a_venir': compteurs['nb_a_venir'],
+        'nb_a_encaisser': compteurs['nb_a_encaisser'],
+        'nb_archivees': compteurs['nb_archivees'],
         
         # Compteurs sous-filtres Urgences
-        'nb_paiements_retard': nb_paiements_retard,
-        'nb_devis_expire': nb_devis_expire,
-        'nb_aujourdhui': nb_aujourdhui,
-        'nb_demain': nb_demain,
+        'nb_paiements_retard': compteurs['nb_paiements_retard'],
+        'nb_devis_expire': compteurs['nb_devis_expire'],
+        'nb_aujourdhui': compteurs['nb_aujourdhui'],
+        'nb_demain': compteurs['nb_demain'],
         
         # Compteurs sous-filtres À faire
-        'nb_a_planifier': nb_a_planifier,
-        'nb_devis_brouillon': nb_devis_brouillon,
-        'nb_operations_sans_paiement': nb_operations_sans_paiement,
+        'nb_a_planifier': compteurs['nb_a_planifier'],
+        'nb_devis_brouillon': compteurs['nb_devis_brouillon'],
+        'nb_operations_sans_paiement': compteurs['nb_operations_sans_paiement'],
         
         # Compteurs anciens (conservés pour compatibilité)
-        'nb_planifie': nb_planifie,
-        'nb_a_traiter': nb_a_traiter,
-        'nb_realise': nb_realise,
-        'nb_paye': nb_paye,
-        'nb_devis_genere_non_envoye': nb_devis_genere_non_envoye,
-        'nb_devis_en_attente': nb_devis_en_attente,
-        'nb_sans_devis': nb_sans_devis,
+        'nb_planifie': compteurs['nb_planifie'],
+        'nb_a_traiter': compteurs['nb_a_traiter'],
+        'nb_realise': compteurs['nb_realise'],
+        'nb_paye': compteurs['nb_paye'],
+        'nb_devis_genere_non_envoye': compteurs['nb_devis_genere_non_envoye'],
+        'nb_devis_en_attente': compteurs['nb_devis_en_attente'],
+        'nb_sans_devis': compteurs['nb_sans_devis'],
         
         'nb_devis_total': devis_counters['nb_devis_total'],
         'nb_devis_brouillon': devis_counters['nb_devis_brouillon'],
@@ -972,13 +640,53 @@ def operations_list(request):
 # ========================================
 # ... Gardez toutes vos autres vues existantes
 # (operation_detail, operation_create, etc.)
+# Nombre d'entrées d'historique affichées sur la fiche opération
+HISTORIQUE_DETAIL = 10
+
+
+def prefetch_detail_operation():
+    """
+    Plan de préchargement de la fiche opération, chaque relation dans
+    l'ordre d'affichage : devis (par version) et leurs lignes,
+    interventions, échéances, passages, 10 dernières entrées d'historique
+    (operation.historique_recent).
+    """
+    return [
+        Prefetch(
+            'devis_set',
+            queryset=Devis.objects.order_by('version').prefetch_related(
+                Prefetch('lignes', queryset=LigneDevis.objects.order_by('ordre'))
+            )
+        ),
+        Prefetch('interventions', queryset=Intervention.objects.order_by('ordre')),
+        Prefetch('echeances', queryset=Echeance.objects.order_by('ordre')),
+        Prefetch('passages', queryset=PassageOperation.objects.order_by('date_prevue', 'created_at')),
+        Prefetch(
+            'historique',
+            queryset=HistoriqueOperation.objects.order_by('-date')[:HISTORIQUE_DETAIL],
+            to_attr='historique_recent'
+        ),
+    ]
+
+
 @login_required
 def operation_detail(request, operation_id):
     """Fiche détaillée d'une opération avec gestion complète"""
-    operation = get_object_or_404(Operation, id=operation_id, user=request.user)
+    operation = get_object_or_404(Operation.objects.select_related('client'), id=operation_id, user=request.user)
     
     if request.method == 'POST':
         action = request.POST.get('action')
+        
+        # ✅ Actions courantes (core/actions_operation.py), aussi disponibles
+        # en JSON sans rechargement de la fiche : ajax_action_operation
+        if action in ACTIONS_OPERATION:
+            try:
+                resultat = ACTIONS_OPERATION[action](operation, request.user, request.POST)
+                getattr(messages, resultat['niveau'])(request, resultat['message'])
+            except ActionOperationError as e:
+                messages.error(request, e.message)
+            return redirect('operation_detail', operation_id=operation.id)
+        
     # ========================================
         # ACTION : CRÉER UN NOUVEAU DEVIS
         # ========================================
@@ -1005,6 +713,24 @@ def operation_detail(request, operation_id):
             
             return redirect('operation_detail', operation_id=operation.id)
         
+        # ========================================
+        # ACTION : NOUVELLE VERSION À PARTIR D'UN DEVIS EXISTANT
+        # ========================================
+        elif action == 'nouvelle_version_devis':
+            try:
+                source, nouveau_devis, nb_lignes = nouvelle_version(
+                    operation, request.user, request.POST.get('devis_id')
+                )
+                messages.success(
+                    request,
+                    f"✅ Nouveau devis {nouveau_devis.numero_devis} créé à partir de {source.numero_devis} "
+                    f"({nb_lignes} ligne{'s' if nb_lignes > 1 else ''} reprise{'s' if nb_lignes > 1 else ''})"
+                )
+            except LignesDevisError as e:
+                messages.error(request, f"❌ {e.message}")
+            
+            return redirect('operation_detail', operation_id=operation.id)
+        
         # ========================================
         # ACTION : AJOUTER UNE LIGNE À UN DEVIS
         # ========================================
@@ -1070,7 +796,7 @@ def operation_detail(request, operation_id):
             ligne_id = request.POST.get('ligne_id')
             
             try:
-                ligne = LigneDevis.objects.get(id=ligne_id, devis__operation=operation)
+                ligne = LigneDevis.objects.select_related('devis').get(id=ligne_id, devis__operation=operation)
                 devis = ligne.devis
                 
                 # Vérifier que le devis n'est pas verrouillé
@@ -1225,86 +951,6 @@ def operation_detail(request, operation_id):
             
             return redirect('operation_detail', operation_id=operation.id)
         
-        # ========================================
-        # ACTION : ACCEPTER UN DEVIS
-        # ========================================
-        elif action == 'accepter_devis':
-            devis_id = request.POST.get('devis_id')
-            
-            try:
-                devis = Devis.objects.get(id=devis_id, operation=operation)
-                
-                # Date de réponse = aujourd'hui
-                devis.date_reponse = timezone.now().date()
-                devis.statut = 'accepte'
-                devis.save()
-                
-                # Changer le statut de l'opération si besoin
-                if operation.statut == 'en_attente_devis':
-                    # ✅ Vérifier si un passage est déjà planifié
-                    passage_planifie = operation.passages.filter(
-                        date_prevue__isnull=False,
-                        realise=False
-                    ).exists()
-                    
-                    if passage_planifie:
-                        # Si déjà planifié, passer en statut "planifie"
-                        operation.statut = 'planifie'
-                    else:
-                        # Sinon, à planifier
-                        operation.statut = 'a_planifier'
-                    
-                    operation.save()
-                
-                # Calculer délai de réponse
-                if devis.date_envoi and devis.date_reponse:
-                    delai = (devis.date_reponse - devis.date_envoi).days
-                    delai_texte = f" - Délai : {delai} jour{'s' if delai > 1 else ''}"
-                else:
-                    delai_texte = ""
-                
-                # Historique
-                HistoriqueOperation.objects.create(
-                    operation=operation,
-                    action=f"✅ Devis {devis.numero_devis} accepté par le client{delai_texte} - Montant : {devis.total_ttc}€ TTC",
-                    utilisateur=request.user
-                )
-                
-                messages.success(request, f"✅ Devis {devis.numero_devis} accepté le {devis.date_reponse.strftime('%d/%m/%Y')} !")
-                
-            except Devis.DoesNotExist:
-                messages.error(request, "❌ Devis introuvable")
-            
-            return redirect('operation_detail', operation_id=operation.id)
-        
-        # ========================================
-        # ACTION : REFUSER UN DEVIS
-        # ========================================
-        elif action == 'refuser_devis':
-            devis_id = request.POST.get('devis_id')
-            
-            try:
-                devis = Devis.objects.get(id=devis_id, operation=operation)
-                
-                # Date de réponse = aujourd'hui
-                devis.date_reponse = timezone.now().date()
-                devis.statut = 'refuse'
-                devis.save()
-                
-                # Historique
-                HistoriqueOperation.objects.create(
-                    operation=operation,
-                    action=f"❌ Devis {devis.numero_devis} refusé par le client - Montant : {devis.total_ttc}€ TTC",
-                    utilisateur=request.user
-                )
-                
-                messages.warning(request, f"❌ Devis {devis.numero_devis} marqué comme refusé.")
-                
-            except Devis.DoesNotExist:
-                messages.error(request, "❌ Devis introuvable")
-            
-            return redirect('operation_detail', operation_id=operation.id)
-        
         # ========================================
         # ACTION : SUPPRIMER UN DEVIS (brouillon uniquement)
         # ========================================
@@ -1367,65 +1013,32 @@ def operation_detail(request, operation_id):
                         numero=dernier_numero + 1,  # ← Auto-incrémenté
                         montant=montant,
                         date_echeance=date_echeance,
-                        ordre=dernier_ordre + 1
-                    )
-
-                    # ✅ AJOUTEZ CES LIGNES : Enregistrer automatiquement le mode échelonné
-                    if not operation.mode_paiement:
-                        operation.mode_paiement = 'echelonne'
-                        operation.save()
-                    
-                    HistoriqueOperation.objects.create(
-                        operation=operation,
-                        action=f"Échéance ajoutée : {montant}€ pour le {date_echeance}",
-                        utilisateur=request.user
-                    )
-                    
-                    messages.success(request, "Échéance ajoutée")
-                except (ValueError, TypeError):
-                    messages.error(request, "Données invalides")
-            
-            return redirect('operation_detail', operation_id=operation.id)
-        
-        elif action == 'delete_echeance':
-            echeance_id = request.POST.get('echeance_id')
-            try:
-                echeance = Echeance.objects.get(id=echeance_id, operation=operation)
-                echeance.delete()
-                messages.success(request, "Échéance supprimée")
-            except Echeance.DoesNotExist:
-                messages.error(request, "Échéance introuvable")
-            
-            return redirect('operation_detail', operation_id=operation.id)
-        
-        elif action == 'marquer_paye_echeance':
-            echeance_id = request.POST.get('echeance_id')
-            try:
-                echeance = Echeance.objects.get(id=echeance_id, operation=operation)
-                echeance.paye = True
-                echeance.save()
-                
-                # Vérifier si toutes les échéances sont payées
-                toutes_payees = not operation.echeances.filter(paye=False).exists()
-                
-                if toutes_payees:
-                    operation.statut = 'paye'
-                    operation.save()
-                    
-                    HistoriqueOperation.objects.create(
-                        operation=operation,
-                        action=f"Échéance {echeance.numero} marquée comme payée - Toutes les échéances sont payées",
-                        utilisateur=request.user
+                        ordre=dernier_ordre + 1
                     )
-                    messages.success(request, "Échéance marquée comme payée. Toutes les échéances sont réglées !")
-                else:
+
+                    # ✅ AJOUTEZ CES LIGNES : Enregistrer automatiquement le mode échelonné
+                    if not operation.mode_paiement:
+                        operation.mode_paiement = 'echelonne'
+                        operation.save()
+                    
                     HistoriqueOperation.objects.create(
                         operation=operation,
-                        action=f"Échéance {echeance.numero} marquée comme payée",
+                        action=f"Échéance ajoutée : {montant}€ pour le {date_echeance}",
                         utilisateur=request.user
                     )
-                    messages.success(request, "Échéance marquée comme payée")
                     
+                    messages.success(request, "Échéance ajoutée")
+                except (ValueError, TypeError):
+                    messages.error(request, "Données invalides")
+            
+            return redirect('operation_detail', operation_id=operation.id)
+        
+        elif action == 'delete_echeance':
+            echeance_id = request.POST.get('echeance_id')
+            try:
+                echeance = Echeance.objects.get(id=echeance_id, operation=operation)
+                echeance.delete()
+                messages.success(request, "Échéance supprimée")
             except Echeance.DoesNotExist:
                 messages.error(request, "Échéance introuvable")
             
@@ -1467,51 +1080,6 @@ def operation_detail(request, operation_id):
             
             return redirect('operation_detail', operation_id=operation.id)
         
-        # GESTION DU CHANGEMENT DE STATUT
-        elif action == 'change_status':
-            nouveau_statut = request.POST.get('statut')
-            date_prevue_str = request.POST.get('date_prevue', '')
-            date_realisation_str = request.POST.get('date_realisation', '')
-            date_paiement_str = request.POST.get('date_paiement', '')
-            
-            if nouveau_statut in dict(Operation.STATUTS):
-                ancien_statut = operation.get_statut_display()
-                operation.statut = nouveau_statut
-                
-                
-                
-                if nouveau_statut == 'planifie' and date_prevue_str:
-                    try:
-                        operation.date_prevue = datetime.fromisoformat(date_prevue_str.replace('T', ' '))
-                    except ValueError:
-                        pass
-                elif nouveau_statut == 'realise' and date_realisation_str:
-                    try:
-                        operation.date_realisation = datetime.fromisoformat(date_realisation_str.replace('T', ' '))
-                    except ValueError:
-                        pass
-                elif nouveau_statut == 'paye':
-                    if date_realisation_str:
-                        try:
-                            operation.date_realisation = datetime.fromisoformat(date_realisation_str.replace('T', ' '))
-                        except ValueError:
-                            pass
-                    if date_paiement_str:
-                        try:
-                            operation.date_paiement = datetime.fromisoformat(date_paiement_str.replace('T', ' '))
-                        except ValueError:
-                            pass
-                        
-                operation.save()
-                
-                HistoriqueOperation.objects.create(
-                    operation=operation,
-                    action=f"Statut changé : {ancien_statut} → {operation.get_statut_display()}",
-                    utilisateur=request.user
-                )
-                
-                messages.success(request, f"Statut mis à jour : {operation.get_statut_display()}")
-                return redirect('operation_detail', operation_id=operation.id)
     # ========================================
         # ACTION : AJOUTER UNE INTERVENTION (pour opérations SANS devis)
         # ========================================
@@ -1567,22 +1135,6 @@ def operation_detail(request, operation_id):
             
             return redirect('operation_detail', operation_id=operation.id)
         
-        # GESTION DES COMMENTAIRES
-        elif action == 'update_commentaires':
-            commentaires = request.POST.get('commentaires', '').strip()
-            
-            operation.commentaires = commentaires
-            operation.save()
-            
-            HistoriqueOperation.objects.create(
-                operation=operation,
-                action="Commentaires mis à jour",
-                utilisateur=request.user
-            )
-            
-            messages.success(request, "Commentaires enregistrés avec succès")
-            return redirect('operation_detail', operation_id=operation.id)
-            
     # ========================================
         # ACTION : SUPPRIMER UNE INTERVENTION (pour opérations SANS devis)
         # ========================================
@@ -1720,279 +1272,17 @@ def operation_detail(request, operation_id):
         # GESTION DES PAIEMENTS (SIMPLIFIÉ)
         # ========================================
 
-        elif action == 'add_paiement':
-            montant_str = request.POST.get('montant', '')
-            date_paiement_str = request.POST.get('date_paiement', '')
-            paye_str = request.POST.get('paye', 'false')
-            generer_facture_auto = request.POST.get('generer_facture_auto') == 'true'
-            
-            if montant_str and date_paiement_str:
-                try:
-                    montant = Decimal(montant_str)
-                    date_paiement = datetime.strptime(date_paiement_str, '%Y-%m-%d').date()
-                    paye = (paye_str == 'true')
-                    
-                    # ✅ VÉRIFICATION : Calculer le total avec ce nouveau paiement
-                    total_actuel_tout = operation.echeances.aggregate(
-                        total=Sum('montant')
-                    )['total'] or 0
-                    
-                    nouveau_total = total_actuel_tout + montant
-                    
-                    if nouveau_total > operation.montant_total:
-                        depassement = nouveau_total - operation.montant_total
-                        messages.error(
-                            request, 
-                            f"❌ Dépassement de {depassement:.2f}€ ! "
-                            f"Total avec ce paiement : {nouveau_total:.2f}€ / Montant opération : {operation.montant_total:.2f}€"
-                        )
-                        return redirect('operation_detail', operation_id=operation.id)
-                    
-                    # Auto-générer le numéro
-                    dernier_numero = operation.echeances.aggregate(
-                        max_numero=Max('numero')
-                    )['max_numero'] or 0
-                    
-                    dernier_ordre = operation.echeances.aggregate(
-                        max_ordre=Max('ordre')
-                    )['max_ordre'] or 0
-                    
-                    # Créer l'échéance
-                    echeance = Echeance.objects.create(
-                        operation=operation,
-                        numero=dernier_numero + 1,
-                        montant=montant,
-                        date_echeance=date_paiement,
-                        paye=paye,
-                        ordre=dernier_ordre + 1
-                    )
-                    
-                    # Historique
-                    statut_txt = "payé" if paye else "prévu"
-                    HistoriqueOperation.objects.create(
-                        operation=operation,
-                        action=f"💰 Paiement {statut_txt} : {montant}€ le {date_paiement.strftime('%d/%m/%Y')}",
-                        utilisateur=request.user
-                    )
-                    
-                    # ════════════════════════════════════════════════════════════
-                    # ✅ NOUVEAU : GÉNÉRATION AUTOMATIQUE DE FACTURE SI PAYÉ
-                    # ════════════════════════════════════════════════════════════
-                    facture_generee = False
-                    
-                    if paye and generer_facture_auto:
-                        # Générer automatiquement la facture
-                        annee_courante = timezone.now().year
-                        prefix = f'FACTURE-{annee_courante}-U{request.user.id}-'
-                        
-                        dernieres_factures = Echeance.objects.filter(
-                            operation__user=request.user,
-                            facture_generee=True,
-                            numero_facture__startswith=prefix
-                        ).values_list('numero_facture', flat=True)
-                        
-                        max_numero_facture = 0
-                        for facture in dernieres_factures:
-                            match = re.search(r'-(\d+)$', facture)
-                            if match:
-                                numero = int(match.group(1))
-                                if numero > max_numero_facture:
-                                    max_numero_facture = numero
-                        
-                        nouveau_numero_facture = f'{prefix}{max_numero_facture + 1:05d}'
-                        
-                        # Déterminer le type de facture
-                        total_echeances = operation.echeances.count()
-                        echeances_payees_count = operation.echeances.filter(paye=True).count()
-                        echeances_payees_non_facturees = operation.echeances.filter(
-                            paye=True,
-                            facture_generee=False
-                        ).count()
-                        total_planifie = operation.echeances.aggregate(
-                            total=Sum('montant')
-                        )['total'] or Decimal('0')
-                        reste_non_enregistre = operation.montant_total - total_planifie
-                        
-                        if echeances_payees_count == 1 and total_echeances == 1:
-                            facture_type = 'globale'
-                        elif echeances_payees_non_facturees == 1 and reste_non_enregistre <= 0:
-                            facture_type = 'solde'
-                        else:
-                            facture_type = 'acompte'
-                        
-                        # Enregistrer la facture
-                        echeance.facture_generee = True
-                        echeance.numero_facture = nouveau_numero_facture
-                        echeance.facture_date_emission = timezone.now().date()
-                        echeance.facture_type = facture_type
-                        echeance.save()
-                        
-                        facture_generee = True
-                        
-                        type_label = {
-                            'globale': 'globale',
-                            'acompte': "d'acompte",
-                            'solde': 'de solde'
-                        }.get(facture_type, '')
-                        
-                        HistoriqueOperation.objects.create(
-                            operation=operation,
-                            action=f"📄 Facture {type_label} {nouveau_numero_facture} générée automatiquement",
-                            utilisateur=request.user
-                        )
-                    
-                    # ════════════════════════════════════════════════════════════
-                    # FIN GÉNÉRATION AUTOMATIQUE
-                    # ════════════════════════════════════════════════════════════
-                    
-                    # Vérifier si tout est payé
-                    total_paye = operation.echeances.filter(paye=True).aggregate(
-                        total=Sum('montant')
-                    )['total'] or 0
-                    
-                    if total_paye >= operation.montant_total:
-                        operation.statut = 'paye'
-                        operation.save()
-                        
-                        if facture_generee:
-                            messages.success(
-                                request, 
-                                f"✅ Paiement de {montant}€ enregistré + Facture {echeance.numero_facture} générée - Opération soldée ! 🎉"
-                            )
-                        else:
-                            messages.success(request, f"✅ Paiement enregistré - Opération soldée ! 🎉")
-                    else:
-                        if facture_generee:
-                            messages.success(
-                                request, 
-                                f"✅ Paiement de {montant}€ enregistré + Facture {echeance.numero_facture} générée"
-                            )
-                        else:
-                            messages.success(request, f"✅ Paiement de {montant}€ enregistré")
-                    
-                except (ValueError, TypeError) as e:
-                    messages.error(request, f"Données invalides : {str(e)}")
-            
-            return redirect('operation_detail', operation_id=operation.id)
-
-        # MARQUER UN PAIEMENT COMME PAYÉ
-        elif action == 'marquer_paye':
-            echeance_id = request.POST.get('echeance_id')
-            try:
-                echeance = Echeance.objects.get(id=echeance_id, operation=operation)
-                echeance.paye = True
-                echeance.save()
-                
-                # ════════════════════════════════════════════════════════════
-                # ✅ NOUVEAU : GÉNÉRATION AUTOMATIQUE DE FACTURE
-                # ════════════════════════════════════════════════════════════
-                if not echeance.facture_generee:
-                    annee_courante = timezone.now().year
-                    prefix = f'FACTURE-{annee_courante}-U{request.user.id}-'
-                    
-                    dernieres_factures = Echeance.objects.filter(
-                        operation__user=request.user,
-                        facture_generee=True,
-                        numero_facture__startswith=prefix
-                    ).values_list('numero_facture', flat=True)
-                    
-                    max_numero_facture = 0
-                    for facture in dernieres_factures:
-                        match = re.search(r'-(\d+)$', facture)
-                        if match:
-                            numero = int(match.group(1))
-                            if numero > max_numero_facture:
-                                max_numero_facture = numero
-                    
-                    nouveau_numero_facture = f'{prefix}{max_numero_facture + 1:05d}'
-                    
-                    # Déterminer le type de facture
-                    total_echeances = operation.echeances.count()
-                    echeances_payees_count = operation.echeances.filter(paye=True).count()
-                    echeances_payees_non_facturees = operation.echeances.filter(
-                        paye=True,
-                        facture_generee=False
-                    ).count()
-                    total_planifie = operation.echeances.aggregate(
-                        total=Sum('montant')
-                    )['total'] or Decimal('0')
-                    reste_non_enregistre = operation.montant_total - total_planifie
-                    
-                    if echeances_payees_count == 1 and total_echeances == 1:
-                        facture_type = 'globale'
-                    elif echeances_payees_non_facturees == 1 and reste_non_enregistre <= 0:
-                        facture_type = 'solde'
-                    else:
-                        facture_type = 'acompte'
-                    
-                    echeance.facture_generee = True
-                    echeance.numero_facture = nouveau_numero_facture
-                    echeance.facture_date_emission = timezone.now().date()
-                    echeance.facture_type = facture_type
-                    echeance.save()
-                    
-                    type_label = {
-                        'globale': 'globale',
-                        'acompte': "d'acompte",
-                        'solde': 'de solde'
-                    }.get(facture_type, '')
-                    
-                    HistoriqueOperation.objects.create(
-                        operation=operation,
-                        action=f"📄 Facture {type_label} {nouveau_numero_facture} générée automatiquement",
-                        utilisateur=request.user
-                    )
-                # ════════════════════════════════════════════════════════════
-                
-                # Vérifier si tout est payé
-                total_paye = operation.echeances.filter(paye=True).aggregate(
-                    total=Sum('montant')
-                )['total'] or 0
-                
-                if total_paye >= operation.montant_total:
-                    operation.statut = 'paye'
-                    operation.save()
-                    
-                    HistoriqueOperation.objects.create(
-                        operation=operation,
-                        action=f"✅ Paiement de {echeance.montant}€ confirmé + Facture {echeance.numero_facture} - Opération soldée ! 🎉",
-                        utilisateur=request.user
-                    )
-                    messages.success(
-                        request, 
-                        f"🎉 Paiement confirmé + Facture {echeance.numero_facture} générée - Opération soldée !"
-                    )
-                else:
-                    HistoriqueOperation.objects.create(
-                        operation=operation,
-                        action=f"✅ Paiement de {echeance.montant}€ confirmé + Facture {echeance.numero_facture}",
-                        utilisateur=request.user
-                    )
-                    messages.success(
-                        request, 
-                        f"✅ Paiement de {echeance.montant}€ confirmé + Facture {echeance.numero_facture} générée"
-                    )
-                    
-            except Echeance.DoesNotExist:
-                messages.error(request, "Paiement introuvable")
-            
-            return redirect('operation_detail', operation_id=operation.id)
-
         # SUPPRIMER UN PAIEMENT
         elif action == 'delete_paiement':
             echeance_id = request.POST.get('echeance_id')
             try:
-                echeance = Echeance.objects.get(id=echeance_id, operation=operation)
+                echeance = operation.echeances.get(id=echeance_id)
                 montant = echeance.montant
                 echeance.delete()
                 
-                # Si c'était payé, re-vérifier le statut
+                # Si c'était payé, re-vérifier le statut (état financier recalculé par delete())
                 if operation.statut == 'paye':
-                    total_paye = operation.echeances.filter(paye=True).aggregate(
-                        total=Sum('montant')
-                    )['total'] or 0
-                    
-                    if total_paye < operation.montant_total:
+                    if operation.montant_encaisse < operation.montant_total:
                         operation.statut = 'realise'
                         operation.save()
                 
@@ -2027,101 +1317,16 @@ def operation_detail(request, operation_id):
             echeance_id = request.POST.get('echeance_id')
             
             try:
-                echeance = Echeance.objects.get(id=echeance_id, operation=operation)
-                
-                if not echeance.paye:
-                    messages.error(request, "❌ Le paiement doit être marqué comme payé avant de générer la facture")
-                    return redirect('operation_detail', operation_id=operation.id)
-                
-                if echeance.facture_generee:
-                    messages.warning(request, f"⚠️ Facture déjà générée : {echeance.numero_facture}")
-                    return redirect('operation_detail', operation_id=operation.id)
-                
-                # ✅ GÉNÉRATION DU NUMÉRO DE FACTURE
-                annee_courante = timezone.now().year
-                prefix = f'FACTURE-{annee_courante}-U{request.user.id}-'
-                
-                dernieres_factures = Echeance.objects.filter(
-                    operation__user=request.user,
-                    facture_generee=True,
-                    numero_facture__startswith=prefix
-                ).values_list('numero_facture', flat=True)
-                
-                max_numero = 0
-                for facture in dernieres_factures:
-                    match = re.search(r'-(\d+)$', facture)
-                    if match:
-                        numero = int(match.group(1))
-                        if numero > max_numero:
-                            max_numero = numero
-                
-                nouveau_numero = max_numero + 1
-                nouveau_numero_facture = f'{prefix}{nouveau_numero:05d}'
-                
-                # ═══════════════════════════════════════════════════════════
-                # ✅ LOGIQUE AMÉLIORÉE V2 : DÉTERMINER LE TYPE DE FACTURE
-                # ═══════════════════════════════════════════════════════════
-
-                # 1️⃣ Compter les échéances
-                total_echeances = operation.echeances.count()
-                echeances_payees_count = operation.echeances.filter(paye=True).count()
-
-                # 2️⃣ Compter combien de paiements PAYÉS n'ont PAS encore de facture
-                echeances_payees_non_facturees = operation.echeances.filter(
-                    paye=True,
-                    facture_generee=False
-                ).count()
-
-                # 3️⃣ Calculer le montant total des échéances (payées + prévues)
-                total_planifie = operation.echeances.aggregate(
-                    total=Sum('montant')
-                )['total'] or Decimal('0')
-
-                # 4️⃣ Vérifier s'il reste des paiements NON ENREGISTRÉS
-                reste_non_enregistre = operation.montant_total - total_planifie
-
-                # 5️⃣ LOGIQUE DE DÉTERMINATION DU TYPE
-                if echeances_payees_count == 1 and total_echeances == 1:
-                    # ✅ CAS 1 : Un seul paiement unique
-                    facture_type = 'globale'
-
-                elif echeances_payees_non_facturees == 1 and reste_non_enregistre <= 0:
-                    # ✅ CAS 2 : C'est le DERNIER paiement à facturer
-                    # ET il n'y a plus rien à enregistrer
-                    facture_type = 'solde'
-
-                else:
-                    # ✅ CAS 3 : Paiement intermédiaire
-                    facture_type = 'acompte'
-                
-                # ═══════════════════════════════════════════════════════════
-                # FIN LOGIQUE AMÉLIORÉE
-                # ═══════════════════════════════════════════════════════════
-                
-                # ✅ ENREGISTRER LA FACTURE
-                echeance.facture_generee = True
-                echeance.numero_facture = nouveau_numero_facture
-                echeance.facture_date_emission = timezone.now().date()
-                echeance.facture_type = facture_type
-                echeance.save()
-                
-                # Historique avec détails du type
-                type_label = {
-                    'globale': 'globale',
-                    'acompte': "d'acompte",
-                    'solde': 'de solde'
-                }.get(facture_type, '')
+                echeance = operation.echeances.get(id=echeance_id)
+                emettre_facture(echeance, request.user, operation=operation)
                 
-                HistoriqueOperation.objects.create(
-                    operation=operation,
-                    action=f"📄 Facture {type_label} {nouveau_numero_facture} générée - Montant : {echeance.montant}€",
-                    utilisateur=request.user
-                )
-                
-                messages.success(request, f"✅ Facture {type_label} {nouveau_numero_facture} générée avec succès !")
+                type_label = LIBELLES_TYPE_FACTURE[echeance.facture_type]
+                messages.success(request, f"✅ Facture {type_label} {echeance.numero_facture} générée avec succès !")
                 
             except Echeance.DoesNotExist:
                 messages.error(request, "❌ Paiement introuvable")
+            except FacturationError as e:
+                messages.error(request, f"❌ {e}")
             except Exception as e:
                 messages.error(request, f"❌ Erreur : {str(e)}")
             
@@ -2132,42 +1337,25 @@ def operation_detail(request, operation_id):
     # GET - Récupérer les données
     # ========================================
 
-    # NOUVEAU : Récupérer tous les devis de l'opération (du plus ancien au plus récent)
-    devis_list = operation.devis_set.all().order_by('version')
+    # ✅ Tout ce que la fiche affiche, en une requête par relation (voir
+    # prefetch_detail_operation) : le template et les propriétés du
+    # modèle lisent ensuite les objets préchargés
+    prefetch_related_objects([operation], *prefetch_detail_operation())
 
-    # Pour chaque devis, enrichir avec ses lignes
+    # Devis du plus ancien au plus récent, avec leurs lignes
+    devis_list = operation.devis_set.all()
     for devis in devis_list:
-        devis.lignes_list = devis.lignes.all().order_by('ordre')
-        
+        devis.lignes_list = devis.lignes.all()
 
     # Interventions (pour opérations SANS devis uniquement)
-    interventions = operation.interventions.all().order_by('ordre')
+    interventions = operation.interventions.all()
 
     # Échéances (inchangé)
-    echeances = operation.echeances.all().order_by('ordre')
-    historique = operation.historique.all().order_by('-date')[:10]
-
-    # Calculs financiers (inchangé)
-    total_echeances_payees = echeances.filter(paye=True).aggregate(
-        total=Sum('montant')
-    )['total'] or 0
-
-    total_echeances_prevus = echeances.filter(paye=False).aggregate(
-        total=Sum('montant')
-    )['total'] or 0
+    echeances = operation.echeances.all()
+    historique = operation.historique_recent
 
-    total_echeances_tout = echeances.aggregate(
-        total=Sum('montant')
-    )['total'] or 0
-
-    reste_a_payer = operation.montant_total - total_echeances_payees
-    reste_a_enregistrer = operation.montant_total - total_echeances_tout
-    reste_a_enregistrer_abs = abs(reste_a_enregistrer)
-
-    if reste_a_enregistrer > 0:
-        max_paiement = reste_a_enregistrer
-    else:
-        max_paiement = operation.montant_total
+    # Calculs financiers : montant_total stocké, échéances préchargées
+    totaux = totaux_paiements(operation.montant_total, operation.totaux_echeances())
 
     # Préparer les données pour JavaScript (MODIFIÉ pour devis)
     lignes_json = json.dumps([])  # Vide car maintenant dans les devis
@@ -2181,7 +1369,7 @@ def operation_detail(request, operation_id):
     ])
     
     # ✅ Compter les passages non réalisés (pour la confirmation JS)
-    passages_non_realises = operation.passages.filter(realise=False).count()
+    passages_non_realises = sum(1 for passage in operation.passages.all() if not passage.realise)
     
     context = {
         'operation': operation,
@@ -2195,16 +1383,10 @@ def operation_detail(request, operation_id):
         
         # Échéances (inchangé)
         'echeances': echeances,
-        'total_echeances': total_echeances_payees,
-        'total_echeances_prevus': total_echeances_prevus,
-        'total_echeances_tout': total_echeances_tout,
-        'reste_a_payer': reste_a_payer,
-        'reste_a_enregistrer': reste_a_enregistrer,
-        'reste_a_enregistrer_abs': reste_a_enregistrer_abs,
-        'max_paiement': max_paiement,
+        **totaux,
         'historique': historique,
+        'historique_limite': HISTORIQUE_DETAIL,
         'statuts_choices': Operation.STATUTS,
-        'montant_total': operation.montant_total,
         'lignes_json': lignes_json,
         'echeances_json': echeances_json,
         'now': timezone.now(),
@@ -2263,25 +1445,11 @@ def ajax_add_ligne_devis(request, operation_id):
             utilisateur=request.user
         )
         
-        devis.refresh_from_db()
-        
+        # ✅ Totaux ajustés en mémoire par ligne.save() (ligne.devis est devis)
         return JsonResponse({
             'success': True,
-            'ligne': {
-                'id': ligne.id,
-                'description': ligne.description,
-                'quantite': float(ligne.quantite),
-                'unite': ligne.unite,
-                'unite_display': ligne.get_unite_display(),
-                'prix_unitaire_ht': float(ligne.prix_unitaire_ht),
-                'taux_tva': float(ligne.taux_tva),
-                'montant': float(ligne.montant)
-            },
-            'totaux': {
-                'sous_total_ht': float(devis.sous_total_ht),
-                'total_tva': float(devis.total_tva),
-                'total_ttc': float(devis.total_ttc)
-            }
+            'ligne': ligne_json(ligne),
+            'totaux': totaux_json(devis)
         })
         
     except Devis.DoesNotExist:
@@ -2305,7 +1473,7 @@ def ajax_delete_ligne_devis(request, operation_id):
     ligne_id = request.POST.get('ligne_id')
     
     try:
-        ligne = LigneDevis.objects.get(id=ligne_id, devis__operation=operation)
+        ligne = LigneDevis.objects.select_related('devis').get(id=ligne_id, devis__operation=operation)
         devis = ligne.devis
         
         if devis.est_verrouille:
@@ -2320,15 +1488,10 @@ def ajax_delete_ligne_devis(request, operation_id):
             utilisateur=request.user
         )
         
-        devis.refresh_from_db()
-        
+        # ✅ Totaux ajustés en mémoire par ligne.delete()
         return JsonResponse({
             'success': True,
-            'totaux': {
-                'sous_total_ht': float(devis.sous_total_ht),
-                'total_tva': float(devis.total_tva),
-                'total_ttc': float(devis.total_ttc)
-            }
+            'totaux': totaux_json(devis)
         })
         
     except LigneDevis.DoesNotExist:
@@ -2337,6 +1500,104 @@ def ajax_delete_ligne_devis(request, operation_id):
         return JsonResponse({'success': False, 'error': str(e)}, status=500)
 
 
+@login_required
+def ajax_lignes_devis_lot(request, operation_id):
+    """
+    Vue AJAX : créations, modifications, suppressions et déplacements de
+    lignes d'un devis en un seul envoi (voir core/lignes_devis.py).
+    Corps JSON : {"devis_id": ..., "operations": [...]}
+    """
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'Méthode non autorisée'}, status=405)
+    
+    if not request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        return JsonResponse({'success': False, 'error': 'Requête non AJAX'}, status=400)
+    
+    operation = get_object_or_404(Operation, id=operation_id, user=request.user)
+    
+    try:
+        donnees = json.loads(request.body)
+    except (ValueError, UnicodeDecodeError):
+        return JsonResponse({'success': False, 'error': 'JSON invalide'}, status=400)
+    if not isinstance(donnees, dict):
+        return JsonResponse({'success': False, 'error': 'JSON invalide'}, status=400)
+    
+    try:
+        devis, lignes = appliquer_lot(operation, donnees.get('devis_id'), donnees.get('operations'), request.user)
+    except LignesDevisError as e:
+        return JsonResponse({'success': False, 'error': e.message}, status=e.statut)
+    
+    return JsonResponse({
+        'success': True,
+        'lignes': [ligne_json(ligne) for ligne in lignes],
+        'totaux': totaux_json(devis),
+    })
+
+
+@login_required
+def ajax_action_operation(request, operation_id):
+    """
+    Vue AJAX des actions courantes de la fiche (ACTIONS_OPERATION) : même
+    traitement que le POST de operation_detail, mais la réponse ne contient
+    que ce qui change (statut, totaux, nouvelles lignes d'historique, carte
+    du devis ou ligne de paiement) au lieu de reconstruire toute la fiche.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'Méthode non autorisée'}, status=405)
+    
+    if not request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        return JsonResponse({'success': False, 'error': 'Requête non AJAX'}, status=400)
+    
+    operation = get_object_or_404(Operation, id=operation_id, user=request.user)
+    action = ACTIONS_OPERATION.get(request.POST.get('action'))
+    if action is None:
+        return JsonResponse({'success': False, 'error': 'Action inconnue'}, status=400)
+    
+    try:
+        resultat = action(operation, request.user, request.POST)
+    except ActionOperationError as e:
+        return JsonResponse({'success': False, 'error': e.message}, status=e.statut)
+    
+    # Totaux depuis l'état financier stocké, tenu à jour en mémoire par l'action
+    totaux = totaux_paiements(operation.montant_total, totaux_stockes(operation))
+    contexte = {'operation': operation, 'now': timezone.now(), **totaux}
+    
+    reponse = {
+        'success': True,
+        'niveau': resultat['niveau'],
+        'message': resultat['message'],
+        'statut': {'code': operation.statut, 'libelle': operation.get_statut_display()},
+        'totaux': {cle: float(valeur) for cle, valeur in totaux.items()},
+        'recap_html': render_to_string('operations/_recap_paiements.html', contexte, request=request),
+        'historique': [
+            {'date': timezone.localtime(entree.date).strftime('%d/%m %H:%M'), 'action': entree.action}
+            # Entrées écrites par cette action (facture automatique comprise), plus récente d'abord
+            for entree in reversed(resultat['historique'])
+        ],
+    }
+    
+    devis = resultat.get('devis')
+    if devis is not None:
+        devis.lignes_list = devis.lignes.all()
+        reponse['devis'] = {
+            'id': devis.id,
+            'statut': devis.statut,
+            'html': render_to_string('operations/_devis.html', {'devis': devis, **contexte}, request=request),
+        }
+    
+    echeance = resultat.get('echeance')
+    if echeance is not None:
+        reponse['echeance'] = {
+            'id': echeance.id,
+            'paye': echeance.paye,
+            'html': render_to_string(
+                'operations/_ligne_echeance.html', {'echeance': echeance, **contexte}, request=request
+            ),
+        }
+    
+    return JsonResponse(reponse)
+
+
 @login_required
 def operation_delete(request, operation_id):
     """Suppression d'une opération avec ses données liées"""
@@ -2403,51 +1664,26 @@ def operation_duplicate(request, operation_id):
 def clients_list(request):
     """Page de gestion des clients avec recherche et opérations"""
     try:
-        # Récupérer tous les clients de l'utilisateur avec prefetch des opérations
-        clients = Client.objects.filter(user=request.user).prefetch_related('operations')
+        clients = Client.objects.filter(user=request.user)
         
         # Recherche
         recherche = request.GET.get('recherche', '')
         
         if recherche:
-            clients = clients.filter(
-                Q(nom__icontains=recherche) |
-                Q(prenom__icontains=recherche) |
-                Q(email__icontains=recherche) |
-                Q(telephone__icontains=recherche) |
-                Q(ville__icontains=recherche) |
-                Q(adresse__icontains=recherche)
-            )
-        
-        # Tri par nom par défaut
-        clients = clients.order_by('nom', 'prenom')
+            clients = rechercher_clients(clients, recherche)
         
-        # Enrichir les clients avec les données d'opérations
-        clients_enrichis = []
-        for client in clients:
-            operations = client.operations.all().order_by('-date_creation')
-            
-            # Dernière opération
-            derniere_operation = operations.first() if operations.exists() else None
-            
-            # Prochaine opération (statut planifié + date future)
-            from django.utils import timezone
-            prochaines_operations = Operation.objects.filter(
-                user=request.user,
-                date_prevue__isnull=False,
-                date_prevue__gte=timezone.now()  # ← Seulement les futures
-            ).exclude(statut__in=['paye', 'annule']).select_related('client').order_by('date_prevue')[:5]
-            
-            client.derniere_op = derniere_operation
-            client.prochaine_op = None
-            clients_enrichis.append(client)
+        # Tri par nom par défaut (index client_user_nom_idx), départagé par l'id
+        clients = clients.order_by('nom', 'prenom', 'pk')
         
-        # Statistiques
-        total_clients = len(clients_enrichis)
+        # ✅ Dernière / prochaine opération, nombre d'opérations et CA en
+        # sous-requêtes : une requête par page au lieu de plusieurs par client
+        paginator = Paginator(annoter_clients(clients), TAILLE_PAGE)
+        page_obj = paginator.get_page(request.GET.get('page'))
         
         context = {
-            'clients': clients_enrichis,
-            'total_clients': total_clients,
+            'clients': page_obj.object_list,
+            'page_obj': page_obj if paginator.num_pages > 1 else None,
+            'total_clients': paginator.count,
             'recherche': recherche,
         }
         
@@ -2456,6 +1692,37 @@ def clients_list(request):
     except Exception as e:
         return HttpResponse(f"Erreur clients: {str(e)}")
 
+@login_required
+@require_GET
+def clients_suggestions(request):
+    """
+    API JSON de la saisie semi-automatique des clients (formulaire de
+    création d'opération) : ?q= début du nom, du prénom, de la ville ou du
+    téléphone, ?limite= nombre de résultats (au plus SUGGESTIONS_MAX).
+    """
+    try:
+        limite = min(max(int(request.GET.get('limite', SUGGESTIONS_DEFAUT)), 1), SUGGESTIONS_MAX)
+    except ValueError:
+        limite = SUGGESTIONS_DEFAUT
+    
+    clients = suggerer_clients(
+        Client.objects.filter(user=request.user).only(*CHAMPS_CLIENT_SUGGESTION),
+        request.GET.get('q', ''),
+        limite
+    )
+    
+    return JsonResponse({
+        'success': True,
+        'clients': [
+            {
+                'id': client.pk,
+                'libelle': libelle_client(client),
+                'telephone': client.telephone,
+            }
+            for client in clients
+        ],
+    })
+
 @login_required
 def client_detail(request, client_id):
     """Fiche détaillée d'un client avec historique des opérations"""
@@ -2496,19 +1763,19 @@ def client_detail(request, client_id):
                 
                 return redirect('client_detail', client_id=client.id)
         
-        # Récupérer toutes les opérations du client
-        operations = client.operations.all().order_by('-date_creation')
+        # ✅ Opérations du client avec leur solde, colonnes affichées seulement
+        operations = annoter_soldes(
+            client.operations.only(*CHAMPS_OPERATION_CLIENT).order_by('-date_creation')
+        )
         
-        # Statistiques du client
-        nb_operations = operations.count()
-        ca_total = sum(op.montant_total for op in operations if op.statut == 'paye')
+        # ✅ Statistiques du client : une seule agrégation
+        totaux = calculer_totaux_client(client)
         
         context = {
             'client': client,
             'operations': operations,
-            'nb_operations': nb_operations,
-            'ca_total': ca_total,
             'statuts_choices': Operation.STATUTS,
+            **totaux,
         }
         
         return render(request, 'clients/detail.html', context)
@@ -2516,6 +1783,36 @@ def client_detail(request, client_id):
     except Exception as e:
         return HttpResponse(f"Erreur client detail: {str(e)}")
 
+def libelle_client(client):
+    """Libellé d'un client dans le formulaire de création d'opération"""
+    return f"{client.nom} {client.prenom} - {client.ville}"
+
+
+def contexte_creation_operation(request):
+    """
+    Contexte du formulaire de création d'opération. La liste des clients
+    n'est jamais rendue (saisie semi-automatique, voir clients_suggestions) :
+    seul le client déjà choisi (?client= ou formulaire renvoyé) est chargé.
+    """
+    # Exclure 'devis_refuse' du formulaire de création
+    statuts_disponibles = [
+        (value, label) 
+        for value, label in Operation.STATUTS 
+        if value != 'devis_refuse' and value != 'en_attente_devis'
+    ]
+    
+    client_choisi = None
+    client_id = request.POST.get('client_id') or request.GET.get('client')
+    if client_id and client_id.isdigit():
+        client_choisi = Client.objects.filter(user=request.user, pk=client_id).only(*CHAMPS_CLIENT_SUGGESTION).first()
+    
+    return {
+        'statuts_choices': statuts_disponibles,
+        'client_choisi': client_choisi,
+        'client_choisi_libelle': libelle_client(client_choisi) if client_choisi else '',
+    }
+
+
 @login_required
 def operation_create(request):
     """Formulaire de création d'une nouvelle opération (Parcours A ou B)"""
@@ -2566,8 +1863,7 @@ def operation_create(request):
                 if not (nom and prenom and telephone):
                     print("✗ ERREUR: Champs obligatoires manquants")
                     messages.error(request, "⚠️ Nom, prénom et téléphone sont obligatoires pour un nouveau client")
-                    clients = Client.objects.filter(user=request.user).order_by('nom', 'prenom')
-                    return render(request, 'operations/create.html', {'clients': clients})
+                    return render(request, 'operations/create.html', contexte_creation_operation(request))
                 
                 client = Client.objects.create(
                     user=request.user,
@@ -2597,8 +1893,7 @@ def operation_create(request):
             if not type_prestation:
                 print("✗ ERREUR: Type de prestation manquant")
                 messages.error(request, "⚠️ Le type de prestation est obligatoire")
-                clients = Client.objects.filter(user=request.user).order_by('nom', 'prenom')
-                return render(request, 'operations/create.html', {'clients': clients})
+                return render(request, 'operations/create.html', contexte_creation_operation(request))
             
             # Adresse par défaut = adresse client
             adresse_finale = adresse_intervention or f"{client.adresse}, {client.ville}"
@@ -2734,8 +2029,7 @@ def operation_create(request):
                     except ValueError as e:
                         print(f"✗ Erreur conversion date: {e}")
                         messages.error(request, f"⚠️ Format de date invalide: {e}")
-                        clients = Client.objects.filter(user=request.user).order_by('nom', 'prenom')
-                        return render(request, 'operations/create.html', {'clients': clients})
+                        return render(request, 'operations/create.html', contexte_creation_operation(request))
                 
                 # Création opération
                 print(f"\n{'─'*80}")
@@ -2900,27 +2194,12 @@ def operation_create(request):
             print(f"{'='*80}\n")
             
             messages.error(request, f"❌ Erreur lors de la création : {str(e)}")
-            clients = Client.objects.filter(user=request.user).order_by('nom', 'prenom')
-            return render(request, 'operations/create.html', {'clients': clients})
+            return render(request, 'operations/create.html', contexte_creation_operation(request))
     
     # ========================================
     # GET - AFFICHAGE FORMULAIRE
     # ========================================
-    clients = Client.objects.filter(user=request.user).order_by('nom', 'prenom')
-    
-    # Exclure 'devis_refuse' du formulaire de création
-    statuts_disponibles = [
-        (value, label) 
-        for value, label in Operation.STATUTS 
-        if value != 'devis_refuse' and value != 'en_attente_devis'
-    ]
-    
-    context = {
-        'clients': clients,
-        'statuts_choices': statuts_disponibles,
-    }
-    
-    return render(request, 'operations/create.html', context)
+    return render(request, 'operations/create.html', contexte_creation_operation(request))
 
 
 @login_required